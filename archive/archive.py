@@ -1,8 +1,18 @@
 import collections
 import itertools
-
-from jinja2 import Environment, PackageLoader
-
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+
+import explain
+import graph
+import history
+import schedule
+from cache import RenderCache
+from executor import Executor, Job, plan
+from hive import Hive
+from query import Created
+from state import Estimates, Plans
 from workflow import DDLWorkflow, DMLWorkflow, Utilities
 
 
@@ -13,13 +23,62 @@ class Archive(DDLWorkflow, DMLWorkflow, Utilities):
     def __init__(self, package, hive, templates='templates'):
         self.package = package
         self.templates = templates
-        self.env = Environment(loader=PackageLoader(
-            self.package,
-            self.templates
-        ))
+        self.env = self._environment()
+        self.render_cache = RenderCache(self.env)
 
         self.hive = hive
         self.queries = collections.OrderedDict()
+        self.plans = Plans()
+        self.estimates = Estimates(plans=self.plans)
+        self.history = None
+
+        # DAG indexes, maintained as queries are added.  Queries may only be
+        # added after their inputs, so insertion order is a topological order.
+        self.nodes = set()
+        self.order = []
+        self.upstream = {}
+        self.downstream = collections.defaultdict(list)
+        self.writers = collections.defaultdict(list)
+
+    def _environment(self):
+        return Environment(loader=PackageLoader(self.package, self.templates))
+
+    def __getstate__(self):
+        '''
+        Archives are pickled into snapshots without their template environment,
+        backend or command line arguments.
+        '''
+        state = self.__dict__.copy()
+        for key in ('env', 'hive', 'args'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.env = self._environment()
+        self.render_cache.env = self.env
+        self.hive = Hive()
+
+    def cache_templates(self, directory):
+        '''
+        Persists compiled templates to the given directory, so later processes
+        load bytecode rather than compiling each template from source.  Jinja
+        checksums each template's source, so stale entries are recompiled
+        automatically.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    def compile_templates(self):
+        '''
+        Compiles every template in the Archive's template package, populating
+        the template cache if there is one.
+        '''
+        names = list(self.env.list_templates(extensions=['sql']))
+        for name in names:
+            self.env.get_template(name)
+        return names
 
     def optimize(self, **kwargs):
         self.stats = {
@@ -46,8 +105,136 @@ class Archive(DDLWorkflow, DMLWorkflow, Utilities):
             self.stats['queries']['unique_queries']
         )
         self.stats['archive'].pop('current_depth', None)
+
+        self.stats['materialized'] = self._materialize(**kwargs)
         return self.stats
 
+    def _materialize(self, **kwargs):
+        '''
+        Decides which ViewUntilTables to materialize, from the references
+        counted by optimize, which count each relation once plus once per
+        query reading it, and the depth of the views stacked in each.  Inputs
+        are decided first, so views atop materialized ones are shallower.
+        '''
+        threshold = kwargs.get('threshold', 2)
+        references = self.stats['queries']['references']
+
+        depths = {}
+        materialized = []
+        for query in self.order:
+            if not hasattr(query, 'view_or_table'):
+                continue
+
+            depth = 1 + max(
+                [0] + [depths.get(i.name, 0) for i in query.inputs]
+            )
+            if hasattr(query, '_optimize') and query._optimize(
+                references.get(query.name, 1) - 1,
+                depth,
+                threshold,
+                self.plan(query)
+            ):
+                materialized.append(query.name)
+
+            if query.view_or_table == 'VIEW':
+                depths[query.name] = depth
+        return materialized
+
+    def plan(self, query):
+        '''
+        The query's cached EXPLAIN plan, if it has been explained as it is.
+        '''
+        if not self.plans:
+            return None
+        hql = query.explain_hql()
+        return self.plans.get(hql) if hql else None
+
+    def explained(self):
+        '''
+        The cached plans of the Archive's queries, by name.
+        '''
+        plans = {}
+        for query in self.order:
+            plan = self.plan(query)
+            if plan is not None:
+                plans[query.name] = plan
+        return plans
+
+    def explain(self, **kwargs):
+        '''
+        Runs EXPLAIN for each query, or the given queries, that does work and
+        hasn't been explained as it is, caching the parsed plans.  Returns the
+        plans explained.
+        '''
+        explained = {}
+        for query in kwargs.get('queries') or self.order:
+            hql = query.explain_hql()
+            if not hql or self.plans.get(hql) is not None:
+                continue
+
+            text = self.hive.explain(hql)
+            if text is None:
+                continue
+            explained[query.name] = explain.parse(text)
+            self.plans.put(hql, explained[query.name])
+            self.plans.save()
+        return explained
+
+    def critical_path(self):
+        '''
+        The Archive's longest chain of estimated work, building relations and
+        running statements alike.
+        '''
+        queries, duration = schedule.critical_path(self, self.estimates)
+        return {
+            'queries': queries,
+            'duration': duration,
+        }
+
+    def _executor(self, include, **kwargs):
+        '''
+        An Executor for the given options.  Running in parallel, ready queries
+        are ranked by their remaining critical path, counting only the
+        queries for which include is true; serially, they run in plan order.
+        '''
+        parallelism = kwargs.get('parallelism', 1)
+        rank = None
+        if parallelism > 1:
+            rank = schedule.rank(self, self.estimates, include)
+
+        checkpoint = kwargs.get('checkpoint')
+        return Executor(
+            self.hive,
+            parallelism,
+            kwargs.get('batch_size', 1),
+            rank=rank,
+            estimate=lambda job: self.estimates.estimate(job.query),
+            record=checkpoint.record if checkpoint is not None else None
+        )
+
+    def _record(self, run_id, command, jobs, checkpoint=None):
+        '''
+        Records the durations of submitted Jobs, for estimates and history,
+        and those that succeeded in the given Checkpoint.
+        '''
+        if checkpoint is not None:
+            for job in jobs:
+                checkpoint.record(job)
+
+        for job in jobs:
+            if job.succeeded:
+                self.estimates.record(job.name, job.duration)
+        self.estimates.save()
+
+        if self.history is not None:
+            self.history.record(
+                run_id,
+                command,
+                jobs,
+                self.hive,
+                getattr(self.hive.args, 'label', None)
+            )
+
     def lookup(self, query_name):
         return self.queries[query_name]
 
@@ -61,11 +248,26 @@ class Archive(DDLWorkflow, DMLWorkflow, Utilities):
         self.validate(query)
 
         self.queries[query.name] = query
+        self._index(query)
         query.archive = self
 
         return query
 
+    def _index(self, query):
+        self.nodes.add(query)
+        self.order.append(query)
+        self.upstream[query.name] = list(query.inputs)
+        for i in query.inputs:
+            self.downstream[i.name].append(query)
+
+        if hasattr(query, 'external_table'):
+            self.writers[query.external_table.name].append(query)
+
     def validate(self, query):
+        '''
+        Checks that a query's inputs have been archived.  Their own inputs were
+        checked when they were added, so only direct inputs are validated.
+        '''
         for i in query.inputs:
             self._validate(i)
 
@@ -74,13 +276,10 @@ class Archive(DDLWorkflow, DMLWorkflow, Utilities):
             raise RuntimeError((
                 "Query '%s' not in Archive; did you forget to add it?\n"
                 'Currently archived: %s' % (
-                    query.name, self.queries
+                    query.name, self.queries.keys()
                 )
             ))
 
-        for i in query.inputs:
-            self._validate(i)
-
     def show(self):
         context = {
             'tables': [],
@@ -123,20 +322,57 @@ Statements:
         ).strip(), context
 
     def graph(self, **kwargs):
-        context = {
-            'offset': 0,
-            'references': {},
-        }
-
-        graph_str = 'Archive: %s' % self.package
-        for r in self.queries.values():
-            graph_str += '\n%s' % r._graph(context, **kwargs)
-
-        return graph_str
+        return str.join('\n', self.graph_lines(**kwargs))
+
+    def graph_lines(self, **kwargs):
+        '''
+        Generates the lines of the graph of the Archive, of the given queries
+        or of a selection of queries, in the given format; see graph.  Text
+        graphs are trees of each query and its inputs; DOT and JSON graphs
+        include everything upstream of the given queries, but only the
+        selected queries of a selection.
+        '''
+        graph_format = kwargs.get('format', 'text')
+        queries = kwargs.get('queries')
+        selection = kwargs.get('selection')
+        if graph_format == 'text':
+            if queries is None:
+                yield 'Archive: %s' % self.package
+                queries = self._queries(queries=selection)
+            for line in graph.text(queries):
+                yield line
+            return
+
+        if queries is not None:
+            queries = graph.upstream(queries)
+        else:
+            queries = self._queries(queries=selection)
+        if graph_format == 'dot':
+            lines = graph.dot(self.package, queries)
+        elif graph_format == 'json':
+            lines = graph.json_lines(self.package, queries)
+        else:
+            raise ValueError('Unrecognized graph format %s' % graph_format)
+
+        for line in lines:
+            yield line
 
     def drop_all(self):
         return self.hive.run_sync(self.drop_all_hql())
 
+    def drop(self, **kwargs):
+        return self.hive.run_sync(self.drop_hql(**kwargs))
+
+    def drop_hql(self, **kwargs):
+        '''
+        Drops every relation, or the given relations, readers before the
+        relations they read.
+        '''
+        return str.join('\n', [
+            query.drop_hql() for query in reversed(self._queries(**kwargs))
+            if hasattr(query, 'qualified_name')
+        ])
+
     def drop_tables(self):
         return self.hive.run_sync(self.drop_tables_hql())
 
@@ -153,36 +389,226 @@ Statements:
             ['DROP TABLE IF EXISTS %s;' % t.qualified_name() for t in tables]
         )
 
-    def recover_all(self):
-        return self.hive.run_sync(self.recover_all_hql())
-
-    def recover_all_hql(self):
-        # Look for partitioned external tables
-        tables = [
+    def recover_all(self, **kwargs):
+        '''
+        Recovers the partitions of every partitioned external table, running
+        up to parallelism tables' recoveries at a time.  One table failing
+        doesn't stop the others; returns each table's duration and error, if
+        any, in Archive order.
+        '''
+        steps = []
+        last = {}
+        for table in self._partitioned():
+            hql, last[table.name] = table._recovery(**kwargs)
+            if hql:
+                steps.append((table, hql))
+
+        executor = Executor(
+            self.hive,
+            kwargs.get('parallelism', 1),
+            estimate=lambda job: self.estimates.estimate(job.query),
+            keep_going=True
+        )
+        executor.run_all_sync(Job(table, hql) for table, hql in steps)
+
+        recovered = []
+        for job in executor.jobs:
+            if job.succeeded:
+                job.query._recovered(last[job.name], **kwargs)
+            recovered.append({
+                'table': job.query.qualified_name(),
+                'duration': job.duration,
+                'error': job.error,
+            })
+        return recovered
+
+    def recover_all_hql(self, **kwargs):
+        # Recover partitioned external tables
+        return str.join('\n', [
+            hql for hql in [
+                t.recover_partitions_hql(**kwargs)
+                for t in self._partitioned()
+            ]
+            if hql
+        ])
+
+    def _partitioned(self):
+        return [
             t for t in self.queries.values()
             if hasattr(t, 'partitioned') and t.partitioned
         ]
 
-        # Recover them
-        return str.join('\n', [t.recover_partitions_hql() for t in tables])
-
-    def build(self):
-        return self.hive.run_all_sync(self.build_hql())
-
-    def build_hql(self):
-        return self._create_all_hql()
+    def keys(self):
+        '''
+        Merkle-style keys for every relation, hashing its DDL together with the
+        keys of its inputs, so that a relation's key changes whenever it or
+        anything upstream of it changes.
+        '''
+        keys = {}
+        for query in self.order:
+            if hasattr(query, '_key'):
+                keys[query.name] = query._key(keys)
+        return keys
+
+    def build(self, **kwargs):
+        return list(self.build_iter(**kwargs))
+
+    def build_iter(self, **kwargs):
+        '''
+        Builds the Archive, or the given relations, yielding results as
+        queries finish.  Given a BuildState as state, the build is
+        incremental; given one as built, only the kinds of relations built
+        are kept, so that a ViewUntilTable's view is replaced by its table or
+        the reverse.
+        '''
+        state = kwargs.get('state')
+        built = kwargs.get('built', state)
+        keys = self.keys() if state is not None else None
+        checkpoint = kwargs.get('checkpoint')
+        run_id = self._run_id(**kwargs)
+
+        executor = self._executor(
+            lambda query: hasattr(query, 'qualified_name'),
+            **kwargs
+        )
+        try:
+            for result in executor.run_all_iter(plan(self._build_steps(
+                state=state,
+                built=built,
+                keys=keys,
+                checkpoint=checkpoint,
+                queries=kwargs.get('queries')
+            ))):
+                yield result
+        finally:
+            self._record(run_id, 'build', executor.jobs, checkpoint)
+            if built is not None:
+                for job in executor.jobs:
+                    if not job.succeeded:
+                        continue
+                    if state is not None:
+                        state.keys[job.name] = keys[job.name]
+                    if hasattr(job.query, 'view_or_table'):
+                        built.kinds[job.name] = job.query.view_or_table
+                built.save()
+
+    def build_hql(self, **kwargs):
+        return (hql for _, hql in self._build_steps(**kwargs))
+
+    def _build_steps(self, **kwargs):
+        '''
+        Given the BuildState of previous builds, only relations whose keys have
+        changed since are rebuilt, and they are dropped first.  Given one as
+        built, relations last built as another kind are dropped first.  Given
+        the Checkpoint of a failed build, relations it completed are skipped.
+        '''
+        steps = self._create_all_steps(queries=kwargs.get('queries'))
+
+        state = kwargs.get('state')
+        built = kwargs.get('built', state)
+        kinds = built.kinds if built is not None else {}
+        if state is not None:
+            keys = kwargs.get('keys') or self.keys()
+            steps = (
+                (query, '%s\n%s' % (self._drop_built_hql(query, kinds), hql))
+                for query, hql in steps
+                if keys[query.name] != state.keys.get(query.name)
+            )
+        else:
+            steps = self._replaced(steps, kinds)
+
+        return self._resumed(steps, **kwargs)
+
+    def _replaced(self, steps, kinds):
+        for query, hql in steps:
+            kind = kinds.get(query.name)
+            if kind is not None and \
+                    kind != getattr(query, 'view_or_table', kind):
+                hql = '%s\n%s' % (self._drop_built_hql(query, kinds), hql)
+            yield query, hql
+
+    def _drop_built_hql(self, query, kinds):
+        '''
+        Drops a relation as it was last built, since a ViewUntilTable may
+        since have changed between a view and a table.
+        '''
+        kind = kinds.get(query.name)
+        if kind is None or not hasattr(query, 'view_or_table'):
+            return query.drop_hql()
+        return 'DROP %s IF EXISTS %s;' % (kind, query.qualified_name())
+
+    def _resumed(self, steps, **kwargs):
+        checkpoint = kwargs.get('checkpoint')
+        if checkpoint is None:
+            return steps
+        return checkpoint.remaining(steps)
+
+    def _queries(self, **kwargs):
+        queries = kwargs.get('queries')
+        return self.order if queries is None else queries
+
+    def _run_id(self, **kwargs):
+        checkpoint = kwargs.get('checkpoint')
+        if checkpoint is not None:
+            return checkpoint.run_id
+        return kwargs.get('run_id') or history.run_id()
 
     def _create_all_hql(self, **kwargs):
-        created = []
-        return list(itertools.chain(*[
-            query._create_sub_hql(created, **kwargs)
-            for query in self.queries.values()
-        ]))
-
-    def run(self):
-        return self.hive.run_all_sync(self.run_hql())
-
-    def run_hql(self):
-        return list(itertools.chain(*[
-            query.run_hql() for query in self.queries.values()
-        ]))
+        return (hql for _, hql in self._create_all_steps(**kwargs))
+
+    def _create_all_steps(self, **kwargs):
+        '''
+        Steps creating every relation, or only the given relations, creating
+        their databases as needed.
+        '''
+        created = Created()
+        queries = kwargs.pop('queries', None)
+        if queries is not None:
+            return self._create_steps(queries, created)
+
+        return itertools.chain.from_iterable(
+            query._create_sub_steps(created, **kwargs)
+            for query in self.order
+        )
+
+    def _create_steps(self, queries, created):
+        for query in queries:
+            if hasattr(query, 'qualified_name'):
+                yield query, query._create_hql(created)
+                created.add(query)
+
+    def run(self, **kwargs):
+        return list(self.run_iter(**kwargs))
+
+    def run_iter(self, **kwargs):
+        '''
+        Runs the Archive's statements, or the given statements, yielding
+        results as they finish.
+        '''
+        checkpoint = kwargs.get('checkpoint')
+        run_id = self._run_id(**kwargs)
+        executor = self._executor(
+            lambda query: not hasattr(query, 'qualified_name'),
+            parallelism=kwargs.get('parallelism', 1),
+            checkpoint=checkpoint
+        )
+        try:
+            for result in executor.run_all_iter(
+                plan(self._run_steps(
+                    checkpoint=checkpoint,
+                    queries=kwargs.get('queries')
+                ))
+            ):
+                yield result
+        finally:
+            self._record(run_id, 'run', executor.jobs, checkpoint)
+
+    def run_hql(self, **kwargs):
+        return (hql for _, hql in self._run_steps(**kwargs))
+
+    def _run_steps(self, **kwargs):
+        return self._resumed((
+            (query, hql)
+            for query in self._queries(**kwargs)
+            for hql in query.run_hql()
+        ), **kwargs)
@@ -0,0 +1,180 @@
+'''
+Backfills of partitioned external tables.  Rather than re-processing a whole
+range of partitions with one dynamic-partition InsertOverwrite, a backfill
+splits the range into chunks of a few partitions each and runs a separate
+InsertOverwrite per chunk, concurrently and with retries.
+
+Templates opt in by filtering on the backfill variable, which is only defined
+while rendering a chunk:
+
+    FROM
+      {{inputs.events}}
+    {%- if backfill %}
+    WHERE {{ backfill.where('event') }}
+    {%- endif %}
+
+Dynamic partition inserts only overwrite the partitions they write, so each
+chunk replaces just its own partitions.
+'''
+
+import datetime
+import logging
+import time
+
+from jinja2 import meta
+
+import partitions
+from executor import Executor, Job
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def supports(query):
+    '''
+    Whether a query's template refers to the backfill variable.
+    '''
+    env = query.archive.env
+    source = env.loader.get_source(env, query.template)[0]
+    return 'backfill' in meta.find_undeclared_variables(env.parse(source))
+
+
+def check(statement):
+    '''
+    Raises ValueError unless the statement can be backfilled in chunks.
+    '''
+    if not supports(statement):
+        raise ValueError(
+            "%s's template doesn't use the backfill variable" % statement.name
+        )
+
+
+def values(start, end):
+    '''
+    The partition values from start to end, inclusive: days, if both are
+    dates like 2014-01-31, or else integers.
+    '''
+    try:
+        first = datetime.datetime.strptime(start, DATE_FORMAT).date()
+        last = datetime.datetime.strptime(end, DATE_FORMAT).date()
+        return [
+            (first + datetime.timedelta(days=i)).strftime(DATE_FORMAT)
+            for i in range((last - first).days + 1)
+        ]
+    except ValueError:
+        pass
+
+    try:
+        return [str(i) for i in range(int(start), int(end) + 1)]
+    except ValueError:
+        raise ValueError(
+            'Partition range %s to %s is neither dates nor integers' % (
+                start, end
+            )
+        )
+
+
+class Chunk(object):
+    '''
+    The partitions of one backfill chunk, as the backfill variable seen by
+    templates.
+    '''
+    def __init__(self, column, values):
+        self.column = column
+        self.values = values
+
+    @property
+    def start(self):
+        return self.values[0]
+
+    @property
+    def end(self):
+        return self.values[-1]
+
+    def where(self, expression=None):
+        '''
+        A predicate restricting the given expression, by default the partition
+        column, to the chunk's partition values.
+        '''
+        return '%s IN (%s)' % (
+            expression or self.column,
+            str.join(', ', [
+                "'%s'" % v.replace("'", "\\'") for v in self.values
+            ])
+        )
+
+    def __str__(self):
+        if len(self.values) == 1:
+            return '%s=%s' % (self.column, self.start)
+        return '%s=%s..%s' % (self.column, self.start, self.end)
+
+
+def chunks(statement, values, chunk_size=1, column=None):
+    '''
+    Splits the given partition values into Chunks of the given size, for the
+    given partition column or else the first of the statement's table.
+    '''
+    if column is None:
+        columns = partitions.columns(statement.external_table.hql())
+        if not columns:
+            raise ValueError(
+                '%s is not partitioned' % statement.external_table
+            )
+        column = columns[0]
+
+    chunk_size = max(1, chunk_size)
+    return [
+        Chunk(column, values[i:i + chunk_size])
+        for i in range(0, len(values), chunk_size)
+    ]
+
+
+def backfill(statement, chunks, parallelism=1, retries=0):
+    '''
+    Runs the statement once per Chunk, up to parallelism at a time, retrying
+    each failed chunk up to retries times.  One chunk failing doesn't stop the
+    others.  Returns a summary of the backfill.
+    '''
+    check(statement)
+
+    executor = Executor(
+        statement.archive.hive,
+        parallelism,
+        keep_going=True,
+        retries=retries
+    )
+    jobs = [
+        (chunk, Job(statement, statement.backfill_hql(chunk)))
+        for chunk in chunks
+    ]
+
+    start = time.time()
+    done = 0
+    for _ in executor.run_all_iter(job for _, job in jobs):
+        done += 1
+        logger.info('Backfilled %s of %s chunks of %s' % (
+            done,
+            len(jobs),
+            statement.name
+        ))
+    elapsed = time.time() - start
+
+    return summary([
+        (chunk, job) for chunk, job in jobs if job.attempts
+    ], len(jobs), elapsed)
+
+
+def summary(jobs, total, elapsed):
+    succeeded = [chunk for chunk, job in jobs if job.succeeded]
+    failed = [chunk for chunk, job in jobs if not job.succeeded]
+    written = sum([len(chunk.values) for chunk in succeeded])
+    return {
+        'chunks': total,
+        'succeeded': len(succeeded),
+        'failed': [str(chunk) for chunk in failed],
+        'retries': sum([job.attempts - 1 for _, job in jobs]),
+        'partitions': written,
+        'elapsed': elapsed,
+        'partitions_per_hour': written * 3600.0 / elapsed if elapsed else None,
+    }
@@ -0,0 +1,100 @@
+'''
+Caching of rendered query templates.
+'''
+
+import hashlib
+import os
+
+
+def _digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class _Entry(object):
+    def __init__(self, hql, filename):
+        # Templates from loaders other than the filesystem have no file, or
+        # a placeholder like '<template>'
+        if filename and not os.path.isfile(filename):
+            filename = None
+
+        self.hql = hql
+        self.filename = filename
+        self.mtime = None
+        self.digest = None
+        if filename:
+            self.mtime = os.path.getmtime(filename)
+            self.digest = _digest(filename)
+
+    def fresh(self):
+        '''
+        An entry is fresh if its template file is unmodified.  A changed
+        modification time alone (e.g. a checkout that touched the file) is not
+        a modification unless the file's content changed too.
+        '''
+        if not self.filename:
+            return True
+
+        try:
+            mtime = os.path.getmtime(self.filename)
+            if mtime == self.mtime:
+                return True
+
+            digest = _digest(self.filename)
+        except (IOError, OSError):
+            return False
+
+        if digest == self.digest:
+            self.mtime = mtime
+            return True
+        return False
+
+
+class RenderCache(object):
+    '''
+    Caches each query's rendered HQL, keyed by query name, template and inputs,
+    so a query shared by many downstream queries is rendered only once.
+    '''
+    def __init__(self, env):
+        self.env = env
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, query, **context):
+        '''
+        Renders a query's template.  Renders given extra context, e.g. that of
+        a backfill chunk, aren't cached.
+        '''
+        inputs = dict([(i.name, i.qualified_name()) for i in query.inputs])
+        if context:
+            template = self.env.get_template(query.template)
+            return template.render(inputs=inputs, **context)
+
+        key = (query.name, query.template, tuple(sorted(inputs.items())))
+
+        entry = self.entries.get(key)
+        if entry is not None and entry.fresh():
+            self.hits += 1
+            return entry.hql
+
+        self.misses += 1
+        template = self.env.get_template(query.template)
+        entry = _Entry(template.render(inputs=inputs), template.filename)
+        self.entries[key] = entry
+        return entry.hql
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('env', None)
+        return state
+
+    def clear(self):
+        self.entries = {}
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -1,5 +1,19 @@
 import argparse
 import importlib
+import logging
+import os
+import sys
+
+import backfill
+import graph
+import history
+import selector
+import snapshot
+import tracing
+from history import History
+from state import BuildState, Checkpoint, Estimates, Plans, Watermarks
+
+logger = logging.getLogger(__name__)
 
 
 class Command(object):
@@ -9,24 +23,119 @@ class Command(object):
             required=True,
             help='name of your archive module, in the form "my.package.module"'
         )
-        self.parser.add_argument(
+        target = self.parser.add_mutually_exclusive_group()
+        target.add_argument(
             '-q', '--query',
             default=None,
             help='name of target query (optional)'
         )
+        target.add_argument(
+            '-S', '--select',
+            dest='select',
+            default=None,
+            help=(
+                'target queries, e.g. "+name" for name and everything '
+                'upstream, "name+" for everything downstream, "db.*", or '
+                'comma-separated unions with "-" exclusions (optional)'
+            )
+        )
+        self.parser.add_argument(
+            '-t', '--template-cache',
+            dest='template_cache',
+            default=os.environ.get('ARCHIVE_TEMPLATE_CACHE'),
+            help='directory in which to cache compiled templates (optional)'
+        )
+        self.parser.add_argument(
+            '-s', '--snapshot',
+            dest='snapshot',
+            default=os.environ.get('ARCHIVE_SNAPSHOT'),
+            help=(
+                'archive snapshot file, loaded by read-only commands while '
+                'it is newer than its sources (optional)'
+            )
+        )
+        self.parser.add_argument(
+            '--state-dir',
+            dest='state_dir',
+            default=os.environ.get('ARCHIVE_STATE_DIR', '.archive'),
+            help='directory in which to keep local state between commands'
+        )
+        self.parser.add_argument(
+            '--trace',
+            dest='trace',
+            default=None,
+            help=(
+                'file to write a Chrome trace of the command to, for '
+                'chrome://tracing or Perfetto (optional)'
+            )
+        )
         self.parser.set_defaults(func=self.run)
 
-    def run(self, args):
+    def read_only(self, args):
+        '''
+        Whether the command only reads the Archive, and so may be served from a
+        snapshot.
+        '''
+        return False
+
+    def load(self, args):
+        if args.snapshot and self.read_only(args) and \
+                snapshot.fresh(args.snapshot, args.archive):
+            archive = snapshot.load(args.snapshot)
+            self.cache_templates(archive, args)
+
+            # Plans may have changed since, and with them what to materialize
+            archive.plans = self.plans(args)
+            archive.optimize()
+            return archive
+
         archive_module = importlib.import_module(args.archive)
         archive = getattr(archive_module, 'archive')
+        archive.plans = self.plans(args)
+
+        # Before optimize and snapshots, which render templates
+        self.cache_templates(archive, args)
+
+        # Make decision on which ViewUntilTables to materialize
+        archive.optimize()
+
+        if args.snapshot:
+            snapshot.save(archive, args.snapshot, args.archive)
+
+        return archive
+
+    def cache_templates(self, archive, args):
+        if args.template_cache:
+            archive.cache_templates(args.template_cache)
+
+    def plans(self, args):
+        return Plans(os.path.join(args.state_dir, 'plans.json'))
+
+    def run(self, args):
+        if not args.trace:
+            return self._run(args)
+
+        tracing.start()
+        try:
+            with tracing.span(self.parser.prog):
+                return self._run(args)
+        finally:
+            tracing.stop().save(args.trace)
+
+    def _run(self, args):
+        with tracing.span('load'):
+            archive = self.load(args)
 
         # Propagate args everywhere
         # TODO: clean this up
         archive.args = args
         archive.hive.args = args
 
-        # Make decision on which ViewUntilTables to materialize
-        archive.optimize()
+        archive.estimates = Estimates(
+            os.path.join(args.state_dir, 'durations.json'),
+            plans=archive.plans
+        )
+        archive.history = History(os.path.join(args.state_dir, 'history.db'))
 
         if args.query:
             try:
@@ -36,18 +145,28 @@ class Command(object):
                 raise ValueError('Unrecognized query %s' % args.query)
 
             self.handle_query(archive, query, args)
+        elif args.select:
+            queries = selector.select(archive, args.select)
+            logger.info('Selected %s queries' % len(queries))
+            self.handle_selection(archive, queries, args)
         else:
             self.handle_archive(archive, args)
 
     def handle_query(self, archive, query, args):
         raise NotImplementedError('Implemented in subclasses')
 
+    def handle_selection(self, archive, queries, args):
+        raise NotImplementedError(
+            '%s is not valid for selections' % self.parser.prog.split()[-1]
+        )
+
     def handle_archive(self, archive, args):
         raise NotImplementedError('Implemented in subclasses')
 
 
 class ArchiveCommand(Command):
-    pass
+    def read_only(self, args):
+        return True
 
 
 class HiveCommand(Command):
@@ -71,6 +190,86 @@ class HiveCommand(Command):
             action='store_true',
             help='print HQL rather than executing query'
         )
+        self.parser.add_argument(
+            '-o', '--output',
+            dest='output',
+            default=None,
+            help='file to write HQL or results to, rather than stdout'
+        )
+
+    def read_only(self, args):
+        return args.dry
+
+    def run(self, args):
+        self.out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            super(HiveCommand, self).run(args)
+        finally:
+            if args.output:
+                self.out.close()
+
+    def write(self, result):
+        '''
+        Writes output as soon as it is produced, so long builds stream.
+        '''
+        print >> self.out, result
+        self.out.flush()
+
+    def log_metrics(self, archive):
+        metrics = archive.hive.metrics()
+        if metrics:
+            logger.info('Backend metrics: %s' % str.join(', ', [
+                '%s=%s' % item for item in sorted(metrics.items())
+            ]))
+        stats = archive.render_cache.stats()
+        logger.info('Render cache: %s' % str.join(', ', [
+            '%s=%s' % item for item in sorted(stats.items())
+        ]))
+
+    def add_partition_arguments(self):
+        self.parser.add_argument(
+            '-i', '--incremental',
+            dest='incremental',
+            action='store_true',
+            help=(
+                'only add partitions new since the last recovery, for '
+                'external tables with a location'
+            )
+        )
+        self.parser.add_argument(
+            '-b', '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='maximum number of partitions to add per statement'
+        )
+
+    def partition_kwargs(self, args):
+        if not args.incremental:
+            return {}
+        return {
+            'watermarks': Watermarks(
+                os.path.join(args.state_dir, 'partitions.json')
+            ),
+            'batch_size': args.batch_size,
+        }
+
+    def checkpoint(self, args, command):
+        '''
+        The Checkpoint of the build or run being resumed, or of a new one.
+        '''
+        run_id = args.resume or history.run_id()
+        path = os.path.join(args.state_dir, 'runs', '%s.json' % run_id)
+        if args.resume and not os.path.exists(path):
+            raise ValueError('No checkpoint for run %s' % run_id)
+
+        if not args.dry:
+            logger.info(
+                'Starting %s %s; if it fails, resume it with --resume %s' % (
+                    command, run_id, run_id
+                )
+            )
+        return Checkpoint(path, run_id, command)
 
 
 class ShowCommand(ArchiveCommand):
@@ -90,12 +289,46 @@ class GraphCommand(ArchiveCommand):
     def __init__(self, subparsers):
         self.parser = subparsers.add_parser('graph')
         super(GraphCommand, self).__init__()
+        self.parser.add_argument(
+            '-f', '--format',
+            dest='format',
+            choices=graph.FORMATS,
+            default='text',
+            help='format of the graph'
+        )
+        self.parser.add_argument(
+            '-o', '--output',
+            dest='output',
+            default=None,
+            help='file to write the graph to, rather than stdout'
+        )
 
     def handle_query(self, archive, query, args):
-        print query.graph()
+        self.write(
+            archive.graph_lines(format=args.format, queries=[query]),
+            args
+        )
+
+    def handle_selection(self, archive, queries, args):
+        self.write(
+            archive.graph_lines(format=args.format, selection=queries),
+            args
+        )
 
     def handle_archive(self, archive, args):
-        print archive.graph()
+        self.write(archive.graph_lines(format=args.format), args)
+
+    def write(self, lines, args):
+        '''
+        Streams lines to the output as they are generated.
+        '''
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            for line in lines:
+                print >> out, line
+        finally:
+            if args.output:
+                out.close()
 
 
 class StatsCommand(ArchiveCommand):
@@ -108,7 +341,86 @@ class StatsCommand(ArchiveCommand):
 
     def handle_archive(self, archive, args):
         import pprint
-        pprint.pprint(archive.stats)
+        stats = dict(archive.stats)
+        stats['critical_path'] = archive.critical_path()
+        stats['plans'] = archive.explained()
+        stats['render_cache'] = archive.render_cache.stats()
+        pprint.pprint(stats)
+
+
+class CompileTemplatesCommand(ArchiveCommand):
+    def __init__(self, subparsers):
+        self.parser = subparsers.add_parser('compile_templates')
+        super(CompileTemplatesCommand, self).__init__()
+
+    def handle_query(self, archive, query, args):
+        raise NotImplementedError('compile_templates is not valid for queries')
+
+    def handle_archive(self, archive, args):
+        if not args.template_cache:
+            raise ValueError('compile_templates requires --template-cache')
+
+        names = archive.compile_templates()
+        print 'Compiled %s templates into %s' % (
+            len(names),
+            args.template_cache
+        )
+
+
+class HistoryCommand(ArchiveCommand):
+    def __init__(self, subparsers):
+        self.parser = subparsers.add_parser('history')
+        super(HistoryCommand, self).__init__()
+        self.parser.add_argument(
+            '--limit',
+            dest='limit',
+            type=int,
+            default=10,
+            help='number of slowest queries to report'
+        )
+        self.parser.add_argument(
+            '--threshold',
+            dest='threshold',
+            type=float,
+            default=1.5,
+            help=(
+                'multiple of its median duration above which a query\'s '
+                'latest run is a regression'
+            )
+        )
+
+    def handle_query(self, archive, query, args):
+        print '%-24s %-12s %10s %-10s %7s' % (
+            'run', 'command', 'duration', 'status', 'retries'
+        )
+        for node in archive.history.nodes(query.name):
+            print '%-24s %-12s %10.1f %-10s %7s' % (
+                node['run_id'],
+                node['command_id'] or '',
+                node['duration'],
+                node['status'],
+                node['retries']
+            )
+
+    def handle_archive(self, archive, args):
+        summary = archive.history.summary()
+        print 'Slowest queries:'
+        print '%-40s %6s %10s %10s %10s' % (
+            'query', 'runs', 'p50', 'p95', 'last'
+        )
+        for s in summary[:args.limit]:
+            print '%-40s %6s %10.1f %10.1f %10.1f' % (
+                s['name'], s['runs'], s['p50'], s['p95'], s['last']
+            )
+
+        regressions = archive.history.regressions(args.threshold)
+        print '\nRegressions:'
+        for name, before, latest in regressions:
+            print '%s took %.1fs, up from a median of %.1fs' % (
+                name, latest, before
+            )
+        if not regressions:
+            print 'None'
 
 
 class DropAllCommand(HiveCommand):
@@ -121,7 +433,7 @@ class DropAllCommand(HiveCommand):
 
     def handle_archive(self, archive, args):
         if args.dry:
-            print archive.drop_all_hql()
+            self.write(archive.drop_all_hql())
         else:
             archive.drop_all()
 
@@ -136,7 +448,7 @@ class DropTablesCommand(HiveCommand):
 
     def handle_archive(self, archive, args):
         if args.dry:
-            print archive.drop_tables_hql()
+            self.write(archive.drop_tables_hql())
         else:
             archive.drop_tables()
 
@@ -148,10 +460,23 @@ class DropCommand(HiveCommand):
 
     def handle_query(self, archive, query, args):
         if args.dry:
-            print query.drop_hql()
+            self.write(query.drop_hql())
         else:
             query.drop()
 
+    def handle_selection(self, archive, queries, args):
+        # Selecting everything is no way around dropping whole archives
+        if len(queries) == len(archive.order):
+            raise ValueError(
+                'drop is not valid for archives, and %s selects every query' %
+                args.select
+            )
+
+        if args.dry:
+            self.write(archive.drop_hql(queries=queries))
+        else:
+            archive.drop(queries=queries)
+
     def handle_archive(self, archive, args):
         raise NotImplementedError('drop is not valid for archives')
 
@@ -160,15 +485,40 @@ class RecoverAllCommand(HiveCommand):
     def __init__(self, subparsers):
         self.parser = subparsers.add_parser('recover_all')
         super(RecoverAllCommand, self).__init__()
+        self.add_partition_arguments()
+        self.parser.add_argument(
+            '-p', '--parallelism',
+            dest='parallelism',
+            type=int,
+            default=4,
+            help='maximum number of tables to recover concurrently'
+        )
 
     def handle_query(self, archive, query, args):
         raise NotImplementedError('recover_all is not valid for queries')
 
     def handle_archive(self, archive, args):
+        kwargs = self.partition_kwargs(args)
         if args.dry:
-            print archive.recover_all_hql()
-        else:
-            archive.recover_all()
+            self.write(archive.recover_all_hql(**kwargs))
+            return
+
+        recovered = archive.recover_all(
+            parallelism=args.parallelism,
+            **kwargs
+        )
+        for table in recovered:
+            self.write('%s\t%.1fs\t%s' % (
+                table['table'],
+                table['duration'] or 0,
+                'failed: %s' % table['error'] if table['error'] else 'ok'
+            ))
+
+        failed = [t['table'] for t in recovered if t['error']]
+        if failed:
+            raise RuntimeError('Failed to recover partitions of %s' % (
+                str.join(', ', failed)
+            ))
 
 
 class CreateCommand(HiveCommand):
@@ -178,7 +528,7 @@ class CreateCommand(HiveCommand):
 
     def handle_query(self, archive, query, args):
         if args.dry:
-            print query.create_hql()
+            self.write(query.create_hql())
         else:
             query.create()
 
@@ -194,10 +544,10 @@ class CreateTablesCommand(HiveCommand):
     def handle_query(self, archive, query, args):
         if args.dry:
             for result in query.create_tables_hql():
-                print result
+                self.write(result)
         else:
             for result in query.create_tables():
-                print result
+                self.write(result)
 
     def handle_archive(self, archive, args):
         raise NotImplementedError('create_tables is not valid for archives')
@@ -207,12 +557,14 @@ class RecoverPartitionsCommand(HiveCommand):
     def __init__(self, subparsers):
         self.parser = subparsers.add_parser('recover_partitions')
         super(RecoverPartitionsCommand, self).__init__()
+        self.add_partition_arguments()
 
     def handle_query(self, archive, query, args):
+        kwargs = self.partition_kwargs(args)
         if args.dry:
-            print query.recover_partitions_hql()
+            self.write(query.recover_partitions_hql(**kwargs))
         else:
-            query.recover_partitions()
+            query.recover_partitions(**kwargs)
 
     def handle_archive(self, archive, args):
         raise NotImplementedError(
@@ -224,44 +576,262 @@ class BuildCommand(HiveCommand):
     def __init__(self, subparsers):
         self.parser = subparsers.add_parser('build')
         super(BuildCommand, self).__init__()
+        self.parser.add_argument(
+            '-p', '--parallelism',
+            dest='parallelism',
+            type=int,
+            default=1,
+            help='maximum number of queries to run concurrently'
+        )
+        self.parser.add_argument(
+            '-i', '--incremental',
+            dest='incremental',
+            action='store_true',
+            help=(
+                'only rebuild relations that changed, or are downstream of '
+                'a change, since the last build (archives only)'
+            )
+        )
+        self.parser.add_argument(
+            '-b', '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=1,
+            help=(
+                'maximum number of independent view and external table '
+                'statements to submit as one command (archives only)'
+            )
+        )
+        self.parser.add_argument(
+            '--resume',
+            dest='resume',
+            default=None,
+            metavar='RUN_ID',
+            help=(
+                'resume a failed build, skipping queries it completed '
+                '(archives only)'
+            )
+        )
 
     def handle_query(self, archive, query, args):
         if args.dry:
             for result in query.build_hql():
-                print result
+                self.write(result)
         else:
-            for result in query.build():
-                print result
+            for result in query.build(parallelism=args.parallelism):
+                self.write(result)
 
-    def handle_archive(self, archive, args):
+    def handle_selection(self, archive, queries, args):
+        self.handle_archive(archive, args, queries)
+
+    def handle_archive(self, archive, args, queries=None):
+        # Kept for every build, so ViewUntilTables are replaced when their
+        # decision flips
+        built = BuildState(os.path.join(args.state_dir, 'build.json'))
+        state = built if args.incremental else None
+
+        checkpoint = self.checkpoint(args, 'build')
         if args.dry:
-            for result in archive.build_hql():
-                print result
+            for result in archive.build_hql(
+                state=state,
+                built=built,
+                checkpoint=checkpoint,
+                queries=queries
+            ):
+                self.write(result)
+            self.log_metrics(archive)
         else:
-            for result in archive.build():
-                print result
+            for result in archive.build_iter(
+                parallelism=args.parallelism,
+                batch_size=args.batch_size,
+                state=state,
+                built=built,
+                checkpoint=checkpoint,
+                queries=queries
+            ):
+                self.write(result)
+            self.log_metrics(archive)
 
 
 class RunCommand(HiveCommand):
     def __init__(self, subparsers):
         self.parser = subparsers.add_parser('run')
         super(RunCommand, self).__init__()
+        self.parser.add_argument(
+            '-p', '--parallelism',
+            dest='parallelism',
+            type=int,
+            default=1,
+            help='maximum number of queries to run concurrently'
+        )
+        self.parser.add_argument(
+            '--resume',
+            dest='resume',
+            default=None,
+            metavar='RUN_ID',
+            help=(
+                'resume a failed run, skipping queries it completed '
+                '(archives only)'
+            )
+        )
 
     def handle_query(self, archive, query, args):
         if args.dry:
             for result in query.run_hql():
-                print result
+                self.write(result)
         else:
             for result in query.run():
-                print result
+                self.write(result)
+
+    def handle_selection(self, archive, queries, args):
+        self.handle_archive(archive, args, queries)
+
+    def handle_archive(self, archive, args, queries=None):
+        checkpoint = self.checkpoint(args, 'run')
+        if args.dry:
+            for result in archive.run_hql(
+                checkpoint=checkpoint,
+                queries=queries
+            ):
+                self.write(result)
+        else:
+            for result in archive.run_iter(
+                parallelism=args.parallelism,
+                checkpoint=checkpoint,
+                queries=queries
+            ):
+                self.write(result)
+            self.log_metrics(archive)
+
+
+class ExplainCommand(HiveCommand):
+    def __init__(self, subparsers):
+        self.parser = subparsers.add_parser('explain')
+        super(ExplainCommand, self).__init__()
+
+    def handle_query(self, archive, query, args):
+        self.explain(archive, [query], args)
 
     def handle_archive(self, archive, args):
+        self.explain(archive, archive.order, args)
+
+    def explain(self, archive, queries, args):
+        '''
+        Explains queries that haven't been explained as they are, printing
+        their plans, or with --dry, the EXPLAIN HQL that would be run.
+        '''
         if args.dry:
-            for result in archive.run_hql():
-                print result
+            for query in queries:
+                hql = query.explain_hql()
+                if hql and archive.plans.get(hql) is None:
+                    self.write(hql)
+            return
+
+        explained = archive.explain(queries=queries)
+        for query in queries:
+            plan = archive.plan(query)
+            if plan is not None:
+                self.write('%s%s\t%s' % (
+                    query.name,
+                    '' if query.name in explained else ' (cached)',
+                    str.join(', ', [
+                        '%s=%s' % item for item in sorted(plan.items())
+                    ])
+                ))
+
+
+class BackfillCommand(HiveCommand):
+    def __init__(self, subparsers):
+        self.parser = subparsers.add_parser('backfill')
+        super(BackfillCommand, self).__init__()
+        self.parser.add_argument(
+            '--start',
+            dest='start',
+            help='first partition value to backfill, a date or integer'
+        )
+        self.parser.add_argument(
+            '--end',
+            dest='end',
+            help='last partition value to backfill, inclusive'
+        )
+        self.parser.add_argument(
+            '--partitions',
+            dest='partitions',
+            default=None,
+            help='comma-separated partition values, instead of a range'
+        )
+        self.parser.add_argument(
+            '--column',
+            dest='column',
+            default=None,
+            help=(
+                'partition column to backfill, by default the first of the '
+                "statement's table"
+            )
+        )
+        self.parser.add_argument(
+            '-c', '--chunk-size',
+            dest='chunk_size',
+            type=int,
+            default=1,
+            help='number of partitions to write per statement'
+        )
+        self.parser.add_argument(
+            '-p', '--parallelism',
+            dest='parallelism',
+            type=int,
+            default=1,
+            help='maximum number of chunks to run concurrently'
+        )
+        self.parser.add_argument(
+            '-r', '--retries',
+            dest='retries',
+            type=int,
+            default=2,
+            help='number of times to retry a failed chunk'
+        )
+
+    def handle_query(self, archive, query, args):
+        if not hasattr(query, 'backfill_hql'):
+            raise ValueError('backfill is only valid for InsertOverwrites')
+
+        if args.partitions:
+            values = args.partitions.split(',')
+        elif args.start and args.end:
+            values = backfill.values(args.start, args.end)
         else:
-            for result in archive.run():
-                print result
+            raise ValueError('backfill requires --partitions or --start/--end')
+
+        # Unscoped chunks would each overwrite every partition
+        backfill.check(query)
+        chunks = backfill.chunks(query, values, args.chunk_size, args.column)
+        if args.dry:
+            for chunk in chunks:
+                self.write(query.backfill_hql(chunk))
+            return
+
+        summary = backfill.backfill(
+            query,
+            chunks,
+            args.parallelism,
+            args.retries
+        )
+        self.write((
+            'Backfilled {partitions} partitions in {succeeded} of {chunks} '
+            'chunks in {elapsed:.1f}s, {rate} partitions/hour ({retries} '
+            'retries)'
+        ).format(rate=(
+            '%.1f' % summary['partitions_per_hour']
+            if summary['partitions_per_hour'] is not None else 'n/a'
+        ), **summary))
+        if summary['failed']:
+            raise RuntimeError('Failed to backfill %s' % str.join(
+                ', ',
+                summary['failed']
+            ))
+
+    def handle_archive(self, archive, args):
+        raise NotImplementedError('backfill is not valid for archives')
 
 parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers()
@@ -269,6 +839,8 @@ subparsers = parser.add_subparsers()
 ShowCommand(subparsers)
 GraphCommand(subparsers)
 StatsCommand(subparsers)
+CompileTemplatesCommand(subparsers)
+HistoryCommand(subparsers)
 
 DropAllCommand(subparsers)
 DropTablesCommand(subparsers)
@@ -280,3 +852,5 @@ CreateTablesCommand(subparsers)
 RecoverPartitionsCommand(subparsers)
 BuildCommand(subparsers)
 RunCommand(subparsers)
+BackfillCommand(subparsers)
+ExplainCommand(subparsers)
@@ -0,0 +1,398 @@
+'''
+Archive's DAG executor.  Rather than submitting HQL strictly one query after
+another, the Executor walks the dependencies between queries and submits every
+query whose inputs have finished, up to a bounded number at a time.
+'''
+
+import collections
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+import Queue
+
+import preamble
+import tracing
+from state import digest
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    '''
+    A Job is the HQL for a single Query along with the Jobs that must finish
+    before it may be submitted.  Once it finishes only its digest is kept, so
+    that finished Jobs don't hold on to their HQL.
+    '''
+    def __init__(self, query, hql, upstream=None):
+        self.query = query
+        self.hql = hql
+        self.digest = digest(hql)
+        self.upstream = upstream or []
+        self.batch_size = 1
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.succeeded = False
+
+        # Wall clock times at which the Job was submitted and finished
+        self.submitted = None
+        self.finished = None
+
+    @property
+    def name(self):
+        return self.query.name
+
+    @property
+    def duration(self):
+        '''
+        The Job's share of the time its command took.
+        '''
+        if self.finished is None:
+            return None
+        return (self.finished - self.submitted) / self.batch_size
+
+    @property
+    def batchable(self):
+        '''
+        Metadata-only DDL is cheap enough to run many to a command.
+        '''
+        return getattr(self.query, 'metadata_only', False)
+
+    def __str__(self):
+        return 'Job(%s)' % self.name
+
+
+def plan(steps):
+    '''
+    Lazily turns the ordered (query, hql) steps generated by the workflow
+    methods into Jobs.  Each Job waits on the Jobs of its nearest planned
+    ancestors, on any planned statement that writes one of its ancestors, and
+    on whichever Job creates its database.  Dependencies only ever point at
+    earlier steps, so running the Jobs serially in order reproduces the
+    original behavior.
+    '''
+    jobs = collections.OrderedDict()
+    writers = collections.defaultdict(list)
+    database_jobs = {}
+
+    for query, hql in steps:
+        job = Job(query, hql, _upstream(query, jobs, writers))
+
+        database = getattr(query, 'database', None)
+        if database is not None:
+            if database not in database_jobs:
+                database_jobs[database] = job
+            elif database_jobs[database] not in job.upstream:
+                job.upstream.append(database_jobs[database])
+
+        if hasattr(query, 'external_table'):
+            writers[query.external_table].append(job)
+
+        jobs[query] = job
+        yield job
+
+
+def _upstream(query, jobs, writers):
+    upstream = []
+    seen = set()
+    stack = list(query.inputs)
+    while stack:
+        i = stack.pop()
+        if i in seen:
+            continue
+        seen.add(i)
+
+        upstream.extend(writers.get(i, []))
+        if i in jobs:
+            upstream.append(jobs[i])
+        else:
+            stack.extend(i.inputs)
+
+    # Preserve order while removing duplicates
+    return list(collections.OrderedDict.fromkeys(upstream))
+
+
+class Executor(object):
+    '''
+    Runs Jobs against a Backend on a pool of worker threads, dispatching each
+    Job as soon as all of its upstream Jobs have succeeded.  If any Job fails,
+    nothing further is dispatched; in-flight Jobs are allowed to finish and the
+    first failure is re-raised.  To keep going instead, only Jobs downstream
+    of a failure are skipped, and failed Jobs are left in failed for the
+    caller to report.  Each command is retried up to the given number of
+    times before its Jobs fail.
+
+    Jobs are pulled from their iterable only a little ahead of execution, so
+    the first Jobs are running while later ones are still being planned.
+    Ready Jobs are dispatched in the order they were planned, or by the given
+    rank, lowest first; see schedule.rank.  Given an estimate of each Job's
+    duration, the Backend is told how long each command is expected to take.
+
+    With a batch size above one, ready Jobs for metadata-only DDL are packed
+    into a single multi-statement command, each Job sharing its result.  If
+    the command fails, its Jobs are run again one at a time, so that only
+    those that fail are failed.  Ready
+    Jobs never depend on one another, so any of them may share a command; see
+    preamble.script for how their resources, functions and settings combine.
+
+    Given record, it is called with each Job that succeeds as it finishes.
+    '''
+    def __init__(self, hive, parallelism=1, batch_size=1, lookahead=None,
+                 rank=None, estimate=None, keep_going=False, retries=0,
+                 record=None):
+        self.hive = hive
+        self.parallelism = max(1, parallelism)
+        self.batch_size = max(1, batch_size)
+        self.lookahead = lookahead or \
+            4 * self.parallelism * self.batch_size
+        self.rank = rank
+        self.estimate = estimate
+        self.keep_going = keep_going
+        self.retries = retries
+        self.record = record
+        self.jobs = []
+        self.failed = []
+        self.sequence = itertools.count()
+
+    def run_all_sync(self, jobs):
+        return list(self.run_all_iter(jobs))
+
+    def run_all_iter(self, jobs):
+        '''
+        Runs the given Jobs, yielding each result as its Job finishes.
+        '''
+        if self.hive._warnings_enabled():
+            # Warning requires seeing every query up front
+            jobs = list(jobs)
+            if not self.hive._warn_all([job.hql for job in jobs]):
+                yield self.hive.ABORT_MSG
+                return
+
+        logger.info('Running queries with parallelism %s' % self.parallelism)
+        with self.hive._warnings_acknowledged():
+            for job in self._run(iter(jobs)):
+                yield job.result
+
+    def _run(self, jobs):
+        remaining = {}
+        downstream = collections.defaultdict(list)
+        ready = []
+        finished_jobs = set()
+        failed_jobs = set()
+
+        submitted = Queue.Queue()
+        finished = Queue.Queue()
+        workers = [
+            threading.Thread(target=self._work, args=(submitted, finished))
+            for _ in range(self.parallelism)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        running = 0
+        exhausted = False
+        failure = None
+        try:
+            while True:
+                can_plan = not exhausted and not failure and \
+                    len(remaining) + len(ready) < self.lookahead
+                filling = can_plan and self._filling(ready)
+
+                if not filling:
+                    while ready and running < self.parallelism and \
+                            not failure:
+                        submitted.put(self._batch(ready))
+                        running += 1
+
+                # Plan further ahead while nothing has finished, or while more
+                # Jobs could join a batch
+                if can_plan and (filling or finished.empty()):
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+
+                    self.jobs.append(job)
+                    if any([u in failed_jobs for u in job.upstream]):
+                        failed_jobs.add(job)
+                        continue
+
+                    pending = [
+                        u for u in job.upstream if u not in finished_jobs
+                    ]
+                    if pending:
+                        remaining[job] = len(pending)
+                        for u in pending:
+                            downstream[u].append(job)
+                    else:
+                        self._ready(ready, job)
+                    continue
+
+                if not running:
+                    break
+
+                batch, exc_info = finished.get()
+                running -= 1
+                for job in batch:
+                    job.hql = None
+
+                failed = [job for job in batch if not job.succeeded]
+                if failed:
+                    logger.error('Query %s failed' % str.join(
+                        ', ',
+                        [job.name for job in failed]
+                    ))
+                    if not self.keep_going:
+                        failure = failure or exc_info
+                    else:
+                        self.failed.extend(failed)
+                        self._skip(failed, remaining, downstream, failed_jobs)
+
+                for job in batch:
+                    if not job.succeeded:
+                        continue
+
+                    if self.record is not None:
+                        self.record(job)
+                    finished_jobs.add(job)
+                    for d in downstream.pop(job, []):
+                        if d not in remaining:
+                            # Skipped, downstream of a failure
+                            continue
+                        remaining[d] -= 1
+                        if remaining[d] == 0:
+                            del remaining[d]
+                            self._ready(ready, d)
+
+                    yield job
+        finally:
+            for worker in workers:
+                submitted.put(None)
+
+        if failure:
+            raise failure[0], failure[1], failure[2]
+
+    def _skip(self, batch, remaining, downstream, failed_jobs):
+        '''
+        Marks failed Jobs and everything planned downstream of them as never
+        to run.
+        '''
+        stack = list(batch)
+        while stack:
+            job = stack.pop()
+            failed_jobs.add(job)
+            for d in downstream.pop(job, []):
+                if d in remaining:
+                    del remaining[d]
+                    stack.append(d)
+
+    def _ready(self, ready, job):
+        '''
+        Adds a Job to the heap of ready Jobs.
+        '''
+        key = (next(self.sequence),)
+        if self.rank:
+            key = tuple(self.rank(job)) + key
+        heapq.heappush(ready, (key, job))
+
+    def _filling(self, ready):
+        batchable = len([job for _, job in ready if job.batchable])
+        return 0 < batchable < self.batch_size
+
+    def _batch(self, ready):
+        '''
+        Takes the next ready Job, along with as many other batchable ready Jobs
+        as fit if it is batchable itself.
+        '''
+        batch = [heapq.heappop(ready)[1]]
+        if self.batch_size > 1 and batch[0].batchable:
+            skipped = []
+            while ready and len(batch) < self.batch_size:
+                entry = heapq.heappop(ready)
+                if entry[1].batchable:
+                    batch.append(entry[1])
+                else:
+                    skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(ready, entry)
+        return batch
+
+    def _work(self, submitted, finished):
+        while True:
+            batch = submitted.get()
+            if batch is None:
+                return
+
+            if len(batch) > 1:
+                logger.info('Batching queries %s' % str.join(
+                    ', ',
+                    [job.name for job in batch]
+                ))
+
+            exc_info = self._submit(batch)
+            if exc_info and len(batch) > 1:
+                # Find which of the batch failed, so the others aren't blamed
+                logger.warning(
+                    'Batch failed, running its queries one at a time'
+                )
+                exc_info = None
+                for job in batch:
+                    exc_info = self._submit([job]) or exc_info
+            finished.put((batch, exc_info))
+
+    def _submit(self, batch):
+        '''
+        Runs the batch as one command, with retries, returning the error's
+        exc_info if it failed.
+        '''
+        for job in batch:
+            job.batch_size = len(batch)
+            job.submitted = time.time()
+
+        for attempt in range(self.retries + 1):
+            for job in batch:
+                job.attempts += 1
+            try:
+                with tracing.span('job', queries=[j.name for j in batch]):
+                    result = self.hive.run_sync(
+                        script(batch),
+                        **self._expected(batch)
+                    )
+                exc_info = None
+                break
+            except Exception:
+                result = None
+                exc_info = sys.exc_info()
+                if attempt < self.retries:
+                    logger.warning('Retrying query %s: %s' % (
+                        str.join(', ', [job.name for job in batch]),
+                        exc_info[1]
+                    ))
+
+        for job in batch:
+            job.finished = time.time()
+            if exc_info:
+                job.error = exc_info[1]
+            else:
+                job.result = result
+                job.succeeded = True
+        return exc_info
+
+    def _expected(self, batch):
+        if self.estimate is None:
+            return {}
+        return {'expected': sum([self.estimate(job) for job in batch])}
+
+
+def script(jobs):
+    '''
+    The HQL script that runs the given Jobs in order as a single command.
+    '''
+    if len(jobs) == 1:
+        return jobs[0].hql
+    return preamble.script([job.hql for job in jobs])
@@ -0,0 +1,43 @@
+'''
+Parsing of Hive's EXPLAIN output into rough cost estimates, available before
+a query first runs.  Plans are cached by the hash of the HQL explained, so a
+query is only explained again once it changes; see state.Plans.
+'''
+
+import re
+
+# Only stages that run jobs count; Hive's plans also have Fetch, Move,
+# Stats-Aggr and the like, which do no real work
+STAGE = re.compile(
+    r'^\s*Stage: (Stage-\d+)\s*\n\s*(?:Map Reduce|Tez|Spark)\s*$',
+    re.MULTILINE
+)
+JOIN = re.compile(r'\bJoin Operator\b')
+TABLE_SCAN = re.compile(
+    r'TableScan\s+alias: (\S+)\s+'
+    r'(?:Statistics: Num rows: (\d+) Data size: (\d+))?'
+)
+
+
+def parse(text):
+    '''
+    The number of MapReduce, Tez or Spark stages and joins in an EXPLAIN plan,
+    the tables it scans and, if Hive has statistics for them, their total rows
+    and bytes.
+    '''
+    scans = TABLE_SCAN.findall(text or '')
+    sized = [(int(rows), int(size)) for _, rows, size in scans if size]
+    return {
+        'stages': len(set(STAGE.findall(text or ''))),
+        'joins': len(JOIN.findall(text or '')),
+        'tables': sorted(set([alias for alias, _, _ in scans])),
+        'input_rows': sum([rows for rows, _ in sized]) if sized else None,
+        'input_bytes': sum([size for _, size in sized]) if sized else None,
+    }
+
+
+def cost(plan):
+    '''
+    A plan's cost relative to that of a simple view, one job without joins.
+    '''
+    return plan['stages'] + plan['joins']
@@ -0,0 +1,117 @@
+'''
+Rendering of an Archive's DAG, as an indented text tree, Graphviz DOT or
+JSON.  Each format is generated a line at a time from an iterative traversal,
+so large graphs can be streamed to a file without deep recursion or building
+the whole output in memory.
+'''
+
+import json
+
+FORMATS = ('text', 'dot', 'json')
+
+# Stands in for the blank line an InsertOverwrite without inputs renders
+BLANK = object()
+
+
+def text(roots, references=None):
+    '''
+    The text tree of the given queries and their inputs, depth first, with
+    each level indented by a tab.  Relations already rendered, as counted in
+    references, are elided with "...".
+    '''
+    if references is None:
+        references = {}
+
+    stack = [(0, root) for root in reversed(roots)]
+    while stack:
+        depth, query = stack.pop()
+        if query is BLANK:
+            yield ''
+            continue
+
+        label, children = query._graph_node(references)
+        yield '%s%s' % ('\t' * depth, label)
+        stack.extend([(depth + 1, c) for c in reversed(children)])
+
+
+def upstream(queries):
+    '''
+    The given queries and every query upstream of them, including the tables
+    statements write, in topological order.
+    '''
+    order = []
+    seen = set()
+    stack = [(q, False) for q in reversed(queries)]
+    while stack:
+        query, expanded = stack.pop()
+        if query.name in seen:
+            continue
+        if expanded:
+            seen.add(query.name)
+            order.append(query)
+            continue
+
+        stack.append((query, True))
+        stack.extend([
+            (i, False) for i in reversed(_inputs(query))
+            if i.name not in seen
+        ])
+    return order
+
+
+def _inputs(query):
+    inputs = list(query.inputs)
+    if hasattr(query, 'external_table'):
+        inputs.append(query.external_table)
+    return inputs
+
+
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def dot(name, queries):
+    '''
+    A Graphviz digraph of the given queries, with an edge from each input to
+    the queries that read it and from each statement to the table it writes,
+    between the given queries only.
+    '''
+    names = set([query.name for query in queries])
+    yield 'digraph %s {' % _quote(name)
+    for query in queries:
+        yield '  %s [label=%s, shape=%s];' % (
+            _quote(query.name),
+            _quote(str(query) if hasattr(query, 'database') else
+                   '[%s]' % query.name),
+            'box' if hasattr(query, 'database') else 'ellipse'
+        )
+    for query in queries:
+        for i in query.inputs:
+            if i.name in names:
+                yield '  %s -> %s;' % (_quote(i.name), _quote(query.name))
+        if hasattr(query, 'external_table') and \
+                query.external_table.name in names:
+            yield '  %s -> %s [style=dashed];' % (
+                _quote(query.name),
+                _quote(query.external_table.name)
+            )
+    yield '}'
+
+
+def json_lines(name, queries):
+    '''
+    A JSON object of the given queries, one per line so that graphs diff
+    well, each with its type, inputs and the table it writes, if any.
+    '''
+    yield '{"archive": %s, "queries": [' % json.dumps(name)
+    for n, query in enumerate(queries):
+        yield '%s%s' % (json.dumps({
+            'name': query.name,
+            'type': type(query).__name__,
+            'relation': query.qualified_name()
+            if hasattr(query, 'qualified_name') else None,
+            'inputs': [i.name for i in query.inputs],
+            'writes': query.external_table.name
+            if hasattr(query, 'external_table') else None,
+        }, sort_keys=True), ',' if n < len(queries) - 1 else '')
+    yield ']}'
@@ -0,0 +1,175 @@
+'''
+A local history of the queries Archive has submitted, kept in sqlite, so that
+their durations can be tracked from run to run.
+'''
+
+import math
+import os
+import sqlite3
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nodes (
+    run_id TEXT NOT NULL,
+    command TEXT NOT NULL,
+    name TEXT NOT NULL,
+    hql_hash TEXT NOT NULL,
+    command_id TEXT,
+    label TEXT,
+    submitted REAL,
+    started REAL,
+    finished REAL,
+    status TEXT,
+    retries INTEGER
+);
+CREATE INDEX IF NOT EXISTS nodes_by_name ON nodes (name, submitted);
+'''
+
+# A node's duration runs from when it was seen running, if it was, so that
+# time spent queued doesn't count
+DURATION = 'finished - COALESCE(started, submitted)'
+
+
+def run_id():
+    '''
+    A new identifier for a build or run.
+    '''
+    return '%s-%s' % (time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+
+
+def percentile(values, p):
+    '''
+    The nearest-rank percentile of the given values.
+    '''
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class History(object):
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.connection = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        return state
+
+    def _connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if self.path != ':memory:' and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def record(self, run_id, command, jobs, hive=None, label=None):
+        '''
+        Records the given Jobs of a build or run, along with what the backend
+        observed of their commands; see Backend.observation.
+        '''
+        rows = []
+        for job in jobs:
+            if job.submitted is None:
+                continue
+
+            if job.succeeded:
+                hive_command = job.result
+            else:
+                hive_command = getattr(job.error, 'command', None)
+            observation = hive.observation(hive_command) if hive else {}
+            status = getattr(hive_command, 'status', None) or \
+                ('done' if job.succeeded else 'error')
+
+            rows.append((
+                run_id,
+                command,
+                job.name,
+                job.digest,
+                observation.get('command_id'),
+                label,
+                job.submitted,
+                observation.get('started'),
+                job.finished,
+                status,
+                observation.get('retries', 0),
+            ))
+
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                'INSERT INTO nodes VALUES (%s)' % str.join(', ', ['?'] * 11),
+                rows
+            )
+
+    def nodes(self, name):
+        '''
+        Every recorded submission of the named query, oldest first.
+        '''
+        cursor = self._connect().execute(
+            '''
+            SELECT run_id, command_id, label, submitted, %s, status, retries
+            FROM nodes WHERE name = ? ORDER BY submitted
+            ''' % DURATION,
+            (name,)
+        )
+        columns = [
+            'run_id', 'command_id', 'label', 'submitted', 'duration',
+            'status', 'retries',
+        ]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def durations(self):
+        '''
+        The durations of each query's successful submissions, oldest first,
+        by name.
+        '''
+        durations = {}
+        cursor = self._connect().execute(
+            '''
+            SELECT name, %s FROM nodes
+            WHERE status = 'done' ORDER BY submitted
+            ''' % DURATION
+        )
+        for name, duration in cursor:
+            durations.setdefault(name, []).append(duration)
+        return durations
+
+    def summary(self):
+        '''
+        The number of successful runs and median and 95th percentile duration
+        of each query, slowest first.
+        '''
+        summary = [
+            {
+                'name': name,
+                'runs': len(durations),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'last': durations[-1],
+            }
+            for name, durations in self.durations().items()
+        ]
+        return sorted(summary, key=lambda s: (-s['p50'], s['name']))
+
+    def regressions(self, threshold=1.5, floor=1.0):
+        '''
+        The queries whose latest successful run took longer than the given
+        multiple of the median of their earlier runs, ignoring differences of
+        less than floor seconds, as (name, earlier median, latest) tuples.
+        '''
+        regressions = []
+        for name, durations in sorted(self.durations().items()):
+            if len(durations) < 2:
+                continue
+
+            before = percentile(durations[:-1], 50)
+            latest = durations[-1]
+            if latest > before * threshold and latest - before > floor:
+                regressions.append((name, before, latest))
+        return regressions
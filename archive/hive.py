@@ -2,57 +2,93 @@
 Archive's API to Hive
 '''
 
+import contextlib
 import logging
 import time
-
-from requests.exceptions import ConnectionError
+from StringIO import StringIO
 
 from qds_sdk.qubole import Qubole as QDS
 from qds_sdk.commands import *
 
+import tracing
+from poller import Poller
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class CommandFailed(RuntimeError):
+    '''
+    Raised when a command finishes unsuccessfully, carrying the command.
+    '''
+    def __init__(self, message, command):
+        super(CommandFailed, self).__init__(message)
+        self.command = command
+
+
 class Backend(object):
     ABORT_MSG = 'Aborting'
 
-    def run_all_sync(self, queries):
-        if self._warn_all(queries):
-            # Shut off individual warnings
-            if 'no_warn' in self.args:
-                old_warn = self.args.no_warn
-                self.args.no_warn = True
+    args = None
 
-            logger.info("Running %s queries" % len(queries))
-            results = [self.run_sync(query) for query in queries]
+    def observation(self, command):
+        '''
+        What the backend observed of the given command, if anything: its id,
+        when it was first seen running and how many polls of it failed.
+        '''
+        return {}
 
-            # Restore warnings
-            if old_warn:
-                self.args.no_warn = old_warn
+    def metrics(self):
+        '''
+        Metrics of the backend's use of its service, if any.
+        '''
+        return {}
 
-            return results
+    def explain(self, hql):
+        '''
+        The output of the given EXPLAIN HQL, if the backend can explain.
+        '''
+        return None
+
+    def run_all_sync(self, queries):
+        if self._warn_all(queries):
+            logger.info("Running %s queries" % len(queries))
+            with tracing.span('run_all_sync', queries=len(queries)), \
+                    self._warnings_acknowledged():
+                return [self.run_sync(query) for query in queries]
         else:
             return [self.ABORT_MSG]
 
     def run_all_async(self, queries):
         if self._warn_all(queries):
-            # Shut off individual warnings
-            if 'no_warn' in self.args:
-                old_warn = self.args.no_warn
-                self.args.no_warn = True
-
             logger.info("Running %s queries" % len(queries))
-            results = [self.run_async(query) for query in queries]
-
-            # Restore warnings
-            if old_warn:
-                self.args.no_warn = old_warn
-
-            return results
+            with self._warnings_acknowledged():
+                return [self.run_async(query) for query in queries]
         else:
             return [self.ABORT_MSG]
 
+    def _warnings_enabled(self):
+        return bool(
+            self.args and 'no_warn' in self.args and not self.args.no_warn
+        )
+
+    @contextlib.contextmanager
+    def _warnings_acknowledged(self):
+        '''
+        Shuts off individual warnings for the duration of a batch of queries
+        whose warning has already been acknowledged, restoring them afterwards.
+        '''
+        if not self.args or 'no_warn' not in self.args:
+            yield
+            return
+
+        old_warn = self.args.no_warn
+        self.args.no_warn = True
+        try:
+            yield
+        finally:
+            self.args.no_warn = old_warn
+
     def _warn(self, hql):
         '''
         If warnings are enabled, generates an stdout warning about database
@@ -67,7 +103,7 @@ class Backend(object):
         modifications contained within a list of HQL queries. Returns a boolean
         representing whether the warning was acknowledged positively.
         '''
-        if self.args and 'no_warn' in self.args and not self.args.no_warn:
+        if self._warnings_enabled():
             if any([-1 != hql.find('DROP ') for hql in hqls]) or \
                any([-1 != hql.find('INSERT ') for hql in hqls]) or \
                any([-1 != hql.find('CREATE ') for hql in hqls]) or \
@@ -86,7 +122,7 @@ class Hive(Backend):
     def set_token(self, api_token):
         pass
 
-    def run_sync(self, query, log_limit=100):
+    def run_sync(self, query, log_limit=100, expected=None):
         if self._warn(query):
             logger.info(
                 "Running query on dummy backend: '%s...'" % query[0:log_limit]
@@ -106,74 +142,99 @@ class Hive(Backend):
 
 
 class Qubole(Hive):
+    '''
+    Runs queries as QDS HiveCommands.  The command class and clock may be
+    replaced, e.g. by those of a simulation.Service.  Without a poll interval,
+    QDS's configured interval is used.
+    '''
+    def __init__(self, command_class=HiveCommand, clock=time,
+                 poll_interval=None):
+        self.command_class = command_class
+        self.clock = clock
+        self.poll_interval = poll_interval
+        self.poller = Poller(
+            command_class,
+            poll_interval or QDS.poll_interval,
+            clock=clock
+        )
+
     def set_token(self, api_token):
         QDS.configure(api_token=api_token)
+        if self.poll_interval is None and QDS.poll_interval:
+            self.poller.interval = QDS.poll_interval
+            self.poller.maximum = max(self.poller.maximum, QDS.poll_interval)
 
-    def backoff_poll_interval(self, multiple=2):
-        QDS.configure(QDS.api_token, poll_interval=QDS.poll_interval * multiple)
-
-    def poll_with_retries(self, hive_command, retries=3):
+    def poll_with_retries(self, hive_command, expected=None):
         '''
-        A temporary work-around for connection failures while polling QDS.  See
-        qds_sdk.commands.Command#run for the original source of this code,
-        prior to retries with polling interval backoff.
+        Waits for a command started by run_async.  Polling backs off and
+        retries connection failures for this command alone; see Poller.
         '''
-        try:
-            while not HiveCommand.is_done(hive_command.status):
-                time.sleep(QDS.poll_interval)
-                hive_command = HiveCommand.find(hive_command.id)
+        with tracing.span('poll', command=hive_command.id):
+            hive_command = self.poller.wait(hive_command, expected)
+        return self._ran(hive_command)
+
+    def _ran(self, hive_command):
+        logger.info('Ran job: %s, Status: %s' % (
+            hive_command.id,
+            hive_command.status
+        ))
+
+        # Notify caller if the command wasn't successful
+        if not self.command_class.is_success(hive_command.status):
+            logger.error(hive_command.get_log())
+            raise CommandFailed((
+                'Job %s failed or was cancelled, '
+                "Status: %s\nCommand: '%s'" % (
+                    hive_command.id,
+                    hive_command.status,
+                    hive_command
+                )
+            ), hive_command)
 
-            logger.info('Ran job: %s, Status: %s' % (
-                hive_command.id,
-                hive_command.status
-            ))
+        return hive_command
 
-            # Notify caller if the command wasn't successful
-            if not HiveCommand.is_success(hive_command.status):
-                logger.error(hive_command.get_log())
-                raise RuntimeError((
-                    'Job %s failed or was cancelled, '
-                    "Status: %s\nCommand: '%s'" % (
-                        hive_command.id,
-                        hive_command.status,
-                        hive_command
-                    )
-                ))
+    def observation(self, command):
+        if not hasattr(command, 'id'):
+            return {}
 
-            return hive_command
-        except ConnectionError as error:
-            if retries > 0:
-                self.backoff_poll_interval()
-                logger.error((
-                    'Received ConnectionError: %s, '
-                    'Retrying with polling interval: %s (%s remaining)' % (
-                        error,
-                        QDS.poll_interval,
-                        retries
-                    )
-                ))
-                return self.poll_with_retries(
-                    hive_command,
-                    retries=retries - 1
-                )
-            else:
-                logger.exception('Polling retries exhausted')
+        observation = {'command_id': command.id, 'retries': 0}
+        observation.update(self.poller.observed.get(command.id, {}))
+        return observation
 
-    def run_sync(self, query, log_limit=100, retries=3):
+    def metrics(self):
+        return self.poller.metrics()
+
+    def run_sync(self, query, log_limit=100, expected=None):
         if self._warn(query):
             logger.info(
                 "Running query on Qubole backend: '%s...'" % query[0:log_limit]
             )
 
             kwargs = {'query': query}
-            if 'label' in self.args:
+            if self.args and 'label' in self.args:
                 kwargs['label'] = self.args.label
 
-            hive_command = HiveCommand.create(**kwargs)
-            return self.poll_with_retries(hive_command)
+            with tracing.span('run_sync') as span:
+                with tracing.span('submit') as submit:
+                    hive_command = self.command_class.create(**kwargs)
+                    submit['command'] = span['command'] = hive_command.id
+
+                with tracing.span('wait', command=hive_command.id):
+                    hive_command = self.poller.wait(hive_command, expected)
+
+            return self._ran(hive_command)
         else:
             return self.ABORT_MSG
 
+    def explain(self, hql):
+        # EXPLAIN modifies nothing, even of statements that would
+        with self._warnings_acknowledged():
+            hive_command = self.run_sync(hql)
+
+        results = StringIO()
+        hive_command.get_results(fp=results)
+        return results.getvalue()
+
     def run_async(self, query, log_limit=100):
         if self._warn(query):
             logger.info(
@@ -181,10 +242,10 @@ class Qubole(Hive):
             )
 
             kwargs = {'query': query}
-            if 'label' in self.args:
+            if self.args and 'label' in self.args:
                 kwargs['label'] = self.args.label
 
-            hive_command = HiveCommand.create(**kwargs)
+            hive_command = self.command_class.create(**kwargs)
 
             logger.info('Started job: %s, Status: %s' % (
                 hive_command.id,
@@ -0,0 +1,383 @@
+'''
+A local Backend that runs Archive's HQL against an embedded sqlite database, so
+that whole builds and runs can be tested in seconds without a cluster.
+
+HQL is translated statement by statement.  Archive's DDL and DML wrappers
+(CREATE DATABASE/VIEW/TABLE AS, CREATE EXTERNAL TABLE, INSERT OVERWRITE, DROP)
+are rewritten for sqlite; SET, RESET, ADD, CREATE TEMPORARY FUNCTION and
+partition maintenance are no-ops; everything else is passed through with a
+handful of common Hive functions available.  sqlite has no databases in Hive's
+sense, so each relation is a table or view named by its qualified name.
+
+External tables are loaded from tab-separated fixture files, found at
+<fixtures>/<database>/<name>.tsv, with empty fields read as NULL.
+'''
+
+import csv
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+
+import tracing
+from hive import Backend
+
+logger = logging.getLogger(__name__)
+
+NAME = r'`?(\w+)\.(\w+)`?'
+NO_OPS = [
+    re.compile(r'^SET\s', re.IGNORECASE),
+    re.compile(r'^RESET$', re.IGNORECASE),
+    re.compile(r'^ADD\s', re.IGNORECASE),
+    re.compile(r'^CREATE\s+TEMPORARY\s+FUNCTION\s', re.IGNORECASE),
+    re.compile(r'^ALTER\s+TABLE\s', re.IGNORECASE),
+]
+CREATE_DATABASE = re.compile(r'^CREATE\s+DATABASE\s', re.IGNORECASE)
+DROP_DATABASE = re.compile(
+    r'^DROP\s+DATABASE\s+(?:IF\s+EXISTS\s+)?`?(\w+)`?',
+    re.IGNORECASE
+)
+DROP = re.compile(
+    r'^DROP\s+(?:TABLE|VIEW)\s+(?:IF\s+EXISTS\s+)?' + NAME,
+    re.IGNORECASE
+)
+CREATE_EXTERNAL_TABLE = re.compile(
+    r'^CREATE\s+EXTERNAL\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + NAME +
+    r'\s*(.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+CREATE_AS = re.compile(
+    r'^CREATE\s+(TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?' + NAME +
+    r'\s+AS\s+(.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+INSERT_OVERWRITE = re.compile(
+    r'^INSERT\s+OVERWRITE\s+TABLE\s+' + NAME +
+    r'\s*(?:PARTITION\s*\(([^)]*)\))?\s*(.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+PARTITIONED_BY = re.compile(r'PARTITIONED\s+BY\s*\(', re.IGNORECASE)
+STATIC_PARTITION = re.compile(r"^\s*(\w+)\s*=\s*('[^']*'|\S+)\s*$")
+CAST_STRING = re.compile(r'\bAS\s+STRING\s*\)', re.IGNORECASE)
+
+
+def statements(hql):
+    '''
+    Splits HQL into statements on semicolons, dropping comments, while
+    respecting quoted strings.
+    '''
+    result = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(hql):
+        c = hql[i]
+        if quote:
+            current.append(c)
+            if c == '\\' and i + 1 < len(hql):
+                current.append(hql[i + 1])
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in ('"', "'", '`'):
+            quote = c
+            current.append(c)
+        elif hql.startswith('--', i):
+            while i < len(hql) and hql[i] != '\n':
+                i += 1
+            continue
+        elif c == ';':
+            result.append(str.join('', current).strip())
+            current = []
+        else:
+            current.append(c)
+        i += 1
+
+    result.append(str.join('', current).strip())
+    return [s for s in result if s]
+
+
+def _columns(definition):
+    '''
+    Column names from a parenthesized list of Hive column definitions, ignoring
+    nested types like array<string> or struct<a:int,b:int>.
+    '''
+    columns = []
+    depth = 0
+    column = []
+    for c in definition:
+        if c in '(<':
+            depth += 1
+        elif c in ')>':
+            depth -= 1
+        if c == ',' and depth == 0:
+            columns.append(str.join('', column))
+            column = []
+        else:
+            column.append(c)
+    columns.append(str.join('', column))
+    return [c.split()[0].strip('`') for c in columns if c.strip()]
+
+
+def _parenthesized(text, start):
+    '''
+    The contents of the parentheses opening at the given index.
+    '''
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i]
+    raise ValueError('Unbalanced parentheses: %s' % text[start:])
+
+
+def _lpad(value, length, pad):
+    if value is None or pad is None:
+        return None
+    value = unicode(value)
+    if len(value) >= length:
+        return value[:length]
+    padding = (pad * length)[:length - len(value)]
+    return padding + value
+
+
+def _concat(*values):
+    if any([v is None for v in values]):
+        return None
+    return str.join('', [unicode(v) for v in values])
+
+
+FUNCTIONS = [
+    ('to_date', 1, lambda t: t and unicode(t)[:10]),
+    ('hour', 1, lambda t: t and int(unicode(t)[11:13])),
+    ('lpad', 3, _lpad),
+    ('concat', -1, _concat),
+    ('rand', 0, random.random),
+]
+
+
+class Local(Backend):
+    def __init__(self, fixtures=None, path=':memory:'):
+        self.fixtures = fixtures
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        for name, arity, function in FUNCTIONS:
+            self.connection.create_function(name, arity, function)
+
+        # Qualified relation names to 'table' or 'view'
+        self.relations = {}
+        self.lock = threading.Lock()
+
+    def set_token(self, api_token):
+        pass
+
+    def run_sync(self, query, log_limit=100, expected=None):
+        if self._warn(query):
+            logger.info(
+                "Running query on local backend: '%s...'" % query[0:log_limit]
+            )
+            with tracing.span('run_sync'), self.lock:
+                return self.execute(query)
+        else:
+            return self.ABORT_MSG
+
+    def run_async(self, query, log_limit=100):
+        return self.run_sync(query, log_limit)
+
+    def execute(self, hql):
+        '''
+        Executes HQL, returning the rows of its last statement with results.
+        '''
+        rows = None
+        for statement in statements(hql):
+            result = self._execute(statement)
+            if result is not None:
+                rows = result
+        self.connection.commit()
+        return rows
+
+    def _execute(self, statement):
+        if any([p.match(statement) for p in NO_OPS]) or \
+                CREATE_DATABASE.match(statement):
+            return None
+
+        match = DROP_DATABASE.match(statement)
+        if match:
+            prefix = '%s.' % match.group(1)
+            for name in self.relations.keys():
+                if name.startswith(prefix):
+                    self._drop(name)
+            return None
+
+        match = DROP.match(statement)
+        if match:
+            self._drop('%s.%s' % match.group(1, 2))
+            return None
+
+        match = CREATE_EXTERNAL_TABLE.match(statement)
+        if match:
+            self._create_external_table(
+                '%s.%s' % match.group(1, 2),
+                match.group(3)
+            )
+            return None
+
+        match = CREATE_AS.match(statement)
+        if match:
+            kind, name = match.group(1).lower(), '%s.%s' % match.group(2, 3)
+            if name not in self.relations:
+                self.connection.execute('CREATE %s "%s" AS %s' % (
+                    kind,
+                    name,
+                    self._translate(match.group(4))
+                ))
+                self.relations[name] = kind
+            return None
+
+        match = INSERT_OVERWRITE.match(statement)
+        if match:
+            self._insert_overwrite(
+                '%s.%s' % match.group(1, 2),
+                match.group(3),
+                match.group(4)
+            )
+            return None
+
+        return self.connection.execute(self._translate(statement)).fetchall()
+
+    def _translate(self, hql):
+        '''
+        Quotes references to known relations and adapts Hive types.
+        '''
+        def quote(match):
+            name = '%s.%s' % match.group(1, 2)
+            if name in self.relations:
+                return '"%s"' % name
+            return match.group(0)
+
+        return CAST_STRING.sub('AS TEXT)', re.sub(NAME, quote, hql))
+
+    def _drop(self, name):
+        kind = self.relations.pop(name, None)
+        if kind:
+            self.connection.execute('DROP %s IF EXISTS "%s"' % (kind, name))
+
+    def _create_external_table(self, name, definition):
+        if name in self.relations:
+            return
+
+        columns = []
+        if definition.startswith('('):
+            columns = _columns(_parenthesized(definition, 0))
+        match = PARTITIONED_BY.search(definition)
+        if match:
+            columns += _columns(_parenthesized(definition, match.end() - 1))
+
+        self.connection.execute('CREATE TABLE "%s" (%s)' % (
+            name,
+            str.join(', ', ['"%s"' % c for c in columns])
+        ))
+        self.relations[name] = 'table'
+        self._load(name, len(columns))
+
+    def _load(self, name, width):
+        if not self.fixtures:
+            return
+
+        path = os.path.join(self.fixtures, *name.split('.')) + '.tsv'
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as f:
+            rows = [
+                [(v.decode('utf-8') if v else None) for v in row]
+                for row in csv.reader(
+                    f,
+                    delimiter='\t',
+                    quoting=csv.QUOTE_NONE
+                )
+                if row
+            ]
+
+        self.connection.executemany(
+            'INSERT INTO "%s" VALUES (%s)' % (
+                name,
+                str.join(', ', ['?'] * width)
+            ),
+            rows
+        )
+        logger.info('Loaded %s rows into %s from %s' % (len(rows), name, path))
+
+    def _insert_overwrite(self, name, partition, select):
+        '''
+        Dynamic partition columns come last in the select, as in Hive; static
+        partition values are spliced in among them, in the order of the
+        partition spec.  As in Hive, only the partitions written are replaced:
+        those of the static values and, for dynamic columns, those the select
+        produces.
+        '''
+        select = self._translate(select)
+        columns = [
+            c.strip() for c in (partition or '').split(',') if c.strip()
+        ]
+        static = [STATIC_PARTITION.match(c) for c in columns]
+
+        if not columns:
+            self.connection.execute('DELETE FROM "%s"' % name)
+            self.connection.execute('INSERT INTO "%s" %s' % (name, select))
+            return
+
+        self.connection.execute(
+            'CREATE TEMP TABLE overwrite AS SELECT * FROM "%s" WHERE 0' % name
+        )
+        self.connection.execute('CREATE TEMP TABLE selected AS %s' % select)
+        try:
+            self.connection.execute(
+                'INSERT INTO overwrite SELECT %s FROM selected' % str.join(
+                    ', ',
+                    self._partitioned_columns(static)
+                )
+            )
+            conditions = [
+                '"%s" = %s' % m.group(1, 2) for m in static if m
+            ]
+            dynamic = [c for c, m in zip(columns, static) if not m]
+            if dynamic:
+                conditions.append(
+                    'EXISTS (SELECT 1 FROM overwrite WHERE %s)' % str.join(
+                        ' AND ', [
+                            'overwrite."%s" IS "%s"."%s"' % (c, name, c)
+                            for c in dynamic
+                        ]
+                    )
+                )
+            self.connection.execute('DELETE FROM "%s" WHERE %s' % (
+                name,
+                str.join(' AND ', conditions)
+            ))
+            self.connection.execute(
+                'INSERT INTO "%s" SELECT * FROM overwrite' % name
+            )
+        finally:
+            self.connection.execute('DROP TABLE overwrite')
+            self.connection.execute('DROP TABLE selected')
+
+    def _partitioned_columns(self, static):
+        '''
+        The columns of the selected rows followed by the partition columns,
+        taking static values in place and dynamic ones from the end of the
+        select.
+        '''
+        names = [
+            '"%s"' % row[1] for row in
+            self.connection.execute('PRAGMA temp.table_info(selected)')
+        ]
+        dynamic = len([m for m in static if not m])
+        trailing = iter(names[len(names) - dynamic:])
+        return names[:len(names) - dynamic] + [
+            m.group(2) if m else next(trailing) for m in static
+        ]
@@ -0,0 +1,144 @@
+'''
+Incremental discovery of the partitions of external tables.  Rather than
+having Hive list an external table's entire location to recover its
+partitions, Archive lists only the partition paths that sort after the last
+one it added, its watermark, and adds them with batched ALTER TABLE ... ADD
+PARTITION statements.  This assumes new partitions sort after old ones, as
+with date and time partitions; a full RECOVER PARTITIONS picks up any others.
+
+Listers are chosen by the scheme of the table's location.  Local paths and
+S3 are supported; others may be added with register.
+'''
+
+import os
+import re
+import urllib
+import urlparse
+
+import boto
+
+PARTITIONED_BY = re.compile(r'PARTITIONED\s+BY\s*\(([^)]*)\)', re.IGNORECASE)
+PARTITION = re.compile(r'^(\w+)=(.+)$')
+
+
+def columns(hql):
+    '''
+    The partition columns declared in an external table's HQL.
+    '''
+    match = PARTITIONED_BY.search(hql)
+    if not match:
+        return []
+    return [
+        c.split()[0].strip('`')
+        for c in match.group(1).split(',')
+        if c.strip()
+    ]
+
+
+def spec(path, partition_columns):
+    '''
+    The partition spec for a partition path like "d=2014-01-01/h=00", as
+    (column, value) pairs, or None if it doesn't match the given columns.
+    '''
+    pairs = []
+    for segment in path.strip('/').split('/'):
+        match = PARTITION.match(segment)
+        if not match:
+            return None
+        pairs.append((match.group(1), urllib.unquote(match.group(2))))
+
+    if [column for column, _ in pairs] != partition_columns:
+        return None
+    return pairs
+
+
+class Lister(object):
+    '''
+    Lists the partition paths under a location.
+    '''
+    def list(self, location, depth, after=None):
+        '''
+        The sorted partition paths, relative to the location and depth
+        directories deep, that sort after the given path, if any.
+        '''
+        raise NotImplementedError('Implemented in subclasses')
+
+
+class LocalLister(Lister):
+    def list(self, location, depth, after=None):
+        root = urlparse.urlparse(location).path if '://' in location \
+            else location
+        paths = ['']
+        for _ in range(depth):
+            paths = [
+                os.path.join(path, name) if path else name
+                for path in paths
+                for name in sorted(os.listdir(os.path.join(root, path)))
+                if os.path.isdir(os.path.join(root, path, name)) and
+                PARTITION.match(name)
+            ]
+        return [p for p in paths if after is None or p > after]
+
+
+class S3Lister(Lister):
+    '''
+    Lists partitions with delimited S3 listings, starting each level after
+    the watermark's directory at that level, so that older partitions are
+    never listed.
+    '''
+    def __init__(self, connection=None):
+        self.connection = connection
+
+    def list(self, location, depth, after=None):
+        if self.connection is None:
+            self.connection = boto.connect_s3()
+
+        url = urlparse.urlparse(location)
+        bucket = self.connection.get_bucket(url.netloc, validate=False)
+        prefix = url.path.lstrip('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+
+        after_segments = after.split('/') if after else None
+        paths = self._list(bucket, prefix, depth, after_segments)
+        return sorted([
+            p[len(prefix):].rstrip('/') for p in paths
+            if after is None or p[len(prefix):].rstrip('/') > after
+        ])
+
+    def _list(self, bucket, prefix, depth, after):
+        if depth == 0:
+            return [prefix]
+
+        marker = prefix + after[0] if after else ''
+        paths = []
+        for entry in bucket.list(prefix=prefix, delimiter='/', marker=marker):
+            name = entry.name[len(prefix):].rstrip('/')
+            if not entry.name.endswith('/') or not PARTITION.match(name):
+                continue
+
+            # Only directories sharing the watermark's prefix need be listed
+            # from the watermark on; later ones are new throughout
+            below = after[1:] if after and name == after[0] else None
+            paths.extend(self._list(bucket, entry.name, depth - 1, below))
+        return paths
+
+
+LISTERS = {
+    '': LocalLister,
+    'file': LocalLister,
+    's3': S3Lister,
+    's3n': S3Lister,
+    's3a': S3Lister,
+}
+
+
+def register(scheme, lister_class):
+    LISTERS[scheme] = lister_class
+
+
+def lister(location):
+    scheme = urlparse.urlparse(location).scheme
+    if scheme not in LISTERS:
+        raise ValueError('No partition lister for location %s' % location)
+    return LISTERS[scheme]()
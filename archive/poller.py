@@ -0,0 +1,277 @@
+'''
+A single poller for all in-flight QDS commands.  Rather than each caller
+sleeping and polling its own command, callers register their commands with a
+shared Poller and block until it wakes them; the Poller refreshes outstanding
+commands from one background thread, each on its own schedule.
+'''
+
+import logging
+import threading
+import time
+
+from requests.exceptions import ConnectionError
+
+from qds_sdk.commands import HiveCommand
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+MINIMUM_INTERVAL = 1.0
+MAXIMUM_INTERVAL = 120.0
+
+# How long polling may fail to connect before a command's caller gives up
+OUTAGE = 300.0
+
+
+class _Pending(object):
+    def __init__(self, command, interval, cap, now):
+        self.command = command
+        self.error = None
+        self.done = threading.Event()
+
+        # When the command was submitted, as far as we know, and first seen
+        # running, if it was, and how many polls of it failed to connect
+        self.submitted = tracing.now()
+        self.started = None
+        self.retries = 0
+
+        # Polling schedule, in the Poller's clock time
+        self.interval = interval
+        self.cap = cap
+        self.polled = now
+        self.due = now + interval
+        self.failures = 0
+        self.failing = None
+
+
+class Poller(object):
+    '''
+    Tracks outstanding commands by id and polls each on its own schedule,
+    waking each waiting caller as its command reaches a done status.
+
+    A command is first polled after the given interval, then at intervals
+    that grow geometrically up to a cap, so that quick DDL is noticed quickly
+    while long queries aren't polled needlessly often.  The cap is a fraction
+    of the command's expected duration, if known, within the interval and the
+    maximum.  Connection failures back a command's polls off further from its
+    current interval, up to the maximum, and its schedule is restored once a
+    poll succeeds; once polls have failed for the given outage, in seconds,
+    its caller receives the error.
+    '''
+    def __init__(self, command_class=HiveCommand, interval=None,
+                 outage=OUTAGE, clock=time, maximum=MAXIMUM_INTERVAL,
+                 backoff=1.5, fraction=0.1):
+        self.command_class = command_class
+        self.interval = interval or MINIMUM_INTERVAL
+        self.outage = outage
+        self.clock = clock
+        self.maximum = max(maximum, self.interval)
+        self.backoff = backoff
+        self.fraction = fraction
+
+        self.outstanding = {}
+        self.observed = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+        # Metrics: finds made, and for each command seen done, the time
+        # since its previous poll, which bounds how late it was noticed
+        self.api_calls = 0
+        self.lags = []
+
+    def wait(self, command, expected=None):
+        '''
+        Blocks until the given command is done and returns its final state.
+        The command's expected duration, in seconds, sets how far its polls
+        back off.
+        '''
+        if self.command_class.is_done(command.status):
+            return command
+
+        pending = _Pending(
+            command,
+            self.interval,
+            self._cap(expected),
+            self.clock.time()
+        )
+        with self.lock:
+            self.outstanding[command.id] = pending
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop)
+                self.thread.daemon = True
+                self.thread.start()
+
+        pending.done.wait()
+        if pending.error:
+            raise pending.error
+        return pending.command
+
+    def _cap(self, expected):
+        if expected is None:
+            return self.maximum
+        return min(max(expected * self.fraction, self.interval), self.maximum)
+
+    def tick(self):
+        '''
+        Polls every outstanding command that is due, waking the callers of
+        those that are done.
+        '''
+        now = self.clock.time()
+        with self.lock:
+            due = [
+                (command_id, pending)
+                for command_id, pending in self.outstanding.items()
+                if pending.due <= now
+            ]
+
+        with tracing.span('poll', commands=len(due)):
+            for command_id, pending in due:
+                try:
+                    self._poll(command_id, pending)
+                except Exception as error:
+                    # Anything but a connection failure isn't retried, and
+                    # goes to the caller rather than killing the thread
+                    logger.error(
+                        'Polling command %s failed: %s' % (command_id, error)
+                    )
+                    self._fail(command_id, pending, error)
+
+    def _poll(self, command_id, pending):
+        with self.lock:
+            self.api_calls += 1
+
+        try:
+            command = self.command_class.find(command_id)
+        except ConnectionError as error:
+            self._failed(command_id, pending, error)
+            return
+
+        now = self.clock.time()
+        if pending.failures:
+            logger.info('Reconnected polling command %s' % command_id)
+            pending.failures = 0
+            pending.failing = None
+
+        # A command already done when first seen started at some unknown
+        # time since submission, so started is left unset
+        done = self.command_class.is_done(command.status)
+        if pending.started is None and command.status == 'running':
+            pending.started = tracing.now()
+
+        if not done:
+            pending.interval = min(
+                pending.interval * self.backoff,
+                pending.cap
+            )
+            pending.polled = now
+            pending.due = now + pending.interval
+            return
+
+        with self.lock:
+            del self.outstanding[command_id]
+            self.observed[command_id] = {
+                'started': pending.started,
+                'retries': pending.retries,
+            }
+            self.lags.append(now - pending.polled)
+        self._traced(pending, command)
+        pending.command = command
+        pending.done.set()
+
+    def _failed(self, command_id, pending, error):
+        now = self.clock.time()
+        pending.retries += 1
+        pending.failures += 1
+        if pending.failing is None:
+            pending.failing = now
+
+        remaining = pending.failing + self.outage - now
+        if remaining <= 0:
+            logger.error(
+                'Polling retries exhausted for command %s' % command_id
+            )
+            self._fail(command_id, pending, error)
+            return
+
+        # The last retry comes as the outage runs out
+        backoff = min(
+            pending.interval * self.backoff ** pending.failures,
+            self.maximum,
+            remaining
+        )
+        pending.due = now + backoff
+        logger.error((
+            'Received ConnectionError: %s, '
+            'Retrying command %s in %s seconds (%.0f seconds remaining)' % (
+                error,
+                command_id,
+                backoff,
+                remaining
+            )
+        ))
+
+    def _fail(self, command_id, pending, error):
+        with self.lock:
+            self.outstanding.pop(command_id, None)
+        pending.error = error
+        pending.done.set()
+
+    def _traced(self, pending, command):
+        track = 'command %s' % command.id
+        if pending.started is not None:
+            tracing.complete(
+                'queued',
+                pending.submitted,
+                pending.started,
+                track,
+                command=command.id
+            )
+        tracing.complete(
+            'executing',
+            pending.started or pending.submitted,
+            tracing.now(),
+            track,
+            command=command.id,
+            status=command.status
+        )
+
+    def _loop(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.outstanding:
+                        self.thread = None
+                        return
+                    due = min([p.due for p in self.outstanding.values()])
+
+                # Wake at least every interval, for newly submitted commands
+                delay = min(due - self.clock.time(), self.interval)
+                if delay > 0:
+                    self.clock.sleep(delay)
+                self.tick()
+        except Exception as error:
+            # Fail every caller rather than leave them waiting on a dead thread
+            logger.error('Poller failed: %s' % error)
+            with self.lock:
+                failed = self.outstanding.items()
+                self.thread = None
+            for command_id, pending in failed:
+                self._fail(command_id, pending, error)
+        finally:
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+    def metrics(self):
+        '''
+        The number of API calls made, and the mean bound on how late commands
+        were noticed to be done: the time between their last two polls.
+        '''
+        with self.lock:
+            lags = list(self.lags)
+        return {
+            'api_calls': self.api_calls,
+            'commands': len(lags),
+            'mean_detection_lag': sum(lags) / len(lags) if lags else None,
+        }
@@ -0,0 +1,63 @@
+'''
+Optimization of the resources, functions and settings that preface queries.
+Each query's HQL adds its own resources, creates its own temporary functions
+and sets its own settings (see Query._command_hql).  When several queries run
+as one script, resources and functions are hoisted to the start of the script
+and emitted once each, while settings are scoped to the query that set them.
+'''
+
+import collections
+import re
+
+RESOURCE = re.compile(r'^ADD\s+\w+\s+\S+;$', re.IGNORECASE)
+FUNCTION = re.compile(
+    r'^CREATE\s+TEMPORARY\s+FUNCTION\s+.+;$',
+    re.IGNORECASE
+)
+SETTING = re.compile(r'^SET\s+[^=\s]+\s*=.*;$', re.IGNORECASE)
+RESET = 'RESET;'
+
+
+def split(hql):
+    '''
+    Splits HQL into its resources, functions, settings and remaining body.
+    '''
+    resources = []
+    functions = []
+    settings = []
+    body = []
+    for line in hql.split('\n'):
+        statement = line.strip()
+        if RESOURCE.match(statement):
+            resources.append(statement)
+        elif FUNCTION.match(statement):
+            functions.append(statement)
+        elif SETTING.match(statement):
+            settings.append(statement)
+        else:
+            body.append(line)
+
+    return resources, functions, settings, str.join('\n', body).strip()
+
+
+def script(hqls):
+    '''
+    Combines HQL into a single script, adding each distinct resource and
+    function once at the start and resetting settings after each query that
+    changes them, so they don't leak into the next.
+    '''
+    resources = collections.OrderedDict()
+    functions = collections.OrderedDict()
+    scoped = []
+    for hql in hqls:
+        hql_resources, hql_functions, settings, body = split(hql)
+        resources.update([(r, None) for r in hql_resources])
+        functions.update([(f, None) for f in hql_functions])
+
+        if settings:
+            scoped.append(str.join('\n', settings + [body, RESET]))
+        else:
+            scoped.append(body)
+
+    preamble = str.join('\n', resources.keys() + functions.keys())
+    return str.join('\n\n', [s for s in [preamble] + scoped if s])
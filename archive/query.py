@@ -1,6 +1,26 @@
+import graph
+import tracing
 from workflow import Utilities
 
 
+class Created(object):
+    '''
+    The queries created so far while generating HQL, along with their
+    databases, supporting constant time membership checks.
+    '''
+    def __init__(self):
+        self.queries = set()
+        self.databases = set()
+
+    def __contains__(self, query):
+        return query in self.queries
+
+    def add(self, query):
+        self.queries.add(query)
+        if hasattr(query, 'database'):
+            self.databases.add(query.database)
+
+
 class Query(Utilities):
     '''
     Archive's notion of a Hive query, Queries form the nodes of the DAG managed
@@ -14,16 +34,18 @@ class Query(Utilities):
         self.resources = kwargs.get('resources', [])
         self.functions = kwargs.get('functions', [])
 
+        # Scheduling hints: queries of higher priority run first when more are
+        # ready than can run, and a duration in seconds overrides estimates
+        # from past runs
+        self.priority = kwargs.get('priority', 0)
+        self.duration = kwargs.get('duration')
+
     def graph(self, **kwargs):
-        return self._graph({
-            'offset': 0,
-            'references': {},
-        }, **kwargs)
+        return str.join('\n', graph.text([self]))
 
-    def hql(self):
-        template = self.archive.env.get_template(self.template)
-        inputs = dict([(i.name, i.qualified_name()) for i in self.inputs])
-        return template.render(inputs=inputs)
+    def hql(self, **context):
+        with tracing.span('render', query=self.name):
+            return self.archive.render_cache.render(self, **context)
 
     def _command_hql(self):
         resources_hql = ''
@@ -38,7 +60,7 @@ class Query(Utilities):
             )
 
         settings_hql = ''
-        for key, value in self.settings.iteritems():
+        for key, value in sorted(self.settings.iteritems()):
             settings_hql += 'SET %s=%s;\n' % (key, value)
 
         return '%s\n%s\n%s' % (
@@ -50,5 +72,22 @@ class Query(Utilities):
     def run_hql(self):
         return []
 
-    def _create_sub_hql(self, created):
+    def explain_hql(self):
+        '''
+        HQL to EXPLAIN the query, if it does any work to explain.
+        '''
+        return None
+
+    def _explain_hql(self, statement):
+        return '''
+{command_hql}
+EXPLAIN
+{statement}
+;
+'''.format(
+            command_hql=Query._command_hql(self),
+            statement=statement,
+        ).strip()
+
+    def _create_sub_steps(self, created, **kwargs):
         return []
@@ -1,6 +1,10 @@
+import hashlib
 import itertools
 
-from query import Query
+import explain
+import partitions
+from executor import Executor, plan
+from query import Created, Query
 from workflow import DDLWorkflow
 
 
@@ -12,25 +16,15 @@ class Relation(Query, DDLWorkflow):
     def qualified_name(self):
         return '%s.%s' % (self.database, self.name)
 
-    def _graph(self, context, **kwargs):
-        if self.name not in context['references']:
-            context['references'][self.name] = 0
-        context['references'][self.name] += 1
-
-        if context['references'][self.name] > 1:
-            return '%s%s ...' % ('\t' * context['offset'], self)
-        else:
-            context['offset'] += 1
-            input_graph = str.join(
-                '\n',
-                [i._graph(context, **kwargs) for i in self.inputs]
-            ).rstrip()
-            context['offset'] -= 1
-
-            graph_str = '%s%s\n%s' % (
-                '\t' * context['offset'], self, input_graph
-            )
-            return graph_str.rstrip()
+    def _graph_node(self, references):
+        '''
+        The relation's label in a text graph and the queries under it: its
+        inputs, unless it has already been rendered.
+        '''
+        references[self.name] = references.get(self.name, 0) + 1
+        if references[self.name] > 1:
+            return '%s ...' % self, []
+        return str(self), list(self.inputs)
 
     def _stats(self, **kwargs):
         stats = self.archive.stats
@@ -67,15 +61,24 @@ class Relation(Query, DDLWorkflow):
     def drop_hql(self):
         return 'DROP TABLE IF EXISTS %s;' % self.qualified_name()
 
-    def build(self):
-        return self.archive.hive.run_all_sync(self.build_hql())
+    def build(self, **kwargs):
+        executor = Executor(self.archive.hive, kwargs.get('parallelism', 1))
+        return executor.run_all_sync(plan(self._create_all_steps()))
 
     def build_hql(self):
         return self._create_all_hql()
 
+    def _key(self, keys):
+        created = Created()
+        created.databases.add(self.database)
+
+        key = hashlib.sha1(self._create_hql(created).encode('utf-8'))
+        for i in self.inputs:
+            key.update(keys[i.name])
+        return key.hexdigest()
+
     def _create_database_hql(self, created):
-        created_databases = set([c.database for c in created])
-        if self.database in created_databases:
+        if self.database in created.databases:
             return ''
         else:
             return 'CREATE DATABASE IF NOT EXISTS %s;' % self.database
@@ -84,7 +87,7 @@ class Relation(Query, DDLWorkflow):
         return self.archive.hive.run_sync(self.create_hql())
 
     def create_hql(self):
-        return self._create_hql([])
+        return self._create_hql(Created())
 
     def create_tables(self):
         return self.archive.hive.run_all_sync(self.create_tables_hql())
@@ -102,52 +105,133 @@ class Relation(Query, DDLWorkflow):
         ).strip()
 
     def _create_all_hql(self, **kwargs):
-        return self._create_sub_hql([], **kwargs)
+        return [hql for _, hql in self._create_all_steps(**kwargs)]
+
+    def _create_all_steps(self, **kwargs):
+        return self._create_sub_steps(Created(), **kwargs)
 
-    def _create_sub_hql(self, created, **kwargs):
+    def _create_sub_steps(self, created, **kwargs):
         if self in created:
             return []
         else:
-            inputs_create_hql = list(itertools.chain(*[
-                i._create_sub_hql(created, **kwargs) for i in self.inputs
+            inputs_create_steps = list(itertools.chain(*[
+                i._create_sub_steps(created, **kwargs) for i in self.inputs
             ]))
             create_hql = self._create_hql(created)
 
             create_tables_only = kwargs.get('create_tables_only', False)
             if not create_tables_only:
-                inputs_create_hql.append(create_hql)
+                inputs_create_steps.append((self, create_hql))
             elif create_tables_only and \
                     hasattr(self, 'view_or_table') and \
                     self.view_or_table == 'TABLE':
-                inputs_create_hql.append(create_hql)
+                inputs_create_steps.append((self, create_hql))
 
-            created.append(self)
-            return inputs_create_hql
+            created.add(self)
+            return inputs_create_steps
 
 
 class ExternalTable(Relation):
     def __init__(self, database, name, *inputs, **kwargs):
         super(ExternalTable, self).__init__(database, name, *inputs, **kwargs)
         self.partitioned = kwargs.get('partitioned', False)
+        self.location = kwargs.get('location')
 
     def __str__(self):
         return 'ExternalTable(%s)' % self.qualified_name()
 
+    @property
+    def metadata_only(self):
+        # Recovering partitions lists the table's location, which may take
+        # many minutes
+        return not self.partitioned
+
     def _show(self, context):
         context['external_tables'].append(self.qualified_name())
 
-    def recover_partitions(self):
-        return self.archive.hive.run_sync(self.recover_partitions_hql())
-
-    def recover_partitions_hql(self):
-        if self.partitioned:
+    def recover_partitions(self, **kwargs):
+        '''
+        Recovers the table's partitions.  Given Watermarks, and the table's
+        location, only partitions new since the last recovery are added, and
+        the table's watermark is advanced once they have been.
+        '''
+        hql, last = self._recovery(**kwargs)
+        if not hql:
+            return None
+
+        result = self.archive.hive.run_sync(hql)
+        if result != self.archive.hive.ABORT_MSG:
+            self._recovered(last, **kwargs)
+        return result
+
+    def recover_partitions_hql(self, **kwargs):
+        return self._recovery(**kwargs)[0]
+
+    def _recovery(self, **kwargs):
+        '''
+        The HQL recovering the table's partitions, and the last partition path
+        it adds, if it adds new partitions incrementally.
+        '''
+        watermarks = kwargs.get('watermarks')
+        if self._incremental(watermarks):
+            paths = self.new_partitions(watermarks.get(self.qualified_name()))
+            return str.join('\n', self.add_partitions_hql(
+                paths,
+                kwargs.get('batch_size', 100)
+            )), paths[-1] if paths else None
+        elif self.partitioned:
             return \
                 'ALTER TABLE `{database}.{name}` RECOVER PARTITIONS;'.format(
                     database=self.database,
                     name=self.name,
-                )
+                ), None
         else:
-            return ''
+            return '', None
+
+    def _recovered(self, last, **kwargs):
+        watermarks = kwargs.get('watermarks')
+        if last is not None and watermarks is not None:
+            watermarks.advance(self.qualified_name(), last)
+            watermarks.save()
+
+    def _incremental(self, watermarks):
+        return bool(
+            self.partitioned and self.location and watermarks is not None
+        )
+
+    def new_partitions(self, watermark=None):
+        '''
+        The partition paths under the table's location that sort after the
+        given watermark, skipping any that don't match its partition columns.
+        '''
+        columns = partitions.columns(self.hql())
+        paths = partitions.lister(self.location).list(
+            self.location,
+            len(columns),
+            watermark
+        )
+        return [p for p in paths if partitions.spec(p, columns)]
+
+    def add_partitions_hql(self, paths, batch_size=100):
+        '''
+        Statements adding the given partition paths, batch_size partitions to
+        a statement.
+        '''
+        columns = partitions.columns(self.hql())
+        specs = [
+            'PARTITION (%s)' % str.join(', ', [
+                "%s='%s'" % (column, value.replace("'", "\\'"))
+                for column, value in partitions.spec(path, columns)
+            ])
+            for path in paths
+        ]
+        return [
+            'ALTER TABLE `%s` ADD IF NOT EXISTS\n%s;' % (
+                self.qualified_name(),
+                str.join('\n', specs[i:i + batch_size])
+            )
+            for i in range(0, len(specs), batch_size)
+        ]
 
     def _create_hql(self, created):
         return '''
@@ -171,6 +255,10 @@ class ViewOrTable(Relation):
         self.view_or_table = view_or_table
         super(ViewOrTable, self).__init__(database, name, *inputs, **kwargs)
 
+    @property
+    def metadata_only(self):
+        return self.view_or_table == 'VIEW'
+
     def _show(self, context):
         if self.view_or_table == 'TABLE':
             context['tables'].append(self.qualified_name())
@@ -201,6 +289,9 @@ CREATE {view_or_table} IF NOT EXISTS {database}.{name} AS
         stats = Relation._stats(self, **kwargs)
         return stats
 
+    def explain_hql(self):
+        return self._explain_hql(self.hql())
+
     def __str__(self):
         return '%s(%s)' % (self.view_or_table.title(), self.qualified_name())
 
@@ -213,3 +304,46 @@ class Table(ViewOrTable):
 class View(ViewOrTable):
     def __init__(self, database, name, *inputs, **kwargs):
         super(View, self).__init__(database, name, 'VIEW', *inputs, **kwargs)
+
+
+class ViewUntilTable(ViewOrTable):
+    '''
+    A view until it's worth materializing as a table.  A view's SELECT is
+    recomputed by every query that reads it, along with those of any views it
+    reads, so Archive.optimize materializes a ViewUntilTable read by enough
+    queries, or expensive enough, that computing it once saves more than the
+    threshold.  Its cost may be hinted relative to that of a simple view, or
+    else comes from its EXPLAIN plan, or the number of views stacked in it;
+    materialize forces the decision either way.
+    '''
+    def __init__(self, database, name, *inputs, **kwargs):
+        super(ViewUntilTable, self).__init__(
+            database,
+            name,
+            'VIEW',
+            *inputs,
+            **kwargs
+        )
+        self.cost = kwargs.get('cost')
+        self.materialize = kwargs.get('materialize')
+
+    def _optimize(self, consumers, depth, threshold, plan=None):
+        '''
+        Decides whether to materialize, given the number of queries that read
+        the view, the number of views stacked in it, itself included, and its
+        EXPLAIN plan, if it has been explained, which gives its cost in place
+        of a hint.
+        '''
+        if self.materialize is not None:
+            materialize = self.materialize
+        else:
+            cost = self.cost
+            if cost is None:
+                cost = depth
+                if plan and plan['stages']:
+                    cost = explain.cost(plan)
+            materialize = consumers > 1 and \
+                (consumers - 1) * cost >= threshold
+
+        self.view_or_table = 'TABLE' if materialize else 'VIEW'
+        return materialize
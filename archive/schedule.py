@@ -0,0 +1,91 @@
+'''
+Critical-path scheduling.  When more queries are ready than can run at once,
+those at the head of the longest chains of remaining work go first, so that
+short queries off the critical path don't hold up long ones on it.
+'''
+
+
+def _successors(archive, query):
+    '''
+    The queries that wait on the given query: those that read it, and those
+    that read a table it writes.
+    '''
+    downstream = archive.downstream
+    successors = list(downstream.get(query.name, []))
+    if hasattr(query, 'external_table'):
+        successors.extend(downstream.get(query.external_table.name, []))
+    return successors
+
+
+def remaining(archive, estimates, include=None):
+    '''
+    The estimated remaining critical path of each query in the Archive, by
+    name: its own estimated duration plus the longest remaining critical path
+    of the queries that wait on it.  Queries for which include is false, e.g.
+    statements during a build, take no time but still connect the queries
+    either side of them.
+    '''
+    lengths = {}
+    for root in archive.order:
+        visiting = set()
+        stack = [(root, False)]
+        while stack:
+            query, expanded = stack.pop()
+            if query.name in lengths:
+                continue
+
+            successors = _successors(archive, query)
+            if not expanded:
+                visiting.add(query.name)
+                stack.append((query, True))
+                stack.extend([
+                    (s, False) for s in successors
+                    if s.name not in lengths and s.name not in visiting
+                ])
+                continue
+
+            duration = 0.0
+            if include is None or include(query):
+                duration = estimates.estimate(query)
+            lengths[query.name] = duration + max(
+                [lengths.get(s.name, 0.0) for s in successors] or [0.0]
+            )
+    return lengths
+
+
+def critical_path(archive, estimates, include=None):
+    '''
+    The names of the queries on the Archive's longest chain of estimated
+    work, in order, along with its estimated duration.
+    '''
+    lengths = remaining(archive, estimates, include)
+    if not lengths:
+        return [], 0.0
+
+    query = max(archive.order, key=lambda q: lengths[q.name])
+    duration = lengths[query.name]
+    path = [query.name]
+    while True:
+        successors = _successors(archive, query)
+        if not successors:
+            break
+        query = max(successors, key=lambda s: lengths[s.name])
+        path.append(query.name)
+
+    return path, duration
+
+
+def rank(archive, estimates, include=None):
+    '''
+    A key by which to order ready Jobs for the Executor: explicit priority
+    first, then the longest remaining critical path.
+    '''
+    lengths = remaining(archive, estimates, include)
+
+    def key(job):
+        return (
+            -getattr(job.query, 'priority', 0),
+            -lengths.get(job.name, 0.0)
+        )
+
+    return key
@@ -0,0 +1,105 @@
+'''
+Selection of slices of an Archive's DAG.  A selector is a comma-separated
+union of terms, each a query name, relation name like db.name or glob like
+db.*, and optionally prefixed by + to include everything upstream, suffixed
+by + to include everything downstream, or prefixed by - to exclude rather
+than include.  At least one term must include.  For example:
+
+    +searches               searches and everything it reads
+    partitioned_events+     partitioned_events and everything reading it
+    events.*,-events.tmp    every relation in events but tmp
+
+Downstream of a statement are the table it writes and that table's readers,
+and upstream of a relation are the statements that write it.  Globs match
+relation names, and so only relations, as well as query names.
+'''
+
+import fnmatch
+
+
+def select(archive, selector):
+    '''
+    The queries the selector selects, in topological order.
+    '''
+    included = set()
+    excluded = set()
+    includes = False
+    for term in selector.split(','):
+        term = term.strip()
+        if not term:
+            continue
+
+        if term.startswith('-'):
+            excluded.update(_term(archive, term[1:]))
+        else:
+            includes = True
+            included.update(_term(archive, term))
+
+    if not includes:
+        raise ValueError('Selector %s includes nothing' % selector)
+    return [
+        query for query in archive.order
+        if query.name in included and query.name not in excluded
+    ]
+
+
+def _term(archive, term):
+    upstream = term.startswith('+')
+    downstream = term.endswith('+') and len(term) > 1
+    pattern = term.strip('+')
+
+    names = match(archive, pattern)
+    selected = set(names)
+    if upstream:
+        selected.update(_closure(archive, names, _predecessors))
+    if downstream:
+        selected.update(_closure(archive, names, _successors))
+    return selected
+
+
+def match(archive, pattern):
+    '''
+    The names of the queries whose name, or relation name, matches the
+    pattern.
+    '''
+    names = [
+        query.name for query in archive.order
+        if fnmatch.fnmatchcase(query.name, pattern) or (
+            hasattr(query, 'qualified_name') and
+            fnmatch.fnmatchcase(query.qualified_name(), pattern)
+        )
+    ]
+    if not names:
+        raise ValueError('No queries match %s' % pattern)
+    return names
+
+
+def _predecessors(archive, name):
+    query = archive.lookup(name)
+    predecessors = [i.name for i in query.inputs]
+    predecessors.extend([w.name for w in archive.writers.get(name, [])])
+    if hasattr(query, 'external_table'):
+        predecessors.append(query.external_table.name)
+    return predecessors
+
+
+def _successors(archive, name):
+    query = archive.lookup(name)
+    successors = [d.name for d in archive.downstream.get(name, [])]
+    if hasattr(query, 'external_table'):
+        table = query.external_table.name
+        successors.append(table)
+        successors.extend([d.name for d in archive.downstream.get(table, [])])
+    return successors
+
+
+def _closure(archive, names, neighbors):
+    seen = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        for n in neighbors(archive, name):
+            if n not in seen:
+                seen.add(n)
+                stack.append(n)
+    return seen
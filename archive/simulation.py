@@ -0,0 +1,321 @@
+'''
+An in-process stand-in for QDS, for measuring changes to how Archive submits
+and polls commands without a cluster.  A Service simulates HiveCommands with
+configurable durations, queueing, failures and connection errors, or replays a
+session captured by a Recorder.  Pass its command class and clock to Qubole:
+
+    service = Service(durations=lambda query, rng: rng.uniform(5, 50))
+    hive = Qubole(service.command_class(), service.clock, poll_interval=5)
+
+A VirtualClock makes no real waits and is deterministic so long as commands
+are polled from a single thread, as in serial runs.  Concurrent runs should
+use a ScaledClock, which runs in accelerated real time.
+'''
+
+import collections
+import hashlib
+import heapq
+import json
+import random
+import sys
+import threading
+import time
+
+from requests.exceptions import ConnectionError
+
+from qds_sdk.commands import Command, HiveCommand
+
+
+class VirtualClock(object):
+    def __init__(self, start=0.0):
+        self.now = start
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class ScaledClock(object):
+    '''
+    Real time, sped up by the given factor.
+    '''
+    def __init__(self, speed=100.0):
+        self.speed = speed
+        self.start = time.time()
+
+    def time(self):
+        return (time.time() - self.start) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+def _hash(query):
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+class _Command(object):
+    def __init__(self, id, query, label, submitted, started, finished,
+                 outcome):
+        self.id = id
+        self.query = query
+        self.label = label
+        self.submitted = submitted
+        self.started = started
+        self.finished = finished
+        self.outcome = outcome
+        self.detected = None
+        self.log = 'Simulated command %s: %s' % (id, outcome)
+
+    def status(self, now):
+        if now < self.started:
+            return 'waiting'
+        elif now < self.finished:
+            return 'running'
+        return self.outcome
+
+
+class SimulatedHiveCommand(object):
+    '''
+    The subset of the HiveCommand API that Archive uses, backed by a Service;
+    see Service.command_class.
+    '''
+    service = None
+
+    is_done = staticmethod(Command.is_done)
+    is_success = staticmethod(Command.is_success)
+
+    def __init__(self, id, status):
+        self.id = id
+        self.status = status
+
+    def __str__(self):
+        return 'SimulatedHiveCommand(%s, %s)' % (self.id, self.status)
+
+    @classmethod
+    def create(cls, **kwargs):
+        return cls(*cls.service.create(**kwargs))
+
+    @classmethod
+    def find(cls, id):
+        return cls(*cls.service.find(id))
+
+    def get_log(self):
+        return self.service.commands[self.id].log
+
+    def get_results(self, fp=sys.stdout, inline=True, delim=None):
+        fp.write('')
+
+
+class Service(object):
+    '''
+    Simulates QDS.  Each command waits for one of a limited number of slots,
+    if given, then runs for a duration drawn from the durations function,
+    called with the query and a seeded random.Random.  Commands fail at the
+    given failure rate, and finds raise ConnectionError at the given rate.
+
+    Given a recording (see Recorder), commands instead take the queue wait,
+    duration and outcome recorded for the same query, or for the command
+    recorded in the same position if the query wasn't recorded.
+    '''
+    def __init__(self, clock=None, durations=None, slots=None,
+                 failure_rate=0.0, connection_error_rate=0.0, seed=0,
+                 recording=None):
+        self.clock = clock or VirtualClock()
+        self.durations = durations or (lambda query, rng: rng.uniform(1, 60))
+        self.slots = [self.clock.time()] * slots if slots else None
+        self.failure_rate = failure_rate
+        self.connection_error_rate = connection_error_rate
+        self.rng = random.Random(seed)
+
+        self.recorded = None
+        if recording is not None:
+            self.recorded = collections.defaultdict(collections.deque)
+            for record in recording['commands']:
+                self.recorded[record['query_hash']].append(record)
+            self.recorded_in_order = collections.deque(recording['commands'])
+
+        self.commands = collections.OrderedDict()
+        self.api_calls = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def replay(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(recording=json.load(f), **kwargs)
+
+    def command_class(self):
+        return type(
+            'SimulatedHiveCommand',
+            (SimulatedHiveCommand,),
+            {'service': self}
+        )
+
+    def create(self, query, label=None, **kwargs):
+        with self.lock:
+            self.api_calls += 1
+            now = self.clock.time()
+
+            if self.recorded is not None:
+                record = self._recorded(query)
+                wait = record['started'] - record['submitted']
+                duration = record['finished'] - record['started']
+                outcome = record['status']
+            else:
+                wait = 0.0
+                duration = self.durations(query, self.rng)
+                outcome = 'done'
+                if self.rng.random() < self.failure_rate:
+                    outcome = 'error'
+
+            started = now + wait
+            if self.slots is not None:
+                started = max(started, heapq.heappop(self.slots))
+                heapq.heappush(self.slots, started + duration)
+
+            command = _Command(
+                len(self.commands) + 1,
+                query,
+                label,
+                now,
+                started,
+                started + duration,
+                outcome
+            )
+            self.commands[command.id] = command
+            return command.id, command.status(now)
+
+    def find(self, id):
+        with self.lock:
+            self.api_calls += 1
+            if self.rng.random() < self.connection_error_rate:
+                raise ConnectionError('Simulated connection failure')
+
+            now = self.clock.time()
+            command = self.commands[id]
+            status = command.status(now)
+            if Command.is_done(status) and command.detected is None:
+                command.detected = now
+            return id, status
+
+    def _recorded(self, query):
+        by_query = self.recorded.get(_hash(query))
+        if by_query:
+            record = by_query.popleft()
+            self.recorded_in_order.remove(record)
+        else:
+            record = self.recorded_in_order.popleft()
+            self.recorded[record['query_hash']].remove(record)
+        return record
+
+    def report(self):
+        commands = self.commands.values()
+        if not commands:
+            return {'commands': 0, 'api_calls': self.api_calls}
+
+        detected = [c for c in commands if c.detected is not None]
+        return {
+            'commands': len(commands),
+            'api_calls': self.api_calls,
+            'failed': len([c for c in commands if c.outcome != 'done']),
+            'makespan': (
+                max([c.finished for c in commands]) -
+                min([c.submitted for c in commands])
+            ),
+            'mean_queue_wait': _mean([c.started - c.submitted
+                                      for c in commands]),
+            'mean_detection_lag': _mean([c.detected - c.finished
+                                         for c in detected]),
+        }
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+class Recorder(object):
+    '''
+    Records a session's commands as they are created and polled, for replay
+    by a Service.  Start and finish times are those at which the command was
+    first observed running or done.
+    '''
+    def __init__(self, command_class=HiveCommand, clock=time):
+        self.inner = command_class
+        self.clock = clock
+        self.start = clock.time()
+        self.records = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def command_class(self):
+        return type(
+            'RecordingHiveCommand',
+            (_RecordingCommand,),
+            {'recorder': self}
+        )
+
+    def _created(self, command, kwargs):
+        now = self.clock.time() - self.start
+        with self.lock:
+            self.records[command.id] = {
+                'query_hash': _hash(kwargs['query']),
+                'label': kwargs.get('label'),
+                'submitted': now,
+                'started': None,
+                'finished': None,
+                'status': command.status,
+            }
+        self._found(command)
+
+    def _found(self, command):
+        now = self.clock.time() - self.start
+        with self.lock:
+            record = self.records[command.id]
+            record['status'] = command.status
+            if command.status == 'running' and record['started'] is None:
+                record['started'] = now
+            if self.inner.is_done(command.status) and \
+                    record['finished'] is None:
+                record['finished'] = now
+                if record['started'] is None:
+                    record['started'] = record['submitted']
+
+    def recording(self):
+        with self.lock:
+            return {
+                'commands': [
+                    r for r in self.records.values()
+                    if r['finished'] is not None
+                ],
+            }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.recording(), f, indent=2)
+
+
+class _RecordingCommand(object):
+    recorder = None
+
+    @classmethod
+    def create(cls, **kwargs):
+        command = cls.recorder.inner.create(**kwargs)
+        cls.recorder._created(command, kwargs)
+        return command
+
+    @classmethod
+    def find(cls, id):
+        command = cls.recorder.inner.find(id)
+        cls.recorder._found(command)
+        return command
+
+    @classmethod
+    def is_done(cls, status):
+        return cls.recorder.inner.is_done(status)
+
+    @classmethod
+    def is_success(cls, status):
+        return cls.recorder.inner.is_success(status)
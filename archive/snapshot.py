@@ -0,0 +1,118 @@
+'''
+Archive snapshots.  A snapshot is a single compressed file holding an optimized
+Archive: its DAG, settings, resources, functions, stats and rendered HQL.
+Read-only commands can load a snapshot rather than importing the archive
+module, which re-executes all of its wiring and re-renders its templates.
+
+A snapshot records the source files it was built from and is considered stale
+once any of them is modified, added or removed.
+'''
+
+import cPickle as pickle
+import os
+import pkgutil
+import zlib
+
+from jinja2 import TemplateNotFound
+
+VERSION = 1
+
+
+def save(archive, path, module, sources=None):
+    '''
+    Renders every query in the Archive and writes it to the given path.
+    '''
+    if sources is None:
+        sources = _sources(module, archive.package, archive.templates)
+
+    # Writing the snapshot modifies its own directory
+    directory = os.path.dirname(os.path.abspath(path))
+    sources = [s for s in sources if s != directory]
+
+    for query in archive.order:
+        try:
+            query.hql()
+        except TemplateNotFound:
+            # Missing templates fail when used, not when snapshotted
+            pass
+
+    header = {
+        'version': VERSION,
+        'module': module,
+        'sources': sources,
+    }
+    body = zlib.compress(pickle.dumps(archive, pickle.HIGHEST_PROTOCOL))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Write atomically so concurrent readers never see a partial snapshot
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        f.write(body)
+    os.rename(tmp_path, path)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        pickle.load(f)
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def fresh(path, module):
+    '''
+    Whether the snapshot at the given path exists, was built from the given
+    module, and is newer than all of its sources.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+        snapshot_mtime = os.path.getmtime(path)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return False
+
+    if header.get('version') != VERSION or header.get('module') != module:
+        return False
+
+    try:
+        return all([
+            os.path.getmtime(source) <= snapshot_mtime
+            for source in header['sources']
+        ])
+    except OSError:
+        return False
+
+
+def _sources(module, package, templates):
+    '''
+    Every file and directory beneath the archive module's package and the
+    Archive's template directory.  Directories are included so that added and
+    removed files are noticed.
+    '''
+    module_directory = _package_directory(module)
+    template_directory = os.path.join(_package_directory(package), templates)
+
+    roots = [module_directory]
+    if not template_directory.startswith(module_directory + os.sep):
+        roots.append(template_directory)
+
+    sources = []
+    for root in roots:
+        for directory, _, filenames in os.walk(root):
+            sources.append(directory)
+            sources.extend([
+                os.path.join(directory, filename)
+                for filename in filenames
+                if not filename.endswith(('.pyc', '.pyo'))
+            ])
+    return sources
+
+
+def _package_directory(name):
+    '''
+    The directory containing the named module or package, found without
+    executing the module itself.
+    '''
+    filename = pkgutil.get_loader(name).get_filename()
+    return os.path.dirname(os.path.abspath(filename))
@@ -0,0 +1,235 @@
+'''
+State persisted locally between Archive commands.
+'''
+
+import hashlib
+import json
+import os
+
+
+def digest(hql):
+    return hashlib.sha1(hql.encode('utf-8')).hexdigest()
+
+
+def _load(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save(path, data):
+    '''
+    Writes JSON atomically, so an interrupted command can't corrupt state.
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+class BuildState(object):
+    '''
+    The key of each relation as of its last successful build, see Archive.keys,
+    and whether each view or table was last built as a VIEW or a TABLE.
+    '''
+    def __init__(self, path):
+        self.path = path
+        state = _load(path)
+        if isinstance(state.get('keys'), dict):
+            self.keys = state['keys']
+            self.kinds = state.get('kinds', {})
+        else:
+            # Written before kinds were kept
+            self.keys = state
+            self.kinds = {}
+
+    def save(self):
+        _save(self.path, {'keys': self.keys, 'kinds': self.kinds})
+
+
+class Estimates(object):
+    '''
+    Estimated durations of queries, in seconds, for scheduling.  A query's
+    duration hint comes first, then a moving average of its past durations,
+    then a low default for metadata-only DDL, then an estimate from its
+    EXPLAIN plan, if it has been explained, and finally a default.  Without a
+    path, past durations are only kept in memory.
+    '''
+    def __init__(self, path=None, default=60.0, metadata_only=1.0,
+                 weight=0.5, plans=None, stage=30.0,
+                 bytes_per_second=50e6):
+        self.path = path
+        self.default = default
+        self.metadata_only = metadata_only
+        self.weight = weight
+        self.durations = _load(path) if path else {}
+
+        # Plan estimates: a fixed time per stage plus time to scan the input
+        self.plans = plans
+        self.stage = stage
+        self.bytes_per_second = bytes_per_second
+
+    def estimate(self, query):
+        if getattr(query, 'duration', None) is not None:
+            return query.duration
+        if query.name in self.durations:
+            return self.durations[query.name]
+        if getattr(query, 'metadata_only', False):
+            return self.metadata_only
+
+        plan = self.plan(query)
+        if plan and plan['stages']:
+            return self.stage * plan['stages'] + \
+                (plan['input_bytes'] or 0) / self.bytes_per_second
+        return self.default
+
+    def plan(self, query):
+        '''
+        The query's cached EXPLAIN plan, if any.
+        '''
+        if not self.plans or not hasattr(query, 'explain_hql'):
+            return None
+        hql = query.explain_hql()
+        return self.plans.get(hql) if hql else None
+
+    def record(self, name, seconds):
+        past = self.durations.get(name)
+        if past is not None:
+            seconds = self.weight * seconds + (1 - self.weight) * past
+        self.durations[name] = seconds
+
+    def save(self):
+        if self.path:
+            _save(self.path, self.durations)
+
+
+class Checkpoint(object):
+    '''
+    The queries a build or run has completed, with the digest of the HQL each
+    ran, so that if it fails it may be resumed where it left off.  Resuming
+    skips the queries that completed with identical HQL.
+
+    The checkpoint is a JSON line describing the run followed by a line per
+    completed query, appended as each completes.
+    '''
+    def __init__(self, path, run_id, command):
+        self.path = path
+        self.run_id = run_id
+        self.command = command
+        self.completed = {}
+        self.recorded = set()
+
+        header = None
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [line for line in f if line.strip()]
+            if lines:
+                header = json.loads(lines[0])
+            for line in lines[1:]:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Cut off as it was appended
+                    continue
+                self.completed[entry['name']] = entry['digest']
+
+        if header and header['command'] != command:
+            raise ValueError('Run %s was a %s, not a %s' % (
+                run_id,
+                header['command'],
+                command
+            ))
+
+    def remaining(self, steps):
+        return (
+            (query, hql) for query, hql in steps
+            if self.completed.get(query.name) != digest(hql)
+        )
+
+    def record(self, job):
+        '''
+        Records the given Job, if it succeeded and isn't yet recorded.
+        '''
+        if not job.succeeded or job in self.recorded:
+            return
+
+        if not os.path.exists(self.path):
+            self.save()
+        self.recorded.add(job)
+        self.completed[job.name] = job.digest
+        with open(self.path, 'a') as f:
+            f.write(self._line(job.name, job.digest))
+
+    def save(self):
+        '''
+        Rewrites the whole checkpoint, atomically.
+        '''
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({
+                'run_id': self.run_id,
+                'command': self.command,
+            }, sort_keys=True) + '\n')
+            for name, hql_digest in sorted(self.completed.items()):
+                f.write(self._line(name, hql_digest))
+        os.rename(tmp_path, self.path)
+
+    def _line(self, name, hql_digest):
+        return json.dumps(
+            {'name': name, 'digest': hql_digest},
+            sort_keys=True
+        ) + '\n'
+
+
+class Watermarks(object):
+    '''
+    The last partition path added to each external table by incremental
+    partition discovery; see partitions.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.paths = _load(path) if path else {}
+
+    def get(self, name):
+        return self.paths.get(name)
+
+    def advance(self, name, path):
+        current = self.paths.get(name)
+        if current is None or path > current:
+            self.paths[name] = path
+
+    def save(self):
+        if self.path:
+            _save(self.path, self.paths)
+
+
+class Plans(object):
+    '''
+    Parsed EXPLAIN plans, keyed by the digest of the HQL explained; see
+    explain.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.plans = _load(path) if path else {}
+
+    def __len__(self):
+        return len(self.plans)
+
+    def get(self, hql):
+        return self.plans.get(digest(hql))
+
+    def put(self, hql, plan):
+        self.plans[digest(hql)] = plan
+
+    def save(self):
+        if self.path:
+            _save(self.path, self.plans)
@@ -1,20 +1,11 @@
+import graph
 from query import Query
 from workflow import DMLWorkflow
 
 
 class Statement(Query, DMLWorkflow):
-    def _graph(self, context, **kwargs):
-        context['offset'] += 1
-        input_graph = str.join(
-            '\n',
-            [i._graph(context, **kwargs) for i in self.inputs]
-        ).rstrip()
-        context['offset'] -= 1
-
-        graph_str = '%s[%s]\n%s' % (
-            '\t' * context['offset'], self.name, input_graph
-        )
-        return graph_str.rstrip()
+    def _graph_node(self, references):
+        return '[%s]' % self.name, list(self.inputs)
 
     def _stats(self, **kwargs):
         stats = self.archive.stats
@@ -46,29 +37,34 @@ class InsertOverwrite(Statement):
     def __str__(self):
         return 'InsertOverwrite(%s, %s)' % (self.name, self.external_table)
 
-    def _graph(self, context, **kwargs):
-        context['offset'] += 1
-        input_graph = str.join(
-            '\n',
-            [i._graph(context, **kwargs) for i in self.inputs]
-        ).rstrip()
-        external_table_graph = self.external_table._graph(context, **kwargs)
-        context['offset'] -= 1
-
-        graph_str = '%s[%s]\n%s\n%s' % (
-            '\t' * context['offset'],
-            self.name,
-            input_graph,
-            external_table_graph
-        )
-        return graph_str
+    def _graph_node(self, references):
+        # The table written follows the inputs, after a blank line if there
+        # are none
+        inputs = list(self.inputs) or [graph.BLANK]
+        return '[%s]' % self.name, inputs + [self.external_table]
 
     def _stats(self, **kwargs):
         Statement._stats(self, **kwargs)
         return self.external_table._stats(**kwargs)
 
     def run_hql(self):
-        return ['''
+        return [self._insert_hql(self.hql())]
+
+    def explain_hql(self):
+        return self._explain_hql('INSERT OVERWRITE TABLE %s.%s\n%s' % (
+            self.external_table.database,
+            self.external_table.name,
+            self.hql()
+        ))
+
+    def backfill_hql(self, chunk):
+        '''
+        The statement scoped to the partitions of a backfill Chunk.
+        '''
+        return self._insert_hql(self.hql(backfill=chunk))
+
+    def _insert_hql(self, hql):
+        return '''
 {command_hql}
 INSERT OVERWRITE TABLE {database}.{name}
 {hql}
@@ -77,8 +73,8 @@ INSERT OVERWRITE TABLE {database}.{name}
             command_hql=Statement._command_hql(self),
             database=self.external_table.database,
             name=self.external_table.name,
-            hql=self.hql(),
-        ).strip()]
+            hql=hql,
+        ).strip()
 
 
 class Select(Statement):
@@ -94,3 +90,6 @@ class Select(Statement):
             command_hql=Statement._command_hql(self),
             hql=self.hql(),
         ).strip()]
+
+    def explain_hql(self):
+        return self._explain_hql(self.hql())
@@ -0,0 +1,157 @@
+'''
+Span tracing of where time goes in builds and runs: rendering templates,
+submitting commands, waiting on them and polling.  Spans are recorded while a
+Tracer is started and saved in the Chrome trace event format, which
+chrome://tracing and Perfetto show as a timeline of each thread:
+
+    tracing.start()
+    archive.build(parallelism=4)
+    tracing.stop().save('build.json')
+
+Commands get a timeline of their own, split into the time they were seen
+queued and the time they were seen executing.  Both are as observed by
+polling, so they end up to one poll interval after the command did.
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+PROCESS = 1
+COMMANDS = 2
+
+
+class Tracer(object):
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.tracks = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        '''
+        Records the time spent in the block under the given name, tagged with
+        the given arguments, to which the block may add.
+        '''
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.complete(name, start, time.time(), **args)
+
+    def complete(self, name, start, end, track=None, **args):
+        '''
+        Records a span that has already finished, on the current thread's
+        timeline or the named track's.
+        '''
+        with self.lock:
+            if track is None:
+                pid, tid = PROCESS, self._thread()
+            else:
+                pid, tid = COMMANDS, self._track(track)
+
+            self.events.append({
+                'name': name,
+                'cat': 'archive',
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int(max(0, end - start) * 1e6),
+                'pid': pid,
+                'tid': tid,
+                'args': args,
+            })
+
+    def _thread(self):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        return thread.ident
+
+    def _track(self, track):
+        if track not in self.tracks:
+            self.tracks[track] = len(self.tracks) + 1
+        return self.tracks[track]
+
+    def trace(self):
+        '''
+        The trace as a trace event format dictionary.
+        '''
+        with self.lock:
+            process = 'archive (%s)' % os.getpid()
+            metadata = [
+                _name('process_name', PROCESS, 0, process),
+                _name('process_name', COMMANDS, 0, 'commands'),
+            ]
+            metadata.extend([
+                _name('thread_name', PROCESS, tid, name)
+                for tid, name in self.threads.items()
+            ])
+            metadata.extend([
+                _name('thread_name', COMMANDS, tid, track)
+                for track, tid in self.tracks.items()
+            ])
+            return {
+                'traceEvents': metadata + list(self.events),
+                'displayTimeUnit': 'ms',
+            }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+def _name(kind, pid, tid, name):
+    return {
+        'name': kind,
+        'ph': 'M',
+        'pid': pid,
+        'tid': tid,
+        'args': {'name': name},
+    }
+
+
+class _NoSpan(object):
+    def __init__(self, args):
+        self.args = args
+
+    def __enter__(self):
+        return self.args
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_tracer = None
+
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def now():
+    return time.time()
+
+
+def span(name, **args):
+    '''
+    A span of the current Tracer, if any; otherwise, the block runs untraced.
+    '''
+    if _tracer is None:
+        return _NoSpan(args)
+    return _tracer.span(name, **args)
+
+
+def complete(name, start, end, track=None, **args):
+    if _tracer is not None:
+        _tracer.complete(name, start, end, track, **args)
@@ -0,0 +1,8 @@
+'''
+Benchmarks of Archive's DAG operations against synthetic archives.  Run from
+the repository root:
+
+    python -m benchmarks.bench --nodes 2000 --depth 25 --output results.json
+
+See benchmarks.bench for comparing results against a baseline.
+'''
@@ -0,0 +1,256 @@
+'''
+Times Archive's DAG operations on synthetic Archives and measures the memory
+each allocates, saving the results as JSON and comparing them against a
+baseline.  By default, runs of the default shape are compared against the
+baseline committed in benchmarks/baseline.json, which is updated with:
+
+    python -m benchmarks.bench --output benchmarks/baseline.json
+
+The run exits non-zero if any operation has regressed.
+'''
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import timeit
+
+import synthetic
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+OPERATIONS = [
+    'add',
+    'validate',
+    'optimize',
+    'graph',
+    'show',
+    'build_hql',
+    'run_hql',
+]
+
+
+def run(shape, repeat=3):
+    '''
+    Times each operation, taking the best of the given number of repeats, each
+    on a newly generated Archive.  Templates are rendered from scratch for
+    build_hql.
+
+    Each operation's memory is measured once, on the first repeat, in a
+    forked copy of the process; see _memory.
+    '''
+    results = dict([(name, {}) for name in OPERATIONS])
+    for n in range(repeat):
+        queries, templates = synthetic.generate(shape)
+        archive = synthetic.SyntheticArchive(templates)
+        for name, operation in _operations(archive, queries):
+            gc.collect()
+            if n == 0:
+                results[name]['memory'] = _memory(operation)
+
+            start = timeit.default_timer()
+            operation()
+            seconds = timeit.default_timer() - start
+
+            result = results[name]
+            result['seconds'] = min(result.get('seconds', seconds), seconds)
+
+    return {
+        'shape': shape.to_dict(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def _peak_memory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _memory(operation):
+    '''
+    How far the operation raises peak memory (in kilobytes on Linux), run in
+    a forked child.  A child's high-water mark starts from its memory as
+    forked, so unlike this process's, it isn't already raised by earlier
+    operations.
+    '''
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            before = _peak_memory()
+            operation()
+            os.write(write, str(_peak_memory() - before))
+        finally:
+            os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    if not output:
+        raise RuntimeError('Measuring memory failed')
+    return int(output)
+
+
+def _operations(archive, queries):
+    def add():
+        for query in queries:
+            archive.add(query)
+
+    def validate():
+        for query in archive.order:
+            archive.validate(query)
+
+    def build_hql():
+        archive.render_cache.clear()
+        for _ in archive.build_hql():
+            pass
+
+    def run_hql():
+        for _ in archive.run_hql():
+            pass
+
+    return [
+        ('add', add),
+        ('validate', validate),
+        ('optimize', archive.optimize),
+        ('graph', archive.graph),
+        ('show', archive.show),
+        ('build_hql', build_hql),
+        ('run_hql', run_hql),
+    ]
+
+
+# Differences too small to be more than noise, by measure
+FLOORS = {
+    'seconds': 0.005,
+    'memory': 1024,
+}
+
+
+def compare(results, baseline, tolerance=0.25, floors=FLOORS):
+    '''
+    The operations that are slower, or allocate more memory, than in the
+    baseline by more than the given fraction, as (operation, measure,
+    baseline, result) tuples.  Differences of less than a measure's floor are
+    ignored as noise.
+    '''
+    regressions = []
+    for name in OPERATIONS:
+        for measure in ('seconds', 'memory'):
+            before = baseline['results'].get(name, {}).get(measure)
+            after = results['results'][name][measure]
+            if before is None:
+                continue
+            if after > before * (1 + tolerance) and \
+                    after - before > floors[measure]:
+                regressions.append((name, measure, before, after))
+    return regressions
+
+
+def report(results, baseline=None):
+    lines = ['%-10s %12s %12s %12s %12s' % (
+        'operation', 'seconds', 'baseline', 'memory', 'baseline'
+    )]
+    for name in OPERATIONS:
+        result = results['results'][name]
+        before = (baseline or {}).get('results', {}).get(name, {})
+        lines.append('%-10s %12.4f %12s %12s %12s' % (
+            name,
+            result['seconds'],
+            '%.4f' % before['seconds'] if 'seconds' in before else '',
+            result['memory'],
+            before.get('memory', '')
+        ))
+    return str.join('\n', lines)
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark Archive's DAG operations on a synthetic archive"
+)
+parser.add_argument('--nodes', type=int, default=500)
+parser.add_argument('--depth', type=int, default=10)
+parser.add_argument('--fan-in', dest='fan_in', type=int, default=3)
+parser.add_argument('--fan-out', dest='fan_out', type=int, default=5)
+parser.add_argument('--views', type=float, default=0.5)
+parser.add_argument('--tables', type=float, default=0.4)
+parser.add_argument('--statements', type=float, default=0.1)
+parser.add_argument('--databases', type=int, default=10)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument(
+    '--repeat',
+    type=int,
+    default=3,
+    help='number of runs, of which the fastest counts'
+)
+parser.add_argument('-o', '--output', help='file to save results to')
+parser.add_argument(
+    '-b', '--baseline',
+    default=BASELINE,
+    help='results to compare against, by default the committed baseline'
+)
+parser.add_argument(
+    '--tolerance',
+    type=float,
+    default=0.25,
+    help='fraction by which an operation may slow before it is a regression'
+)
+
+
+def shape(args):
+    return synthetic.Shape(
+        nodes=args.nodes,
+        depth=args.depth,
+        fan_in=args.fan_in,
+        fan_out=args.fan_out,
+        views=args.views,
+        tables=args.tables,
+        statements=args.statements,
+        databases=args.databases,
+        seed=args.seed
+    )
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    # Deep archives recurse deeply in optimize
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * args.depth))
+
+    # Read first, as the results may replace it
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(shape(args), args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    # Other shapes do different work, so aren't comparable
+    if baseline and baseline['shape'] != results['shape']:
+        print 'Not comparing against %s, of a different shape: %s' % (
+            args.baseline,
+            baseline['shape']
+        )
+        baseline = None
+
+    print report(results, baseline)
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, measure, before, after in regressions:
+            print 'Regression: %s %s rose to %s from %s' % (
+                name, measure, after, before
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+'''
+Generation of synthetic Archives of a given shape, for benchmarking.
+'''
+
+import random
+
+from jinja2 import DictLoader, Environment
+
+from archive.archive import Archive
+from archive.hive import Hive
+from archive.relation import ExternalTable, Table, View
+from archive.statement import InsertOverwrite
+
+
+class Shape(object):
+    '''
+    The shape of a synthetic Archive: its number of queries, the number of
+    layers they are spread over, the most inputs any query reads and the most
+    queries any relation is read by, and the shares of views, tables and
+    statements among the queries above the first layer, which holds external
+    tables.  Where fan-out limits would leave a query without inputs, they are
+    exceeded.
+    '''
+    def __init__(self, nodes=500, depth=10, fan_in=3, fan_out=5, views=0.5,
+                 tables=0.4, statements=0.1, databases=10, seed=0):
+        self.nodes = nodes
+        self.depth = max(1, depth)
+        self.fan_in = max(1, fan_in)
+        self.fan_out = max(1, fan_out)
+        self.views = views
+        self.tables = tables
+        self.statements = statements
+        self.databases = max(1, databases)
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class SyntheticArchive(Archive):
+    '''
+    An Archive whose templates are held in memory rather than a package.
+    '''
+    def __init__(self, templates, hive=None):
+        self.synthetic_templates = templates
+        super(SyntheticArchive, self).__init__('synthetic', hive or Hive())
+
+    def _environment(self):
+        return Environment(loader=DictLoader(self.synthetic_templates))
+
+
+def generate(shape):
+    '''
+    Generates the queries of a synthetic Archive in a valid order, along with
+    their templates, by template name.
+    '''
+    rng = random.Random(shape.seed)
+    layers = [[] for _ in range(shape.depth)]
+    references = {}
+    queries = []
+    templates = {}
+
+    def database():
+        return 'db_%s' % rng.randrange(shape.databases)
+
+    def pick_inputs(layer):
+        # At least one input from the previous layer with relations, so that
+        # the Archive has the requested depth
+        previous = _available(
+            [l for l in layers[:layer] if l][-1],
+            references,
+            shape.fan_out
+        )
+        inputs = [rng.choice(previous)]
+
+        earlier = _available(
+            [r for l in layers[:layer] for r in l],
+            references,
+            shape.fan_out
+        )
+        count = rng.randint(1, shape.fan_in) - 1
+        for i in rng.sample(earlier, min(count, len(earlier))):
+            if i not in inputs:
+                inputs.append(i)
+
+        for i in inputs:
+            references[i] = references.get(i, 0) + 1
+        return inputs
+
+    roots = max(1, shape.nodes / shape.depth)
+    for n in range(shape.nodes):
+        name = 'q%s' % n
+        layer = min(shape.depth - 1, n / roots) if n >= roots else 0
+        if layer == 0:
+            query = ExternalTable(database(), name, partitioned=True)
+            templates[query.template] = _external_table_template(name)
+            layers[0].append(query)
+            queries.append(query)
+            continue
+
+        inputs = pick_inputs(layer)
+        templates['%s.sql' % name] = _select_template(inputs)
+
+        kind = rng.random() * (shape.views + shape.tables + shape.statements)
+        if kind < shape.views:
+            query = View(database(), name, *inputs)
+        elif kind < shape.views + shape.tables:
+            query = Table(database(), name, *inputs)
+        else:
+            query = InsertOverwrite(name, rng.choice(layers[0]), *inputs)
+
+        if hasattr(query, 'qualified_name'):
+            layers[layer].append(query)
+        queries.append(query)
+
+    return queries, templates
+
+
+def archive(shape, hive=None):
+    '''
+    A synthetic Archive of the given shape with all of its queries added.
+    '''
+    queries, templates = generate(shape)
+    result = SyntheticArchive(templates, hive)
+    for query in queries:
+        result.add(query)
+    return result
+
+
+def _available(relations, references, fan_out):
+    available = [r for r in relations if references.get(r, 0) < fan_out]
+    return available or relations
+
+
+def _external_table_template(name):
+    return '''
+(id STRING, value BIGINT)
+PARTITIONED BY (d STRING)
+LOCATION 's3://synthetic/%s/'
+''' % name
+
+
+def _select_template(inputs):
+    return str.join('\nUNION ALL\n', [
+        "SELECT id, value FROM {{ inputs['%s'] }}" % i.name for i in inputs
+    ])
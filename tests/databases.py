@@ -104,3 +104,14 @@ def dynamo(archive, dynamo_database):
             'hive.exec.reducers.max': '1',
         }
     ))
+
+
+def build(archive):
+    '''
+    Adds every test database to the given Archive.
+    '''
+    atomic(archive, 'atomic')
+    inputs(archive, 'inputs')
+    events(archive, 'events')
+    dynamo(archive, 'dynamo')
+    return archive
@@ -0,0 +1,40 @@
+'''
+Test backends
+'''
+from __future__ import absolute_import
+
+import threading
+import time
+
+from archive.hive import Hive
+
+
+class RecordingHive(Hive):
+    '''
+    Dummy backend that records when queries start and finish, failing any
+    query containing the given substring.
+    '''
+    def __init__(self, delay=0.01, fail=None):
+        self.delay = delay
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.max_running = 0
+
+    def run_sync(self, query, log_limit=100, expected=None):
+        with self.lock:
+            self.started.append(query)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+        time.sleep(self.delay)
+
+        with self.lock:
+            self.running -= 1
+            self.finished.append(query)
+
+        if self.fail and self.fail in query:
+            raise RuntimeError('Failed: %s' % self.fail)
+        return query
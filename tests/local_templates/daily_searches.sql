@@ -0,0 +1,9 @@
+SELECT
+  app_id,
+  day,
+  COUNT(*) AS searches
+FROM
+  {{inputs.searches}}
+GROUP BY
+  app_id,
+  day
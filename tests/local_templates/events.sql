@@ -0,0 +1,13 @@
+-- Minimal events, loaded from tests/fixtures
+(
+  app_id string,
+  event string,
+  se_label string,
+  collector_tstamp timestamp -- When the collector received the event
+)
+PARTITIONED BY (run string)
+ROW FORMAT DELIMITED
+FIELDS TERMINATED BY '\t'
+LINES TERMINATED BY '\n'
+STORED AS TEXTFILE
+LOCATION '${EVENTS_TABLE}'
@@ -0,0 +1,7 @@
+PARTITION (day)
+SELECT
+  app_id,
+  searches,
+  day
+FROM
+  {{inputs.daily_searches}}
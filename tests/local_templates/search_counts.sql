@@ -0,0 +1,6 @@
+(
+  app_id string,
+  searches bigint
+)
+PARTITIONED BY (day string)
+LOCATION '${SEARCH_COUNTS_TABLE}'
@@ -0,0 +1,9 @@
+SELECT
+  app_id,
+  to_date(collector_tstamp) AS day,
+  lpad(hour(collector_tstamp), 2, '0') AS hour,
+  se_label AS search_query
+FROM
+  {{inputs.events}}
+WHERE
+  event = 'search'
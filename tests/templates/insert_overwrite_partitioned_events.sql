@@ -32,3 +32,9 @@ SELECT
   END AS event
 FROM
   {{inputs.events}}
+{%- if backfill %}
+WHERE
+  {{ backfill.where(
+    "CASE WHEN event = 'struct' THEN se_action ELSE event END"
+  ) }}
+{%- endif %}
@@ -66,3 +66,13 @@ class TestArchive:
 
         assert_equal(1, stats['queries']['references']['events'])
         assert_equal(set(['events']), stats['queries']['unique_queries'])
+
+    def test_indexes(self):
+        self.archive.add(self.events)
+        view = self.archive.add(View('atomic', 'searches', self.events))
+
+        assert_equal([self.events, view], self.archive.order)
+        assert_equal(set([self.events, view]), self.archive.nodes)
+        assert_equal([self.events], self.archive.upstream['searches'])
+        assert_equal([view], self.archive.downstream['events'])
+        assert_equal([], self.archive.downstream['searches'])
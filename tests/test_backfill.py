@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+from nose.tools import *
+
+from archive import backfill
+from archive.archive import Archive
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class TestBackfill:
+    def setup(self):
+        self.hive = RecordingHive(delay=0.01)
+        self.archive = databases.build(Archive('tests', self.hive))
+        self.insert = self.archive.lookup(
+            'insert_overwrite_partitioned_events'
+        )
+
+    def test_values(self):
+        eq_(
+            ['2014-01-30', '2014-01-31', '2014-02-01'],
+            backfill.values('2014-01-30', '2014-02-01')
+        )
+        eq_(['8', '9', '10'], backfill.values('8', '10'))
+        assert_raises(ValueError, backfill.values, 'a', 'c')
+
+    def test_chunks(self):
+        chunks = backfill.chunks(self.insert, ['a', 'b', 'c'], chunk_size=2)
+        eq_(['event=a..b', 'event=c'], [str(c) for c in chunks])
+        eq_("event IN ('a', 'b')", chunks[0].where())
+
+    def test_supports(self):
+        ok_(backfill.supports(self.insert))
+        ok_(not backfill.supports(
+            self.archive.lookup('insert_overwrite_dynamo_result_stats')
+        ))
+
+        backfill.check(self.insert)
+        assert_raises(
+            ValueError,
+            backfill.check,
+            self.archive.lookup('insert_overwrite_dynamo_result_stats')
+        )
+
+    def test_hql(self):
+        # Templates render as before outside of backfills
+        ok_('WHERE' not in self.insert.run_hql()[0])
+
+        chunk = backfill.Chunk('event', ['page_view', "it's"])
+        hql = self.insert.backfill_hql(chunk)
+        ok_(hql.startswith(self.insert.run_hql()[0][:-1].strip()))
+        ok_(hql.endswith(
+            "WHERE\n  CASE WHEN event = 'struct' THEN se_action "
+            "ELSE event END IN ('page_view', 'it\\'s')\n;"
+        ))
+
+    def test_backfill(self):
+        chunks = backfill.chunks(self.insert, backfill.values('1', '5'), 2)
+        summary = backfill.backfill(self.insert, chunks, parallelism=3)
+        eq_(3, self.hive.max_running)
+        eq_(3, summary['chunks'])
+        eq_(3, summary['succeeded'])
+        eq_(5, summary['partitions'])
+        eq_([], summary['failed'])
+        ok_(summary['partitions_per_hour'] > 0)
+
+    def test_retries(self):
+        self.hive.fail = "IN ('3', '4')"
+        chunks = backfill.chunks(self.insert, backfill.values('1', '5'), 2)
+        summary = backfill.backfill(self.insert, chunks, retries=2)
+
+        # The failing chunk was tried three times, without stopping the rest
+        eq_(['event=3..4'], summary['failed'])
+        eq_(2, summary['retries'])
+        eq_(2, summary['succeeded'])
+        eq_(5, len(self.hive.started))
+
+    @raises(ValueError)
+    def test_unsupported(self):
+        statement = self.archive.lookup('insert_overwrite_dynamo_result_stats')
+        backfill.backfill(statement, [backfill.Chunk('d', ['1'])])
@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+
+import json
+
+from nose.tools import *
+
+from benchmarks import bench, synthetic
+
+
+class TestBenchmarks:
+    def setup(self):
+        self.shape = synthetic.Shape(nodes=60, depth=6, fan_in=3, fan_out=2)
+
+    def test_generate(self):
+        queries, templates = synthetic.generate(self.shape)
+        eq_(60, len(queries))
+
+        # Every input precedes the query that reads it
+        depths = {}
+        for query in queries:
+            for i in query.inputs:
+                ok_(i in depths)
+                ok_('%s.sql' % i.name in templates)
+            depths[query] = 1 + max([depths[i] for i in query.inputs] or [0])
+        eq_(6, max(depths.values()))
+
+        archive = synthetic.archive(self.shape)
+        eq_(
+            [q.name for q in queries],
+            [q.name for q in archive.order]
+        )
+
+    def test_run_and_compare(self):
+        results = bench.run(self.shape, repeat=1)
+        eq_(set(bench.OPERATIONS), set(results['results'].keys()))
+        ok_(all([r['memory'] >= 0 for r in results['results'].values()]))
+        eq_([], bench.compare(results, results))
+
+        baseline = {'results': {'graph': {'seconds': 0.0, 'memory': 0}}}
+        results['results']['graph']['seconds'] = 0.5
+        results['results']['graph']['memory'] = 100
+        eq_(
+            [('graph', 'seconds', 0.0, 0.5)],
+            bench.compare(results, baseline)
+        )
+
+        # Memory regresses too, beyond its floor
+        results['results']['graph']['memory'] = 4096
+        eq_(
+            [('graph', 'seconds', 0.0, 0.5), ('graph', 'memory', 0, 4096)],
+            bench.compare(results, baseline)
+        )
+
+    def test_baseline(self):
+        # The committed baseline is of the default shape
+        with open(bench.BASELINE) as f:
+            baseline = json.load(f)
+        args = bench.parser.parse_args([])
+        eq_(bench.BASELINE, args.baseline)
+        eq_(bench.shape(args).to_dict(), baseline['shape'])
+        eq_(set(bench.OPERATIONS), set(baseline['results'].keys()))
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+from jinja2 import Environment, FileSystemLoader
+
+from archive.archive import Archive
+from archive.cache import RenderCache
+from archive.hive import Hive
+from archive.relation import ExternalTable, View
+
+
+class TestRenderCache:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('events.sql', '(id string)')
+        self.write('searches.sql', 'SELECT * FROM {{inputs.events}}')
+
+        self.archive = Archive('tests', Hive())
+        self.archive.env = Environment(loader=FileSystemLoader(self.directory))
+        self.archive.render_cache = RenderCache(self.archive.env)
+        self.cache = self.archive.render_cache
+
+        self.events = self.archive.add(ExternalTable('atomic', 'events'))
+        self.searches = self.archive.add(View(
+            'events',
+            'searches',
+            self.events
+        ))
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+
+    def test_hits(self):
+        assert_equal('SELECT * FROM atomic.events', self.searches.hql())
+        self.searches.hql()
+        self.searches.create_hql()
+        self.searches.build_hql()
+
+        assert_equal(2, self.cache.stats()['misses'])
+        assert_equal(3, self.cache.stats()['hits'])
+
+    def test_touched_template(self):
+        self.searches.hql()
+        self.write(
+            'searches.sql',
+            'SELECT * FROM {{inputs.events}}',
+            mtime=1000000000
+        )
+
+        self.searches.hql()
+        assert_equal(1, self.cache.misses)
+        assert_equal(1, self.cache.hits)
+
+    def test_modified_template(self):
+        self.searches.hql()
+        self.write(
+            'searches.sql',
+            'SELECT id FROM {{inputs.events}}',
+            mtime=1000000000
+        )
+
+        assert_equal('SELECT id FROM atomic.events', self.searches.hql())
+        assert_equal(2, self.cache.misses)
+        assert_equal(0, self.cache.hits)
+
+
+class TestTemplateCache:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = Archive('tests', Hive())
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compile_templates(self):
+        self.archive.cache_templates(self.directory)
+        names = self.archive.compile_templates()
+
+        assert_true('events.sql' in names)
+        assert_equal(len(names), len(os.listdir(self.directory)))
+
+    def test_load_cached(self):
+        self.archive.cache_templates(self.directory)
+        self.archive.compile_templates()
+
+        archive = Archive('tests', Hive())
+        archive.cache_templates(self.directory)
+        events = archive.add(ExternalTable('atomic', 'events'))
+        assert_true('event_id' in events.hql())
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.executor import Executor, plan
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class TestExecutor:
+    def setup(self):
+        self.hive = RecordingHive()
+        self.archive = databases.build(Archive('tests', self.hive))
+
+    def test_serial_build(self):
+        results = self.archive.build()
+        assert_equal(list(self.archive.build_hql()), results)
+        assert_equal(1, self.hive.max_running)
+
+    def test_parallel_build(self):
+        jobs = list(plan(self.archive._create_all_steps()))
+        hql = dict([(job, job.hql) for job in jobs])
+        Executor(self.hive, parallelism=4).run_all_sync(jobs)
+
+        assert_true(self.hive.max_running > 1)
+        for job in jobs:
+            started = self.hive.started.index(hql[job])
+            for u in job.upstream:
+                assert_true(self.hive.finished.index(hql[u]) < started)
+
+        # Finished Jobs keep only the digest of their HQL
+        assert_true(all([job.hql is None and job.digest for job in jobs]))
+
+    def test_run_plan(self):
+        jobs = dict([(j.name, j) for j in plan(self.archive._run_steps())])
+        assert_equal(
+            [jobs['insert_overwrite_partitioned_events']],
+            jobs['insert_overwrite_dynamo_result_stats'].upstream
+        )
+
+    def test_database_dependencies(self):
+        jobs = dict([
+            (j.name, j) for j in plan(self.archive._create_all_steps())
+        ])
+        assert_true(jobs['searches'] in jobs['result_views'].upstream)
+
+    def test_streaming(self):
+        produced = []
+
+        def steps():
+            for step in self.archive._create_all_steps():
+                produced.append(step)
+                yield step
+
+        results = Executor(self.hive, lookahead=1).run_all_iter(plan(steps()))
+        first = next(results)
+        assert_equal([first], self.hive.started)
+
+        # The first query finished before later steps were generated
+        assert_true(len(produced) < 7)
+        assert_equal(6, len(list(results)))
+        assert_equal(7, len(produced))
+
+    def test_batching(self):
+        results = self.archive.build(batch_size=10)
+        assert_equal(6, len(self.hive.started))
+        assert_equal(7, len(results))
+
+        batched = [hql for hql in self.hive.started if 'CREATE VIEW' in hql]
+        assert_equal(2, len(batched))
+        assert_true('events.searches' in batched[0])
+        assert_true('events.impressions' in batched[1])
+        assert_true('events.result_views' in batched[1])
+        assert_false(any([
+            'CREATE TABLE' in hql and 'CREATE VIEW' in hql
+            for hql in self.hive.started
+        ]))
+
+    def test_batch_failure(self):
+        self.hive.fail = 'CREATE VIEW IF NOT EXISTS events.result_views'
+        jobs = list(plan(self.archive._create_all_steps()))
+        executor = Executor(self.hive, batch_size=10, keep_going=True)
+        executor.run_all_sync(jobs)
+
+        # The failed batch's queries were run alone, so only the culprit fails
+        assert_equal(['result_views'], [job.name for job in executor.failed])
+        jobs = dict([(job.name, job) for job in jobs])
+        assert_true(jobs['impressions'].succeeded)
+        assert_equal(2, jobs['impressions'].attempts)
+        assert_false(jobs['stage_dynamo_result_stats'].succeeded)
+
+    def test_batch_size(self):
+        self.archive.build(batch_size=1)
+        assert_equal(7, len(self.hive.started))
+
+    @raises(RuntimeError)
+    def test_failure(self):
+        self.hive.fail = 'CREATE VIEW IF NOT EXISTS events.searches'
+        try:
+            self.archive.build(parallelism=4)
+        finally:
+            assert_false(any([
+                'events.impressions AS' in q for q in self.hive.started
+            ]))
+
+    def test_keep_going(self):
+        self.hive.fail = 'CREATE VIEW IF NOT EXISTS events.searches'
+        executor = Executor(self.hive, parallelism=4, keep_going=True)
+        executor.run_all_sync(plan(self.archive._create_all_steps()))
+
+        # Only the failure and what depends on it didn't run
+        assert_equal(['searches'], [job.name for job in executor.failed])
+        assert_false(any([
+            'events.impressions AS' in q for q in self.hive.started
+        ]))
+        assert_true(any([
+            'inputs.partitioned_events' in q for q in self.hive.finished
+        ]))
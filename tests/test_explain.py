@@ -0,0 +1,200 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive import explain
+from archive.archive import Archive
+from archive.hive import Qubole
+from archive.relation import ExternalTable, Table, ViewUntilTable
+from archive.simulation import Service
+from archive.state import Estimates, Plans
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+PLAN = '''
+STAGE DEPENDENCIES:
+  Stage-1 is a root stage
+  Stage-2 depends on stages: Stage-1
+  Stage-0 depends on stages: Stage-2
+
+STAGE PLANS:
+  Stage: Stage-1
+    Map Reduce
+      Map Operator Tree:
+          TableScan
+            alias: searches
+            Statistics: Num rows: 1000 Data size: 200000000 Basic stats: \
+COMPLETE Column stats: NONE
+          TableScan
+            alias: result_views
+            Statistics: Num rows: 500 Data size: 50000000 Basic stats: \
+COMPLETE Column stats: NONE
+      Reduce Operator Tree:
+        Join Operator
+          condition map:
+               Inner Join 0 to 1
+
+  Stage: Stage-2
+    Map Reduce
+      Map Operator Tree:
+          TableScan
+            Reduce Output Operator
+      Reduce Operator Tree:
+        Group By Operator
+
+  Stage: Stage-0
+    Fetch Operator
+      limit: -1
+'''
+
+# A simple view's plan: one job, and a fetch
+SIMPLE = '''
+STAGE DEPENDENCIES:
+  Stage-1 is a root stage
+  Stage-0 depends on stages: Stage-1
+
+STAGE PLANS:
+  Stage: Stage-1
+    Map Reduce
+      Map Operator Tree:
+          TableScan
+            alias: events
+            Statistics: Num rows: 4 Data size: 400 Basic stats: COMPLETE \
+Column stats: NONE
+            Filter Operator
+              predicate: (event = 'search') (type: boolean)
+              Select Operator
+                File Output Operator
+
+  Stage: Stage-0
+    Fetch Operator
+      limit: -1
+      Processor Tree:
+        ListSink
+'''
+
+
+class ExplainingHive(RecordingHive):
+    def __init__(self, plan=PLAN):
+        super(ExplainingHive, self).__init__(delay=0)
+        self.plan = plan
+        self.explained = []
+
+    def explain(self, hql):
+        self.explained.append(hql)
+        return self.plan
+
+
+class TestExplain:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'plans.json')
+        self.hive = ExplainingHive()
+        self.archive = databases.build(Archive('tests', self.hive))
+        self.archive.plans = Plans(self.path)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        plan = explain.parse(PLAN)
+        eq_(2, plan['stages'])
+        eq_(1, plan['joins'])
+        eq_(['result_views', 'searches'], plan['tables'])
+        eq_(1500, plan['input_rows'])
+        eq_(250000000, plan['input_bytes'])
+        eq_(3, explain.cost(plan))
+
+        # Fetch stages do no work, so a simple view costs one job
+        plan = explain.parse(SIMPLE)
+        eq_(1, plan['stages'])
+        eq_(0, plan['joins'])
+        eq_(1, explain.cost(plan))
+
+        # Without statistics, sizes are unknown
+        plan = explain.parse(
+            'Stage: Stage-1\n  Map Reduce\n    TableScan\n      alias: a\n'
+        )
+        eq_(1, plan['stages'])
+        eq_(['a'], plan['tables'])
+        assert_is_none(plan['input_bytes'])
+
+    def test_explain_hql(self):
+        assert_is_none(self.archive.lookup('events').explain_hql())
+        ok_(self.archive.lookup('searches').explain_hql().startswith(
+            'EXPLAIN\nSELECT'
+        ))
+        hql = self.archive.lookup(
+            'insert_overwrite_dynamo_result_stats'
+        ).explain_hql()
+        ok_(hql.startswith('ADD JAR'))
+        ok_(
+            'EXPLAIN\nINSERT OVERWRITE TABLE dynamo.dynamo_result_stats' in hql
+        )
+
+    def test_cache(self):
+        explained = self.archive.explain()
+        eq_(
+            set(['searches', 'impressions', 'result_views',
+                 'stage_dynamo_result_stats',
+                 'insert_overwrite_partitioned_events',
+                 'insert_overwrite_dynamo_result_stats']),
+            set(explained.keys())
+        )
+        eq_(6, len(self.hive.explained))
+
+        # Unchanged queries aren't explained again, even by a new process
+        self.archive.plans = Plans(self.path)
+        eq_({}, self.archive.explain())
+        eq_(6, len(self.hive.explained))
+        eq_(explained, self.archive.explained())
+
+        # Changed queries are
+        self.archive.lookup('searches').settings = {'a': 'b'}
+        eq_(['searches'], self.archive.explain().keys())
+
+    def test_estimates(self):
+        estimates = Estimates(plans=self.archive.plans)
+        table = self.archive.lookup('stage_dynamo_result_stats')
+        eq_(60.0, estimates.estimate(table))
+
+        self.archive.explain(queries=[table])
+        eq_(2 * 30.0 + 5.0, estimates.estimate(table))
+
+        # Past durations are more reliable than plans, and views are created
+        # without running their plans
+        estimates.record('stage_dynamo_result_stats', 12.0)
+        eq_(12.0, estimates.estimate(table))
+
+        searches = self.archive.lookup('searches')
+        self.archive.explain(queries=[searches])
+        eq_(1.0, estimates.estimate(searches))
+
+    def test_materialization(self):
+        archive = Archive('tests', self.hive)
+        archive.plans = Plans()
+        events = archive.add(ExternalTable('atomic', 'events'))
+        searches = archive.add(ViewUntilTable('events', 'searches', events))
+        for name in ('impressions', 'result_views'):
+            archive.add(Table('events', name, searches))
+
+        # Two readers of a simple view don't warrant a table, but two of a
+        # view with an expensive plan do
+        eq_([], archive.optimize()['materialized'])
+        archive.explain(queries=[searches])
+        eq_(['searches'], archive.optimize()['materialized'])
+
+        self.hive.plan = SIMPLE
+        archive.plans = Plans()
+        archive.explain(queries=[searches])
+        eq_([], archive.optimize()['materialized'])
+
+    def test_qubole(self):
+        service = Service(durations=lambda query, rng: 1)
+        hive = Qubole(service.command_class(), service.clock, poll_interval=1)
+        eq_('', hive.explain('EXPLAIN\nSELECT 1\n;'))
+        eq_(1, service.report()['commands'])
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import json
+import sys
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.hive import Hive
+from archive.relation import ExternalTable, View
+from archive.statement import InsertOverwrite
+import tests.databases as databases
+
+
+class TestGraph:
+    def setup(self):
+        self.archive = databases.build(Archive('tests', Hive()))
+
+    def test_text(self):
+        lines = self.archive.graph().split('\n')
+        eq_('Archive: tests', lines[0])
+        eq_('[insert_overwrite_partitioned_events]', lines[3])
+        eq_('\tExternalTable(atomic.events) ...', lines[4])
+        eq_('\tExternalTable(inputs.partitioned_events) ...', lines[5])
+
+        # Query graphs are independent of one another
+        impressions = self.archive.lookup('impressions')
+        eq_(
+            'View(events.impressions)\n'
+            '\tView(events.searches)\n'
+            '\t\tExternalTable(inputs.partitioned_events)',
+            impressions.graph()
+        )
+        eq_(impressions.graph(), impressions.graph())
+
+    def test_blank_line(self):
+        table = self.archive.add(ExternalTable('atomic', 'solo'))
+        insert = self.archive.add(InsertOverwrite('insert_solo', table))
+        eq_('[insert_solo]\n\n\tExternalTable(atomic.solo)', insert.graph())
+
+    def test_dot(self):
+        lines = list(self.archive.graph_lines(format='dot'))
+        eq_('digraph "tests" {', lines[0])
+        eq_('}', lines[-1])
+        ok_('  "searches" -> "impressions";' in lines)
+        ok_((
+            '  "insert_overwrite_partitioned_events" -> '
+            '"partitioned_events" [style=dashed];'
+        ) in lines)
+
+    def test_json(self):
+        graph = json.loads(self.archive.graph(format='json'))
+        eq_('tests', graph['archive'])
+        eq_(
+            [q.name for q in self.archive.order],
+            [q['name'] for q in graph['queries']]
+        )
+
+        # A query's graph includes everything upstream of it
+        insert = self.archive.lookup('insert_overwrite_partitioned_events')
+        graph = json.loads(str.join('\n', self.archive.graph_lines(
+            format='json',
+            queries=[insert]
+        )))
+        eq_(
+            [
+                ('events', 'ExternalTable', [], None),
+                ('partitioned_events', 'ExternalTable', [], None),
+                ('insert_overwrite_partitioned_events', 'InsertOverwrite',
+                 ['events'], 'partitioned_events'),
+            ],
+            [
+                (q['name'], q['type'], q['inputs'], q['writes'])
+                for q in graph['queries']
+            ]
+        )
+
+    @raises(ValueError)
+    def test_unrecognized_format(self):
+        self.archive.graph(format='svg')
+
+    def test_deep(self):
+        archive = Archive('tests', Hive())
+        query = archive.add(ExternalTable('atomic', 'root'))
+        depth = 2 * sys.getrecursionlimit()
+        for i in range(depth):
+            query = archive.add(View('atomic', 'view_%s' % i, query))
+
+        lines = query.graph().split('\n')
+        eq_(depth + 1, len(lines))
+        eq_('\t' * depth + 'ExternalTable(atomic.root)', lines[-1])
+
+        # Every query on its own line, between the opening and closing lines
+        eq_(depth + 3, len(list(archive.graph_lines(format='json'))))
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.executor import Job
+from archive.history import History, percentile
+from archive.hive import Qubole
+from archive.simulation import Service
+from archive.relation import View
+import tests.databases as databases
+
+
+def test_percentile():
+    eq_(None, percentile([], 50))
+    eq_(3, percentile([5, 1, 3], 50))
+    eq_(95, percentile(range(1, 101), 95))
+    eq_(5, percentile([5, 1, 3], 95))
+
+
+class TestHistory:
+    def setup(self):
+        self.history = History()
+
+    def job(self, name, duration, succeeded=True):
+        job = Job(View('db', name), 'SELECT 1;')
+        job.submitted = 100.0
+        job.finished = 100.0 + duration
+        job.succeeded = succeeded
+        return job
+
+    def test_summary_and_regressions(self):
+        for run, durations in enumerate([(10, 2), (12, 2), (11, 2), (30, 2)]):
+            self.history.record(str(run), 'build', [
+                self.job('slow', durations[0]),
+                self.job('fast', durations[1]),
+                self.job('failed', 100, succeeded=False),
+            ])
+
+        summary = self.history.summary()
+        eq_(['slow', 'fast'], [s['name'] for s in summary])
+        eq_(4, summary[0]['runs'])
+        eq_(11, summary[0]['p50'])
+        eq_(30, summary[0]['p95'])
+        eq_([('slow', 11, 30)], self.history.regressions())
+
+        nodes = self.history.nodes('failed')
+        eq_(4, len(nodes))
+        eq_('error', nodes[0]['status'])
+
+    def test_qubole(self):
+        service = Service(durations=lambda query, rng: 10, slots=1)
+        hive = Qubole(service.command_class(), service.clock, poll_interval=4)
+        archive = databases.build(Archive('tests', hive))
+        archive.history = self.history
+        archive.build(run_id='first')
+
+        nodes = self.history.nodes('searches')
+        eq_(1, len(nodes))
+        eq_('first', nodes[0]['run_id'])
+        ok_(nodes[0]['command_id'])
+        eq_('done', nodes[0]['status'])
+        eq_(0, nodes[0]['retries'])
+
+    def test_failure(self):
+        service = Service(failure_rate=1)
+        hive = Qubole(service.command_class(), service.clock, poll_interval=4)
+        archive = databases.build(Archive('tests', hive))
+        archive.history = self.history
+        assert_raises(RuntimeError, archive.build)
+
+        nodes = self.history.nodes('events')
+        eq_('error', nodes[0]['status'])
+        eq_('1', nodes[0]['command_id'])
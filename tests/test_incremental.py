@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.relation import ExternalTable, Table, ViewUntilTable
+from archive.state import BuildState
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class TestIncrementalBuild:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'build.json')
+        self.hive = RecordingHive(delay=0)
+        self.archive = databases.build(Archive('tests', self.hive))
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def built(self):
+        return sorted([
+            q.name for q in self.archive.order
+            if hasattr(q, 'drop_hql') and
+            any([q.drop_hql() in hql for hql in self.hive.started])
+        ])
+
+    def build(self):
+        self.hive.started = []
+        self.archive.build(state=BuildState(self.path))
+
+    def test_keys(self):
+        keys = self.archive.keys()
+        assert_equal(7, len(keys))
+        assert_equal(keys, self.archive.keys())
+
+    def test_unchanged(self):
+        self.build()
+        assert_equal(7, len(self.hive.started))
+        assert_equal(7, len(BuildState(self.path).keys))
+
+        self.build()
+        assert_equal([], self.hive.started)
+
+    def test_changed(self):
+        self.build()
+        self.archive.lookup('searches').settings = {'hive.foo': 'bar'}
+        self.build()
+
+        assert_equal(
+            ['impressions', 'searches', 'stage_dynamo_result_stats'],
+            self.built()
+        )
+        assert_true(all(['DROP ' in hql for hql in self.hive.started]))
+
+    def test_failure(self):
+        self.hive.fail = 'CREATE VIEW IF NOT EXISTS events.impressions'
+        assert_raises(RuntimeError, self.build)
+
+        keys = BuildState(self.path).keys
+        assert_true('searches' in keys)
+        assert_false('impressions' in keys)
+        assert_false('stage_dynamo_result_stats' in keys)
+
+    def test_materialized(self):
+        archive = Archive('tests', self.hive)
+        events = archive.add(ExternalTable('atomic', 'events'))
+        searches = archive.add(ViewUntilTable('events', 'searches', events))
+        for name in ('impressions', 'result_views'):
+            archive.add(Table('events', name, searches))
+
+        def build(cost, **kwargs):
+            searches.cost = cost
+            archive.optimize()
+            self.hive.started = []
+            archive.build(built=BuildState(self.path), **kwargs)
+            return [
+                hql for hql in self.hive.started
+                if 'EXISTS events.searches' in hql
+            ]
+
+        eq_(1, len(build(1)))
+        eq_({'searches': 'VIEW', 'impressions': 'TABLE',
+             'result_views': 'TABLE'}, BuildState(self.path).kinds)
+
+        # The view is dropped before it's materialized, and the reverse
+        started = build(2)
+        eq_(1, len(started))
+        ok_(started[0].startswith('DROP VIEW IF EXISTS events.searches;'))
+        ok_('CREATE TABLE IF NOT EXISTS events.searches' in started[0])
+        eq_('TABLE', BuildState(self.path).kinds['searches'])
+
+        started = build(1)
+        ok_(started[0].startswith('DROP TABLE IF EXISTS events.searches;'))
+        ok_('CREATE VIEW IF NOT EXISTS events.searches' in started[0])
+
+        # Incremental builds drop what was built, not what will be
+        started = build(2, state=BuildState(self.path))
+        ok_(started[0].startswith('DROP VIEW IF EXISTS events.searches;'))
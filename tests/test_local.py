@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+
+import os
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.local import Local, statements
+from archive.relation import ExternalTable, Table, View
+from archive.statement import InsertOverwrite
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_statements():
+    assert_equal(
+        ["SELECT ';' AS a", 'SELECT 2'],
+        statements("SELECT ';' AS a; -- A comment; with a semicolon\nSELECT 2;")
+    )
+
+
+class TestLocal:
+    def setup(self):
+        self.hive = Local(fixtures=FIXTURES)
+        self.archive = Archive('tests', self.hive, templates='local_templates')
+
+        events = self.archive.add(ExternalTable(
+            'atomic',
+            'events',
+            partitioned=True
+        ))
+        searches = self.archive.add(View('events', 'searches', events))
+        daily_searches = self.archive.add(Table(
+            'reports',
+            'daily_searches',
+            searches
+        ))
+        search_counts = self.archive.add(ExternalTable(
+            'reports',
+            'search_counts',
+            partitioned=True
+        ))
+        self.archive.add(InsertOverwrite(
+            'insert_overwrite_search_counts',
+            search_counts,
+            daily_searches,
+            settings={'hive.exec.dynamic.partition.mode': 'nonstrict'}
+        ))
+
+    def query(self, hql):
+        return self.hive.run_sync(hql)
+
+    def test_build(self):
+        self.archive.build()
+
+        assert_equal([(4,)], self.query('SELECT COUNT(*) FROM atomic.events'))
+        assert_equal(
+            [(u'web', u'2014-01-01', u'09', u'shoes')],
+            self.query('SELECT * FROM events.searches ORDER BY hour LIMIT 1')
+        )
+        assert_equal(
+            [(u'ios', u'2014-01-02', 1), (u'web', u'2014-01-01', 2)],
+            self.query(
+                'SELECT * FROM reports.daily_searches ORDER BY app_id'
+            )
+        )
+        assert_equal(
+            [(None,)],
+            self.query("SELECT se_label FROM atomic.events WHERE "
+                       "event = 'page_view'")
+        )
+
+    def test_run(self):
+        self.archive.build(parallelism=2)
+        self.archive.run()
+        self.archive.run()
+
+        assert_equal(
+            [(u'ios', 1, u'2014-01-02'), (u'web', 2, u'2014-01-01')],
+            self.query('SELECT * FROM reports.search_counts ORDER BY app_id')
+        )
+
+    def test_partitions(self):
+        self.archive.build()
+        self.query(
+            "INSERT INTO reports.search_counts VALUES ('web', 7, '2013-12-31')"
+        )
+
+        # Dynamic partitions replace only the days selected
+        self.archive.run()
+        assert_equal(
+            [(u'web', 7, u'2013-12-31'), (u'web', 2, u'2014-01-01'),
+             (u'ios', 1, u'2014-01-02')],
+            self.query('SELECT * FROM reports.search_counts ORDER BY day')
+        )
+
+        # Static partitions replace only their own
+        self.query(
+            "INSERT OVERWRITE TABLE reports.search_counts "
+            "PARTITION (day='2014-01-01') SELECT 'web', 3"
+        )
+        assert_equal(
+            [(u'web', 7, u'2013-12-31'), (u'web', 3, u'2014-01-01'),
+             (u'ios', 1, u'2014-01-02')],
+            self.query('SELECT * FROM reports.search_counts ORDER BY day')
+        )
+
+    def test_mixed_partitions(self):
+        self.query(
+            'CREATE EXTERNAL TABLE reports.hourly (v string) '
+            'PARTITIONED BY (d string, h string)'
+        )
+        self.query(
+            "INSERT OVERWRITE TABLE reports.hourly "
+            "PARTITION (d='2014-01-01', h) SELECT 'a', '07'"
+        )
+        self.query(
+            "INSERT OVERWRITE TABLE reports.hourly "
+            "PARTITION (d='2014-01-01', h) SELECT 'b', '08'"
+        )
+        assert_equal(
+            [(u'a', u'2014-01-01', u'07'), (u'b', u'2014-01-01', u'08')],
+            self.query('SELECT * FROM reports.hourly ORDER BY h')
+        )
+
+    def test_drop(self):
+        self.archive.build()
+        self.query(self.archive.drop_tables_hql())
+        assert_equal(['atomic.events', 'events.searches',
+                      'reports.search_counts'],
+                     sorted(self.hive.relations.keys()))
+
+        self.archive.optimize()
+        self.query(self.archive.drop_all_hql())
+        assert_equal({}, self.hive.relations)
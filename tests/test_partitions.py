@@ -0,0 +1,214 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.partitions import LocalLister, S3Lister, columns, lister
+from archive.relation import ExternalTable
+from archive.state import Watermarks
+from tests.hives import RecordingHive
+
+
+class FakeKey(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeBucket(object):
+    '''
+    Delimited listings of a set of keys, recording each listing's marker.
+    '''
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.markers = []
+
+    def list(self, prefix='', delimiter='', marker=''):
+        self.markers.append(marker)
+        names = []
+        for key in self.keys:
+            if not key.startswith(prefix) or key <= marker:
+                continue
+            rest = key[len(prefix):]
+            if delimiter in rest:
+                rest = rest[:rest.index(delimiter) + 1]
+            if prefix + rest not in names:
+                names.append(prefix + rest)
+        return [FakeKey(name) for name in names]
+
+
+class FakeConnection(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, name, validate=True):
+        return self.bucket
+
+
+class TestPartitions:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'events')
+        self.hive = RecordingHive(delay=0)
+        self.archive = Archive('tests', self.hive)
+        self.events = self.archive.add(ExternalTable(
+            'atomic',
+            'events',
+            partitioned=True,
+            location=self.location
+        ))
+        self.watermarks = Watermarks(
+            os.path.join(self.directory, 'partitions.json')
+        )
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def partition(self, path):
+        os.makedirs(os.path.join(self.location, path))
+
+    def test_columns(self):
+        eq_(['run'], columns(self.events.hql()))
+        eq_(['d', 'h'], columns('PARTITIONED BY (d string, `h` int)'))
+        eq_([], columns('STORED AS TEXTFILE'))
+
+    def test_local_lister(self):
+        for path in ['run=2', 'run=1', 'other', 'run=3/x=1']:
+            self.partition(path)
+        open(os.path.join(self.location, 'run=4'), 'w').close()
+
+        listed = LocalLister().list(self.location, 1)
+        eq_(['run=1', 'run=2', 'run=3'], listed)
+        eq_(['run=3'], LocalLister().list(self.location, 1, 'run=2'))
+        eq_(['run=3/x=1'], lister('file://' + self.location).list(
+            'file://' + self.location, 2
+        ))
+
+    def test_incremental(self):
+        self.partition('run=2014-01-01')
+        self.partition('run=2014-01-02')
+        self.events.recover_partitions(watermarks=self.watermarks)
+        eq_([(
+            'ALTER TABLE `atomic.events` ADD IF NOT EXISTS\n'
+            "PARTITION (run='2014-01-01')\n"
+            "PARTITION (run='2014-01-02');"
+        )], self.hive.finished)
+
+        # The watermark is saved, and only new partitions are added
+        watermarks = Watermarks(self.watermarks.path)
+        eq_('run=2014-01-02', watermarks.get('atomic.events'))
+        eq_('', self.events.recover_partitions_hql(watermarks=watermarks))
+
+        self.partition('run=2014-01-03')
+        self.events.recover_partitions(watermarks=watermarks)
+        eq_(2, len(self.hive.finished))
+        ok_("(run='2014-01-03')" in self.hive.finished[-1])
+        ok_('2014-01-02' not in self.hive.finished[-1])
+
+        # Nothing new, nothing run
+        self.events.recover_partitions(watermarks=watermarks)
+        eq_(2, len(self.hive.finished))
+
+    def test_failure(self):
+        self.partition('run=1')
+        self.hive.fail = 'ADD IF NOT EXISTS'
+        assert_raises(
+            RuntimeError,
+            self.events.recover_partitions,
+            watermarks=self.watermarks
+        )
+        assert_is_none(self.watermarks.get('atomic.events'))
+
+    def test_batches(self):
+        for run in range(5):
+            self.partition('run=%s' % run)
+        statements = self.events.add_partitions_hql(
+            self.events.new_partitions(),
+            batch_size=2
+        )
+        eq_(3, len(statements))
+        eq_(
+            [2, 2, 1],
+            [s.count('PARTITION (') for s in statements]
+        )
+
+        hql = self.archive.recover_all_hql(
+            watermarks=self.watermarks,
+            batch_size=2
+        )
+        eq_(3, hql.count('ADD IF NOT EXISTS'))
+
+    def test_quoting(self):
+        self.partition("run=it%27s")
+        eq_(
+            ["ALTER TABLE `atomic.events` ADD IF NOT EXISTS\n"
+             "PARTITION (run='it\\'s');"],
+            self.events.add_partitions_hql(self.events.new_partitions())
+        )
+
+    def test_recover_all(self):
+        self.archive.add(ExternalTable(
+            'inputs',
+            'partitioned_events',
+            partitioned=True
+        ))
+        self.hive.delay = 0.05
+        self.partition('run=1')
+
+        recovered = self.archive.recover_all(
+            parallelism=2,
+            watermarks=self.watermarks
+        )
+        eq_(2, self.hive.max_running)
+        eq_(
+            ['atomic.events', 'inputs.partitioned_events'],
+            [t['table'] for t in recovered]
+        )
+        ok_(all([t['duration'] >= 0.05 for t in recovered]))
+        ok_(not any([t['error'] for t in recovered]))
+        eq_('run=1', self.watermarks.get('atomic.events'))
+
+        # Failures are reported per table, without stopping the others
+        self.partition('run=2')
+        self.hive.fail = 'RECOVER PARTITIONS'
+        recovered = self.archive.recover_all(watermarks=self.watermarks)
+        ok_(recovered[0]['error'] is None)
+        ok_(isinstance(recovered[1]['error'], RuntimeError))
+        eq_('run=2', self.watermarks.get('atomic.events'))
+
+    def test_fallback(self):
+        recover = 'ALTER TABLE `atomic.events` RECOVER PARTITIONS;'
+        eq_(recover, self.events.recover_partitions_hql())
+
+        self.events.location = None
+        eq_(
+            recover,
+            self.events.recover_partitions_hql(watermarks=self.watermarks)
+        )
+        eq_(recover, self.archive.recover_all_hql(watermarks=self.watermarks))
+
+    def test_s3_lister(self):
+        bucket = FakeBucket([
+            'events/d=2014-01-01/h=00/part-0',
+            'events/d=2014-01-01/h=01/part-0',
+            'events/d=2014-01-02/h=00/part-0',
+            'events/d=2014-01-02/h=01/part-0',
+            'events/_SUCCESS',
+        ])
+        s3 = S3Lister(FakeConnection(bucket))
+        eq_(4, len(s3.list('s3://bucket/events', 2)))
+
+        bucket.markers = []
+        eq_(
+            ['d=2014-01-02/h=00', 'd=2014-01-02/h=01'],
+            s3.list('s3://bucket/events', 2, 'd=2014-01-01/h=01')
+        )
+
+        # Listing starts from the watermark at each level
+        eq_('events/d=2014-01-01', bucket.markers[0])
+        eq_('events/d=2014-01-01/h=01', bucket.markers[1])
+        eq_('', bucket.markers[2])
+        ok_(isinstance(lister('s3n://bucket/events'), S3Lister))
@@ -0,0 +1,213 @@
+from __future__ import absolute_import
+
+import threading
+
+from nose.tools import *
+from requests.exceptions import ConnectionError
+
+from archive.hive import Qubole, QDS
+from archive.poller import Poller
+from archive.simulation import Service, VirtualClock
+
+
+class FakeCommand(object):
+    '''
+    Stand-in for HiveCommand whose commands finish after a given number of
+    finds, or raise ConnectionError if unreachable.
+    '''
+    def __init__(self, id, status='waiting'):
+        self.id = id
+        self.status = status
+
+    @staticmethod
+    def is_done(status):
+        return status in ('done', 'error', 'cancelled')
+
+    @classmethod
+    def reset(cls, remaining, unreachable=False):
+        cls.remaining = dict(remaining)
+        cls.unreachable = unreachable
+        cls.finds = 0
+
+    @classmethod
+    def find(cls, id):
+        cls.finds += 1
+        if cls.unreachable:
+            raise ConnectionError('unreachable')
+
+        cls.remaining[id] -= 1
+        if cls.remaining[id] <= 0:
+            return cls(id, 'done')
+        return cls(id, 'running')
+
+
+def test_qds_poll_interval():
+    # Qubole falls back to QDS's configured interval
+    configured = QDS.poll_interval
+    QDS.poll_interval = 5
+    try:
+        eq_(5, Qubole().poller.interval)
+        eq_(2, Qubole(poll_interval=2).poller.interval)
+    finally:
+        QDS.poll_interval = configured
+
+
+class TestPoller:
+    def setup(self):
+        self.poller = Poller(FakeCommand, interval=0.001, outage=0.05)
+
+    def wait_all(self, ids):
+        results = {}
+
+        def wait(command_id):
+            try:
+                results[command_id] = self.poller.wait(FakeCommand(command_id))
+            except ConnectionError as error:
+                results[command_id] = error
+
+        threads = [threading.Thread(target=wait, args=(i,)) for i in ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_done(self):
+        FakeCommand.reset({})
+        command = FakeCommand(1, 'done')
+        assert_equal(command, self.poller.wait(command))
+        assert_equal(0, FakeCommand.finds)
+
+    def test_multiplexed(self):
+        FakeCommand.reset(dict([(i, i) for i in range(1, 6)]))
+        results = self.wait_all(range(1, 6))
+
+        assert_equal(5, len(results))
+        assert_true(all([c.status == 'done' for c in results.values()]))
+        # Each command is found once per tick until done, and no more
+        assert_equal(sum(range(1, 6)), FakeCommand.finds)
+        assert_equal({}, self.poller.outstanding)
+
+    def test_started(self):
+        FakeCommand.reset({1: 2, 2: 1})
+        self.wait_all([1, 2])
+
+        # Only commands seen running have a start; the others' durations
+        # run from submission
+        ok_(self.poller.observed[1]['started'] is not None)
+        eq_(None, self.poller.observed[2]['started'])
+
+    def test_retries_exhausted(self):
+        FakeCommand.reset({1: 1, 2: 1}, unreachable=True)
+        results = self.wait_all([1, 2])
+
+        assert_true(isinstance(results[1], ConnectionError))
+        assert_true(isinstance(results[2], ConnectionError))
+
+
+class TestAdaptivePolling:
+    def setup(self):
+        self.clock = VirtualClock()
+
+    def outage(self, start, end, finished):
+        clock = self.clock
+
+        class Command(FakeCommand):
+            @classmethod
+            def find(cls, id):
+                if start <= clock.time() < end:
+                    raise ConnectionError('unreachable')
+                return cls(id, 'done' if clock.time() >= finished else
+                           'running')
+
+        return Command
+
+    def wait_for(self, poller, service, durations):
+        command_class = service.command_class()
+        for duration, expected in durations:
+            service.durations = lambda query, rng: duration
+            command = command_class.create(query='SELECT %s;' % duration)
+            poller.wait(command, expected)
+        return poller.metrics()
+
+    def test_backoff(self):
+        service = Service(self.clock)
+        poller = Poller(service.command_class(), 1, clock=self.clock)
+        metrics = self.wait_for(poller, service, [(0.5, None)])
+
+        # Short commands are noticed within the initial interval
+        eq_(1, metrics['api_calls'])
+        ok_(service.report()['mean_detection_lag'] <= 1)
+
+        # Long commands back off to a cap set by their expected duration
+        service = Service(self.clock)
+        poller = Poller(service.command_class(), 1, clock=self.clock)
+        metrics = self.wait_for(poller, service, [(3600, 3600)])
+        ok_(metrics['api_calls'] < 50)
+        ok_(metrics['mean_detection_lag'] <= 360)
+
+        service = Service(self.clock)
+        poller = Poller(service.command_class(), 1, clock=self.clock)
+        metrics = self.wait_for(poller, service, [(3600, 60)])
+        ok_(metrics['mean_detection_lag'] <= 6)
+
+    def test_reconnect(self):
+        FakeCommand.reset({1: 3})
+        poller = Poller(FakeCommand, interval=0.001, outage=0.05)
+
+        # A failed poll backs off that command alone, and polling resumes
+        find = FakeCommand.find.im_func
+        failures = [ConnectionError('unreachable')]
+
+        def flaky(cls, id):
+            if failures:
+                raise failures.pop()
+            return find(cls, id)
+
+        FakeCommand.find = classmethod(flaky)
+        try:
+            eq_('done', poller.wait(FakeCommand(1)).status)
+        finally:
+            FakeCommand.find = classmethod(find)
+
+        eq_(1, poller.observed[1]['retries'])
+        eq_(4, poller.metrics()['api_calls'])
+
+    def test_error(self):
+        FakeCommand.reset({1: 1, 2: 1})
+        poller = Poller(FakeCommand, interval=0.001, outage=0.05)
+
+        # Other errors aren't retried, but reach the caller
+        find = FakeCommand.find.im_func
+
+        def broken(cls, id):
+            raise ValueError('No JSON object could be decoded')
+
+        FakeCommand.find = classmethod(broken)
+        try:
+            assert_raises(ValueError, poller.wait, FakeCommand(1))
+        finally:
+            FakeCommand.find = classmethod(find)
+
+        # And polling carries on for later callers
+        eq_('done', poller.wait(FakeCommand(2)).status)
+        eq_({}, poller.outstanding)
+
+    def test_outage(self):
+        # Long commands outlast outages shorter than the poller's
+        command_class = self.outage(5, 35, 3600)
+        poller = Poller(command_class, 1, clock=self.clock)
+        eq_('done', poller.wait(command_class(1), 3600).status)
+        ok_(poller.observed[1]['retries'] > 0)
+
+        # But not longer ones
+        self.clock = VirtualClock()
+        command_class = self.outage(5, 1000, 3600)
+        poller = Poller(command_class, 1, outage=60, clock=self.clock)
+        assert_raises(
+            ConnectionError,
+            poller.wait,
+            command_class(1),
+            3600
+        )
+        ok_(60 <= self.clock.time() < 100)
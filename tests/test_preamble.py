@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+
+from nose.tools import *
+
+from archive import preamble
+
+JAR = 'ADD JAR s3://bucket/dynamodb.jar;'
+FUNCTION = "CREATE TEMPORARY FUNCTION parse AS 'com.example.Parse';"
+
+
+def test_split():
+    resources, functions, settings, body = preamble.split(
+        '%s\n%s\nSET hive.exec.reducers.max=1;\nSELECT 1\n;' % (JAR, FUNCTION)
+    )
+    assert_equal([JAR], resources)
+    assert_equal([FUNCTION], functions)
+    assert_equal(['SET hive.exec.reducers.max=1;'], settings)
+    assert_equal('SELECT 1\n;', body)
+
+
+def test_script():
+    script = preamble.script([
+        '%s\n\n\nCREATE VIEW a AS SELECT 1;' % JAR,
+        '%s\n%s\nSET x=1;\nCREATE VIEW b AS SELECT 2;' % (JAR, FUNCTION),
+        '%s\nCREATE VIEW c AS SELECT 3;' % JAR,
+    ])
+
+    assert_equal(1, script.count(JAR))
+    assert_equal(1, script.count(FUNCTION))
+    assert_true(script.startswith('%s\n%s' % (JAR, FUNCTION)))
+    assert_true(
+        'SET x=1;\nCREATE VIEW b AS SELECT 2;\nRESET;\n\nCREATE VIEW c' in
+        script
+    )
+    assert_true(script.index('VIEW a') < script.index('VIEW b'))
+
+
+def test_script_without_preamble():
+    assert_equal(
+        'CREATE VIEW a AS SELECT 1;\n\nCREATE VIEW b AS SELECT 2;',
+        preamble.script([
+            'CREATE VIEW a AS SELECT 1;',
+            'CREATE VIEW b AS SELECT 2;',
+        ])
+    )
@@ -3,7 +3,9 @@ from __future__ import absolute_import
 from nose.tools import *
 from jinja2 import TemplateNotFound
 
-from archive.relation import Table
+from archive.archive import Archive
+from archive.hive import Hive
+from archive.relation import ExternalTable, Table, View, ViewUntilTable
 import tests.archive
 
 
@@ -85,3 +87,65 @@ class TestTable:
         assert_equal(3, len([q for q in build_queries if 'CREATE VIEW' in q]))
         assert_true('CREATE EXTERNAL TABLE' in build_queries[0])
         assert_true('CREATE TABLE' in build_queries[-1])
+
+
+class TestViewUntilTable:
+    def setup(self):
+        self.archive = Archive('tests', Hive())
+        self.events = self.archive.add(ExternalTable('atomic', 'events'))
+
+    def view(self, name, *inputs, **kwargs):
+        return self.archive.add(
+            ViewUntilTable('events', name, *inputs, **kwargs)
+        )
+
+    def consumers(self, view, count):
+        for i in range(count):
+            self.archive.add(Table('events', '%s_%s' % (view.name, i), view))
+
+    def test_unshared(self):
+        view = self.view('searches', self.events)
+        self.consumers(view, 1)
+        eq_([], self.archive.optimize()['materialized'])
+        eq_('VIEW', view.view_or_table)
+        ok_('CREATE VIEW' in view.create_hql())
+
+    def test_shared(self):
+        view = self.view('searches', self.events)
+        self.consumers(view, 3)
+        eq_(['searches'], self.archive.optimize()['materialized'])
+        eq_('TABLE', view.view_or_table)
+        eq_('Table(events.searches)', str(view))
+        ok_('DROP TABLE IF EXISTS events.searches;' in
+            self.archive.drop_tables_hql())
+
+    def test_depth(self):
+        # Two consumers of a simple view fall short of the threshold, but
+        # stacked atop another view, the work saved is doubled
+        shallow = self.view('shallow', self.events)
+        self.consumers(shallow, 2)
+        base = self.archive.add(View('events', 'base', self.events))
+        deep = self.view('deep', base)
+        self.consumers(deep, 2)
+
+        eq_(['deep'], self.archive.optimize(threshold=2)['materialized'])
+        eq_('VIEW', shallow.view_or_table)
+
+    def test_materialized_inputs(self):
+        lower = self.view('lower', self.events, cost=10)
+        self.consumers(lower, 2)
+        upper = self.view('upper', lower)
+        self.consumers(upper, 2)
+
+        # Atop a materialized view, upper is only as deep as itself
+        eq_(['lower'], self.archive.optimize(threshold=2)['materialized'])
+
+    def test_hints(self):
+        cheap = self.view('cheap', self.events, cost=0.1)
+        self.consumers(cheap, 5)
+        forced = self.view('forced', self.events, materialize=True)
+        never = self.view('never', self.events, materialize=False)
+        self.consumers(never, 5)
+
+        eq_(['forced'], self.archive.optimize()['materialized'])
+        eq_('VIEW', never.view_or_table)
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive.archive import Archive
+from archive.state import Checkpoint
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class TestResume:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'runs', 'first.json')
+        self.hive = RecordingHive(delay=0)
+        self.archive = databases.build(Archive('tests', self.hive))
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def checkpoint(self, command='build'):
+        return Checkpoint(self.path, 'first', command)
+
+    def test_resume_build(self):
+        self.hive.fail = 'CREATE VIEW IF NOT EXISTS events.impressions'
+        assert_raises(
+            RuntimeError,
+            self.archive.build,
+            checkpoint=self.checkpoint()
+        )
+        eq_(
+            set(['events', 'partitioned_events', 'searches']),
+            set(self.checkpoint().completed.keys())
+        )
+
+        self.hive.fail = None
+        del self.hive.started[:]
+        self.archive.build(checkpoint=self.checkpoint())
+        eq_(4, len(self.hive.started))
+        ok_('events.impressions' in self.hive.started[0])
+        eq_(7, len(self.checkpoint().completed))
+
+    def test_changed_hql_reruns(self):
+        self.archive.build(checkpoint=self.checkpoint())
+
+        checkpoint = self.checkpoint()
+        checkpoint.completed['searches'] = 'stale'
+        checkpoint.save()
+
+        eq_(
+            [self.archive.lookup('searches').create_hql()],
+            list(self.archive.build_hql(checkpoint=self.checkpoint()))
+        )
+
+    def test_resume_run(self):
+        self.hive.fail = 'INSERT OVERWRITE TABLE dynamo.dynamo_result_stats'
+        assert_raises(
+            RuntimeError,
+            self.archive.run,
+            checkpoint=self.checkpoint('run')
+        )
+
+        self.hive.fail = None
+        del self.hive.started[:]
+        self.archive.run(checkpoint=self.checkpoint('run'))
+        eq_(1, len(self.hive.started))
+
+    def test_appended(self):
+        self.archive.build(checkpoint=self.checkpoint())
+
+        # A line per query, appended as each completes
+        with open(self.path) as f:
+            lines = f.readlines()
+        eq_(8, len(lines))
+
+        # A line cut off as it was appended is ignored
+        with open(self.path, 'w') as f:
+            f.writelines(lines[:-1] + [lines[-1][:10]])
+        eq_(6, len(self.checkpoint().completed))
+
+    @raises(ValueError)
+    def test_command_mismatch(self):
+        self.archive.build(checkpoint=self.checkpoint())
+        self.checkpoint('run')
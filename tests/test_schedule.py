@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+
+from jinja2 import DictLoader, Environment
+from nose.tools import *
+
+from archive import schedule
+from archive.archive import Archive
+from archive.executor import Executor, plan
+from archive.relation import ExternalTable, Table, View
+from archive.state import Estimates
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class DictArchive(Archive):
+    def _environment(self):
+        return Environment(loader=DictLoader({
+            'root.sql': '(id STRING)',
+            'short.sql': "SELECT * FROM {{ inputs['root'] }}",
+            'long.sql': "SELECT * FROM {{ inputs['root'] }}",
+            'after.sql': "SELECT * FROM {{ inputs['long'] }}",
+        }))
+
+
+class TestSchedule:
+    def setup(self):
+        self.hive = RecordingHive(delay=0)
+        self.archive = databases.build(Archive('tests', self.hive))
+        self.estimates = Estimates(default=10.0, metadata_only=1.0)
+
+    def test_remaining(self):
+        lengths = schedule.remaining(self.archive, self.estimates)
+        eq_(1.0, lengths['dynamo_result_stats'])
+        eq_(10.0, lengths['insert_overwrite_dynamo_result_stats'])
+        eq_(
+            lengths['stage_dynamo_result_stats'] + 1.0,
+            lengths['impressions']
+        )
+
+        # Writers lengthen the path of the tables they write
+        ok_(lengths['insert_overwrite_partitioned_events'] <
+            lengths['events'])
+
+    def test_partitioned(self):
+        # Only external tables without partitions to recover are quick
+        eq_(10.0, self.estimates.estimate(self.archive.lookup('events')))
+        eq_(1.0, self.estimates.estimate(
+            self.archive.lookup('dynamo_result_stats')
+        ))
+
+    def test_critical_path(self):
+        self.archive.lookup('result_views').duration = 100.0
+        queries, duration = schedule.critical_path(
+            self.archive,
+            self.estimates
+        )
+        eq_(
+            [
+                'events',
+                'insert_overwrite_partitioned_events',
+                'result_views',
+                'stage_dynamo_result_stats',
+                'insert_overwrite_dynamo_result_stats',
+            ],
+            queries
+        )
+        # Recovering events' partitions isn't a quick metadata change
+        eq_(10.0 + 10.0 + 100.0 + 10.0 + 10.0, duration)
+
+    def test_rank(self):
+        # Later Jobs are planned while the first runs, so they are all ready
+        # together when it finishes
+        self.hive.delay = 0.1
+        archive = DictArchive('tests', self.hive)
+        root = archive.add(ExternalTable('db', 'root'))
+        archive.add(View('db', 'short', root))
+        long_table = archive.add(Table('db', 'long', root))
+        archive.add(Table('db', 'after', long_table))
+
+        rank = schedule.rank(archive, self.estimates)
+        Executor(self.hive, rank=rank).run_all_sync(
+            plan(archive._create_all_steps())
+        )
+        started = [
+            re.search(r'EXISTS (db\.\w+)', hql).group(1)
+            for hql in self.hive.started
+        ]
+        eq_(['db.root', 'db.long', 'db.after', 'db.short'], started)
+
+        # Explicit priority comes first
+        archive.lookup('short').priority = 1
+        del self.hive.started[:]
+        rank = schedule.rank(archive, self.estimates)
+        Executor(self.hive, rank=rank).run_all_sync(
+            plan(archive._create_all_steps())
+        )
+        ok_('db.short' in self.hive.started[1])
+
+    def test_parallel_build_records_durations(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'durations.json')
+            self.archive.estimates = Estimates(path)
+            self.archive.build(parallelism=2)
+
+            durations = Estimates(path).durations
+            eq_(7, len(durations))
+            ok_(all([d >= 0 for d in durations.values()]))
+        finally:
+            shutil.rmtree(directory)
+
+
+def test_estimates():
+    estimates = Estimates(default=10.0)
+    query = View('db', 'view')
+    eq_(1.0, estimates.estimate(query))
+
+    estimates.record('view', 4.0)
+    estimates.record('view', 8.0)
+    eq_(6.0, estimates.estimate(query))
+
+    query.duration = 2.0
+    eq_(2.0, estimates.estimate(query))
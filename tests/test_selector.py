@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+
+from nose.tools import *
+
+from archive import selector
+from archive.archive import Archive
+from tests.hives import RecordingHive
+import tests.databases as databases
+
+
+class TestSelector:
+    def setup(self):
+        self.hive = RecordingHive(delay=0)
+        self.archive = databases.build(Archive('tests', self.hive))
+
+    def select(self, expression):
+        return [q.name for q in selector.select(self.archive, expression)]
+
+    def test_names(self):
+        eq_(['searches'], self.select('searches'))
+        eq_(['searches'], self.select('events.searches'))
+        eq_(['events', 'searches'], self.select('searches, atomic.events'))
+
+    @raises(ValueError)
+    def test_unmatched(self):
+        self.select('+missing')
+
+    def test_upstream(self):
+        eq_(
+            ['events', 'partitioned_events',
+             'insert_overwrite_partitioned_events', 'searches'],
+            self.select('+searches')
+        )
+
+    def test_downstream(self):
+        eq_(
+            ['searches', 'impressions', 'stage_dynamo_result_stats',
+             'dynamo_result_stats', 'insert_overwrite_dynamo_result_stats'],
+            self.select('searches+')
+        )
+
+        # Through the tables statements write
+        eq_(
+            ['events', 'partitioned_events',
+             'insert_overwrite_partitioned_events', 'searches',
+             'impressions', 'result_views', 'stage_dynamo_result_stats',
+             'dynamo_result_stats', 'insert_overwrite_dynamo_result_stats'],
+            self.select('events+')
+        )
+
+    def test_globs_and_exclusions(self):
+        eq_(
+            ['searches', 'impressions', 'result_views'],
+            self.select('events.*')
+        )
+        eq_(['searches', 'result_views'], self.select('events.*,-impressions'))
+        eq_(
+            ['events', 'partitioned_events',
+             'insert_overwrite_partitioned_events'],
+            self.select('*,-searches+,-result_views+')
+        )
+        assert_raises(ValueError, self.select, '-searches+')
+        eq_(
+            ['insert_overwrite_partitioned_events',
+             'insert_overwrite_dynamo_result_stats'],
+            self.select('insert_*')
+        )
+
+    def test_build(self):
+        queries = selector.select(self.archive, 'searches+')
+        self.archive.build(queries=queries)
+
+        # Only the selected relations, creating the databases they need
+        eq_(4, len(self.hive.started))
+        ok_(self.hive.started[0].startswith(
+            'CREATE DATABASE IF NOT EXISTS events;\n'
+            'CREATE VIEW IF NOT EXISTS events.searches'
+        ))
+        ok_('CREATE VIEW IF NOT EXISTS events.impressions' in
+            self.hive.started[1])
+        ok_(self.hive.started[2].startswith(
+            'CREATE DATABASE IF NOT EXISTS dynamo;'
+        ))
+        ok_('CREATE EXTERNAL TABLE IF NOT EXISTS dynamo.dynamo_result_stats'
+            in self.hive.started[3])
+
+    def test_run(self):
+        queries = selector.select(self.archive, 'searches+')
+        eq_(1, len(self.archive.run(queries=queries)))
+        ok_('dynamo.dynamo_result_stats' in self.hive.started[0])
+
+        eq_([], self.archive.run(queries=[]))
+
+    def test_drop(self):
+        queries = selector.select(self.archive, 'partitioned_events+')
+        hql = self.archive.drop_hql(queries=queries).split('\n')
+        eq_(6, len(hql))
+        eq_('DROP TABLE IF EXISTS dynamo.dynamo_result_stats;', hql[0])
+        eq_('DROP TABLE IF EXISTS inputs.partitioned_events;', hql[-1])
+
+    def test_graph(self):
+        queries = selector.select(self.archive, 'impressions+')
+        eq_(
+            'Archive: tests\n'
+            'View(events.impressions)\n'
+            '\tView(events.searches)\n'
+            '\t\tExternalTable(inputs.partitioned_events)\n'
+            'Table(dynamo.stage_dynamo_result_stats)\n'
+            '\tView(events.impressions) ...\n'
+            '\tView(events.result_views)\n'
+            '\t\tExternalTable(inputs.partitioned_events) ...\n'
+            'ExternalTable(dynamo.dynamo_result_stats)\n'
+            '[insert_overwrite_dynamo_result_stats]\n'
+            '\tTable(dynamo.stage_dynamo_result_stats) ...\n'
+            '\tExternalTable(dynamo.dynamo_result_stats) ...',
+            self.archive.graph(selection=queries)
+        )
+
+        dot = list(self.archive.graph_lines(format='dot', selection=queries))
+        ok_('  "impressions" -> "stage_dynamo_result_stats";' in dot)
+        ok_(not any(['"searches"' in line for line in dot]))
@@ -0,0 +1,107 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+from requests.exceptions import ConnectionError
+
+from archive.hive import Qubole
+from archive.simulation import Recorder, Service, VirtualClock
+
+
+def constant(seconds):
+    return lambda query, rng: seconds
+
+
+class TestSimulation:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def qubole(self, service):
+        return Qubole(
+            service.command_class(),
+            service.clock,
+            poll_interval=5
+        )
+
+    def test_run_sync(self):
+        service = Service(durations=constant(12))
+        self.qubole(service).run_sync('SELECT 1;')
+
+        report = service.report()
+        eq_(1, report['commands'])
+        eq_(12, report['makespan'])
+        eq_(0.5, report['mean_detection_lag'])
+        # One create and two finds, at 5 and 12.5 seconds
+        eq_(3, report['api_calls'])
+
+    def test_slots(self):
+        service = Service(durations=constant(10), slots=1)
+        hive = self.qubole(service)
+        hive.run_sync('SELECT 1;')
+        hive.run_sync('SELECT 2;')
+        eq_(0, service.report()['mean_queue_wait'])
+
+        # Submitted together, the second waits for the first
+        service = Service(durations=constant(10), slots=1)
+        service.create(query='SELECT 1;')
+        service.create(query='SELECT 2;')
+        report = service.report()
+        eq_(5, report['mean_queue_wait'])
+        eq_(20, report['makespan'])
+
+    @raises(RuntimeError)
+    def test_failure(self):
+        self.qubole(Service(failure_rate=1)).run_sync('SELECT 1;')
+
+    @raises(ConnectionError)
+    def test_connection_error(self):
+        self.qubole(Service(connection_error_rate=1)).run_sync('SELECT 1;')
+
+    def test_record_and_replay(self):
+        clock = VirtualClock()
+        durations = {'SELECT 1;': 30, 'SELECT 2;': 7}
+        original = Service(
+            clock,
+            durations=lambda query, rng: durations[query]
+        )
+        recorder = Recorder(original.command_class(), clock)
+        Qubole(recorder.command_class(), clock, poll_interval=1).run_sync(
+            'SELECT 1;'
+        )
+        Qubole(recorder.command_class(), clock, poll_interval=1).run_sync(
+            'SELECT 2;'
+        )
+
+        path = os.path.join(self.directory, 'recording.json')
+        recorder.save(path)
+        with open(path) as f:
+            recorded = json.load(f)['commands']
+        eq_(2, len(recorded))
+
+        # Durations are as observed by polling, so at least those simulated
+        durations = [r['finished'] - r['started'] for r in recorded]
+        ok_(durations[0] >= 30)
+        ok_(durations[1] >= 7)
+
+        # Replayed out of order, commands match by query
+        replay = Service.replay(path)
+        hive = self.qubole(replay)
+        hive.run_sync('SELECT 2;')
+        hive.run_sync('SELECT 1;')
+        commands = replay.commands.values()
+        eq_(
+            [durations[1], durations[0]],
+            [c.finished - c.started for c in commands]
+        )
+
+        # Unrecorded queries take recorded commands in order
+        replay = Service.replay(path)
+        replay.create(query='SELECT 3;')
+        eq_(durations[0], replay.commands.values()[0].finished)
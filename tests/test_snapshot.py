@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive import snapshot
+from archive.archive import Archive
+from archive.hive import Hive
+import tests.databases as databases
+
+
+class TestSnapshot:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive.snapshot')
+        self.source = os.path.join(self.directory, 'source.sql')
+        with open(self.source, 'w') as f:
+            f.write('SELECT 1')
+        os.utime(self.source, (1000000000, 1000000000))
+
+        self.archive = databases.build(Archive('tests', Hive()))
+        self.archive.optimize()
+        snapshot.save(
+            self.archive,
+            self.path,
+            'tests.archive',
+            sources=[self.source]
+        )
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        loaded = snapshot.load(self.path)
+
+        assert_equal(self.archive.show()[0], loaded.show()[0])
+        assert_equal(self.archive.graph(), loaded.graph())
+        assert_equal(self.archive.stats, loaded.stats)
+        assert_equal(
+            list(self.archive.build_hql()),
+            list(loaded.build_hql())
+        )
+        assert_equal(list(self.archive.run_hql()), list(loaded.run_hql()))
+
+    def test_rendered(self):
+        loaded = snapshot.load(self.path)
+        misses = loaded.render_cache.misses
+        list(loaded.build_hql())
+        assert_equal(misses, loaded.render_cache.misses)
+
+    def test_fresh(self):
+        assert_true(snapshot.fresh(self.path, 'tests.archive'))
+        assert_false(snapshot.fresh(self.path, 'tests.other'))
+
+        modified = os.path.getmtime(self.path) + 1
+        os.utime(self.source, (modified, modified))
+        assert_false(snapshot.fresh(self.path, 'tests.archive'))
+
+    def test_missing(self):
+        assert_false(snapshot.fresh(self.source + '.missing', 'tests.archive'))
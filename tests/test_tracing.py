@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from archive import tracing
+from archive.archive import Archive
+from archive.hive import Qubole
+from archive.simulation import Service
+
+import tests.databases as databases
+from tests.hives import RecordingHive
+
+
+class TestTracing:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.tracer = tracing.start()
+
+    def teardown(self):
+        tracing.stop()
+        shutil.rmtree(self.directory)
+
+    def spans(self, name):
+        return [e for e in self.tracer.events if e['name'] == name]
+
+    def test_disabled(self):
+        tracing.stop()
+        with tracing.span('ignored', query='q') as args:
+            args['command'] = 1
+        eq_([], self.tracer.events)
+
+    def test_nested_spans(self):
+        with tracing.span('outer'):
+            with tracing.span('inner', query='q') as args:
+                args['command'] = 1
+
+        inner, outer = self.tracer.events
+        eq_('inner', inner['name'])
+        eq_({'query': 'q', 'command': 1}, inner['args'])
+        ok_(outer['ts'] <= inner['ts'])
+        ok_(inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'])
+
+        path = os.path.join(self.directory, 'trace.json')
+        self.tracer.save(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        eq_(
+            ['process_name', 'process_name', 'thread_name', 'inner', 'outer'],
+            [e['name'] for e in events]
+        )
+
+    def test_build(self):
+        archive = databases.build(Archive('tests', RecordingHive(delay=0)))
+        archive.build(parallelism=2)
+
+        relations = [
+            q.name for q in archive.order if hasattr(q, 'qualified_name')
+        ]
+        eq_(len(relations), len(self.spans('job')))
+        eq_(
+            set(relations),
+            set([e['args']['query'] for e in self.spans('render')])
+        )
+
+    def test_qubole(self):
+        service = Service(durations=lambda query, rng: 10, slots=1)
+        hive = Qubole(service.command_class(), service.clock, poll_interval=4)
+        hive.run_sync('SELECT 1;')
+
+        eq_(1, len(self.spans('submit')))
+        eq_(1, self.spans('wait')[0]['args']['command'])
+        eq_(1, len(self.spans('queued')))
+        eq_('done', self.spans('executing')[0]['args']['status'])
+        ok_(self.spans('poll'))